@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+跨批次趋势分析
+
+把 test_history (以及 data/archive 下已归档的批次) 以列式快照的形式加载到内存
+(numpy 数组: case_id / run_at / outcome / duration / similarity), 所有统计都在快照上做向量化计算,
+不再逐行经过 ORM。快照按 test_history 最大 id 增量追加; 以下情况整体重建:
+- 归档发生变化 (归档行已从数据库删除)
+- history_version 变化: 重新校验回写结果 / 清空用例时在同一事务内递增 (见 mark_history_changed)
+- 已加载范围内的行数或最大 id 与数据库不一致 (其他途径删除了行, 或 SQLite 在删空后复用了 id)
+"""
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, or_, select
+
+from .models import SessionLocal, SystemConfig, TestBatch, TestCase, TestHistory, SqlText, history_actual_sql
+from .config_store import HISTORY_VERSION_KEY, bump_version
+from .archive import ARCHIVE_DIR, _require_pyarrow
+
+logger = logging.getLogger("Backend.Analytics")
+
+# outcome 编码
+OUTCOME_PASS = 0
+OUTCOME_FAIL = 1
+OUTCOME_ERROR = 2
+
+# 从数据库分块读取的行数
+LOAD_CHUNK_SIZE = 50000
+
+_OUTCOME_EXPR = case(
+    (TestHistory.result == "PASS", OUTCOME_PASS),
+    (TestHistory.sql_hash.is_(None) & or_(TestHistory.actual_sql.is_(None), TestHistory.actual_sql == ""),
+     OUTCOME_ERROR),
+    (history_actual_sql.like("Error%"), OUTCOME_ERROR),
+    else_=OUTCOME_FAIL
+)
+
+
+def mark_history_changed(db):
+    """test_history 已有的行被改写或删除时调用 (在同一事务内, 由调用方提交), 快照下次读取时重建"""
+    bump_version(db, HISTORY_VERSION_KEY, "历史记录版本号, 原地改写 / 删除历史行时递增")
+
+
+class HistorySnapshot:
+    """test_history 的列式内存快照"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = self._empty()
+        self._last_id = 0
+        self._db_rows = 0
+        self._archive_key = None
+        self._history_version = None
+
+    @staticmethod
+    def _empty() -> pd.DataFrame:
+        return pd.DataFrame({
+            "case_id": np.array([], dtype=np.int64),
+            "run_at": np.array([], dtype="datetime64[ns]"),
+            "outcome": np.array([], dtype=np.int8),
+            "duration": np.array([], dtype=np.float32),
+            "similarity": np.array([], dtype=np.float32),
+        })
+
+    @staticmethod
+    def _load_db_rows(db, after_id: int):
+        """读取 id > after_id 的历史行, 返回 (DataFrame, 最大 id)"""
+        frames = []
+        last_id = after_id
+        while True:
+            rows = db.execute(
+                select(
+                    TestHistory.id, TestHistory.case_id, TestHistory.run_at,
+                    _OUTCOME_EXPR, TestHistory.duration, TestHistory.similarity
+                ).outerjoin(
+                    SqlText, SqlText.hash == TestHistory.sql_hash
+                ).where(TestHistory.id > last_id).order_by(TestHistory.id).limit(LOAD_CHUNK_SIZE)
+            ).all()
+            if not rows:
+                break
+            ids, case_ids, run_ats, outcomes, durations, similarities = zip(*rows)
+            frames.append(pd.DataFrame({
+                "case_id": np.asarray(case_ids, dtype=np.int64),
+                "run_at": pd.to_datetime(list(run_ats)),
+                "outcome": np.asarray(outcomes, dtype=np.int8),
+                "duration": np.asarray([d if d is not None else np.nan for d in durations], dtype=np.float32),
+                "similarity": np.asarray([s if s is not None else np.nan for s in similarities], dtype=np.float32),
+            }))
+            last_id = ids[-1]
+            if len(rows) < LOAD_CHUNK_SIZE:
+                break
+        frame = pd.concat(frames, ignore_index=True) if frames else None
+        return frame, last_id
+
+    @staticmethod
+    def _load_archives(batches: List[TestBatch]) -> Optional[pd.DataFrame]:
+        if not batches:
+            return None
+        _require_pyarrow()
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        frames = []
+        for batch in batches:
+            path = os.path.join(ARCHIVE_DIR, batch.archive_path)
+            if not os.path.exists(path):
+                logger.warning(f"Archive file missing: {path}")
+                continue
+            # 早期的归档文件没有 similarity 列
+            has_similarity = "similarity" in pq.read_schema(path).names
+            table = pq.read_table(path, columns=["case_id", "run_at", "result", "actual_sql", "duration"]
+                                  + (["similarity"] if has_similarity else []))
+            is_pass = pc.equal(table["result"], "PASS")
+            sql = pc.fill_null(table["actual_sql"], "")
+            is_error = pc.or_(pc.equal(sql, ""), pc.starts_with(sql, "Error"))
+            outcome = np.where(
+                is_pass.to_numpy(zero_copy_only=False), OUTCOME_PASS,
+                np.where(is_error.to_numpy(zero_copy_only=False), OUTCOME_ERROR, OUTCOME_FAIL)
+            )
+            frames.append(pd.DataFrame({
+                "case_id": table["case_id"].to_numpy(zero_copy_only=False).astype(np.int64),
+                "run_at": table["run_at"].to_pandas().to_numpy(),
+                "outcome": outcome.astype(np.int8),
+                "duration": table["duration"].to_numpy(zero_copy_only=False).astype(np.float32),
+                "similarity": (
+                    table["similarity"].to_numpy(zero_copy_only=False).astype(np.float32) if has_similarity
+                    else np.full(table.num_rows, np.nan, dtype=np.float32)
+                ),
+            }))
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def _is_stale(self, db, archive_key, history_version) -> bool:
+        """快照中的数据库部分是否已与数据库不一致, 不能再增量追加"""
+        if archive_key != self._archive_key or history_version != self._history_version:
+            return True
+        # 兜底: 已加载范围内的行被删除, 或删空后 id 从头复用
+        loaded, max_id = db.execute(
+            select(func.count(), func.max(TestHistory.id)).where(TestHistory.id <= self._last_id)
+        ).one()
+        return loaded != self._db_rows or (max_id or 0) != (self._last_id if self._db_rows else 0)
+
+    def frame(self) -> pd.DataFrame:
+        """返回最新快照 (只读), 必要时增量刷新"""
+        with self._lock:
+            db = SessionLocal()
+            try:
+                archived = db.query(TestBatch).filter(TestBatch.archived_at.isnot(None)).all()
+                archive_key = tuple(sorted((b.id, b.archived_at) for b in archived))
+                version_row = db.get(SystemConfig, HISTORY_VERSION_KEY)
+                history_version = version_row.value if version_row else None
+
+                if self._is_stale(db, archive_key, history_version):
+                    parts = [self._load_archives(archived)]
+                    db_frame, self._last_id = self._load_db_rows(db, 0)
+                    parts.append(db_frame)
+                    parts = [p for p in parts if p is not None]
+                    self._frame = pd.concat(parts, ignore_index=True) if parts else self._empty()
+                    self._db_rows = len(db_frame) if db_frame is not None else 0
+                    self._archive_key = archive_key
+                    self._history_version = history_version
+                else:
+                    db_frame, self._last_id = self._load_db_rows(db, self._last_id)
+                    if db_frame is not None:
+                        self._frame = pd.concat([self._frame, db_frame], ignore_index=True)
+                        self._db_rows += len(db_frame)
+            finally:
+                db.close()
+            return self._frame
+
+    @staticmethod
+    def categories() -> Dict[int, str]:
+        db = SessionLocal()
+        try:
+            return {case_id: category or "uncategorized"
+                    for case_id, category in db.query(TestCase.id, TestCase.category)}
+        finally:
+            db.close()
+
+
+snapshot = HistorySnapshot()
+
+
+class HistoryAnalytics:
+    """基于快照的向量化统计"""
+
+    @staticmethod
+    def _window(frame: pd.DataFrame, days: Optional[int]) -> pd.DataFrame:
+        if days is None:
+            return frame
+        cutoff = np.datetime64(datetime.now() - timedelta(days=days), "ns")
+        return frame[frame["run_at"].to_numpy() >= cutoff]
+
+    @staticmethod
+    def _with_category(frame: pd.DataFrame) -> pd.DataFrame:
+        mapping = HistorySnapshot.categories()
+        category = frame["case_id"].map(mapping).fillna("deleted")
+        return frame.assign(category=category)
+
+    @staticmethod
+    def pass_rate_trend(days: int = 90, by_category: bool = True) -> List[Dict[str, Any]]:
+        """按天 (可选再按分类) 统计通过率和平均相似度"""
+        frame = HistoryAnalytics._window(snapshot.frame(), days)
+        if frame.empty:
+            return []
+        keys = ["date"]
+        frame = frame.assign(date=frame["run_at"].dt.floor("D"), passed=(frame["outcome"] == OUTCOME_PASS))
+        if by_category:
+            frame = HistoryAnalytics._with_category(frame)
+            keys.append("category")
+
+        grouped = frame.groupby(keys, sort=True).agg(
+            total=("passed", "size"), passed=("passed", "sum"), avg_similarity=("similarity", "mean")
+        )
+        grouped["pass_rate"] = (grouped["passed"] / grouped["total"]).round(4)
+        # 没有相似度的分组 (升级前的数据) 为 None
+        grouped["avg_similarity"] = grouped["avg_similarity"].astype(float).round(4).astype(object)
+        grouped.loc[grouped["avg_similarity"].isna(), "avg_similarity"] = None
+        grouped = grouped.reset_index()
+        grouped["date"] = grouped["date"].dt.strftime("%Y-%m-%d")
+        grouped["passed"] = grouped["passed"].astype(int)
+        return grouped.to_dict(orient="records")
+
+    @staticmethod
+    def flips(days: Optional[int] = 90, direction: str = "pass_to_fail",
+              latest_only: bool = True, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        检测结果翻转的用例
+
+        对同一用例按时间排序后比较相邻两次结果。latest_only 时只返回最近一次运行
+        恰好发生翻转的用例 (即当前的回归 / 修复)。
+        """
+        frame = HistoryAnalytics._window(snapshot.frame(), days)
+        if len(frame) < 2:
+            return []
+
+        case_ids = frame["case_id"].to_numpy()
+        run_at = frame["run_at"].to_numpy()
+        passed = frame["outcome"].to_numpy() == OUTCOME_PASS
+        order = np.lexsort((run_at, case_ids))
+        case_ids, run_at, passed = case_ids[order], run_at[order], passed[order]
+
+        same_case = case_ids[1:] == case_ids[:-1]
+        if direction == "pass_to_fail":
+            flipped = same_case & passed[:-1] & ~passed[1:]
+        else:
+            flipped = same_case & ~passed[:-1] & passed[1:]
+        # flip_idx 指向翻转后的那次运行
+        flip_idx = np.nonzero(flipped)[0] + 1
+
+        if latest_only:
+            is_last = np.append(case_ids[1:] != case_ids[:-1], True)
+            flip_idx = flip_idx[is_last[flip_idx]]
+
+        flip_cases, flip_counts = np.unique(case_ids[np.nonzero(flipped)[0] + 1], return_counts=True)
+        count_map = dict(zip(flip_cases.tolist(), flip_counts.tolist()))
+
+        # 最近翻转的排在前面
+        flip_idx = flip_idx[np.argsort(run_at[flip_idx])[::-1]][:limit]
+        categories = HistorySnapshot.categories()
+        return [
+            {
+                "case_id": int(case_ids[i]),
+                "category": categories.get(int(case_ids[i]), "deleted"),
+                "flipped_at": pd.Timestamp(run_at[i]).isoformat(),
+                "flip_count": count_map.get(int(case_ids[i]), 0)
+            }
+            for i in flip_idx
+        ]
+
+    @staticmethod
+    def latency(days: int = 90, by_category: bool = True, bins: int = 20) -> Dict[str, Any]:
+        """耗时分布: 分位数 + 直方图"""
+        frame = HistoryAnalytics._window(snapshot.frame(), days)
+        frame = frame[frame["duration"].notna()]
+        if frame.empty:
+            return {"groups": [], "histogram": {"edges": [], "counts": []}}
+
+        if by_category:
+            frame = HistoryAnalytics._with_category(frame)
+            grouped = frame.groupby("category")["duration"]
+        else:
+            grouped = frame.assign(category="all").groupby("category")["duration"]
+
+        quantiles = grouped.quantile([0.5, 0.9, 0.99]).unstack()
+        stats = grouped.agg(["count", "mean", "max"]).join(quantiles)
+        groups = [
+            {
+                "category": category,
+                "count": int(row["count"]),
+                "mean": round(float(row["mean"]), 3),
+                "p50": round(float(row[0.5]), 3),
+                "p90": round(float(row[0.9]), 3),
+                "p99": round(float(row[0.99]), 3),
+                "max": round(float(row["max"]), 3),
+            }
+            for category, row in stats.iterrows()
+        ]
+
+        durations = frame["duration"].to_numpy()
+        low, high = float(durations.min()), float(durations.max())
+        if low == high:
+            # 耗时全部相同 (例如全为 0) 时 np.histogram 会把区间扩到 [v-0.5, v+0.5], 改为单个区间 [v, v]
+            counts, edges = np.array([len(durations)]), np.array([low, high])
+        else:
+            counts, edges = np.histogram(durations, bins=bins)
+        return {
+            "groups": groups,
+            "histogram": {"edges": np.round(edges, 3).tolist(), "counts": counts.tolist()}
+        }
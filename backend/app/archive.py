@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+历史结果归档
+
+test_history 会无限增长, 而 data/autotest.db 需要随离线部署包拷贝。
+超出保留策略的已结束批次 (早于 HISTORY_RETENTION_DAYS 天, 或不在最新的
+HISTORY_KEEP_LATEST 个之内) 的明细导出为 zstd 压缩的 Parquet 文件
+(data/archive/<batch_id>.parquet), 再分块从 SQLite 删除并增量回收空间。
+批次本身 (含计数) 保留在 test_batches, 报告接口读取明细时透明地改读归档文件。
+
+命令行执行: python -m backend.app.archive
+"""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, select, text
+
+from . import schemas
+from .models import (
+    SessionLocal, engine, DATA_DIR, IS_SQLITE, TestBatch, TestHistory, TestCase, BatchEvent, SqlText, history_actual_sql
+)
+from backend.core.config import Config
+
+logger = logging.getLogger("Backend.Archive")
+
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+
+# 每个事务删除的历史行数, 避免长时间持有写锁
+DELETE_CHUNK_SIZE = 5000
+
+# 逐块读写归档文件时每块的行数
+READ_CHUNK_SIZE = 5000
+
+# 归档文件的列 (与 TestResult / 报告导出所需字段一致)
+ARCHIVE_COLUMNS = [
+    "case_id", "question", "actual_sql", "result", "error_message", "duration", "run_at",
+    "expected_sql", "expected_keywords", "expected_conditions", "similarity",
+]
+
+
+def _archive_schema(pa):
+    """归档文件的 Parquet schema, 列顺序与 ARCHIVE_COLUMNS 一致"""
+    return pa.schema([
+        ("case_id", pa.int64()),
+        ("question", pa.string()),
+        ("actual_sql", pa.string()),
+        ("result", pa.string()),
+        ("error_message", pa.string()),
+        ("duration", pa.float64()),
+        ("run_at", pa.timestamp("us")),
+        ("expected_sql", pa.string()),
+        ("expected_keywords", pa.string()),
+        ("expected_conditions", pa.string()),
+        ("similarity", pa.float64()),
+    ])
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        logger.error("缺失依赖: pyarrow。无法读写归档文件。")
+        raise RuntimeError("缺失依赖 pyarrow，请运行 'pip install pyarrow'")
+    return pyarrow
+
+
+class HistoryArchiver:
+    """历史批次归档服务"""
+
+    @staticmethod
+    def select_batches(db, keep_days: Optional[int], keep_latest: Optional[int]) -> List[TestBatch]:
+        """按保留策略挑选需要归档的批次 (只处理已结束且未归档的批次)"""
+        finished = db.query(TestBatch).filter(
+            TestBatch.status != "RUNNING",
+            TestBatch.archived_at.is_(None)
+        )
+        candidates = {}
+
+        if keep_days is not None:
+            cutoff = datetime.now() - timedelta(days=keep_days)
+            for batch in finished.filter(TestBatch.start_time < cutoff):
+                candidates[batch.id] = batch
+
+        if keep_latest is not None:
+            newest = select(TestBatch.id).order_by(TestBatch.start_time.desc()).limit(keep_latest)
+            for batch in finished.filter(TestBatch.id.notin_(newest)):
+                candidates[batch.id] = batch
+
+        return sorted(candidates.values(), key=lambda b: b.start_time or datetime.min)
+
+    @staticmethod
+    def archive_batch(db, batch: TestBatch) -> int:
+        """
+        归档单个批次
+
+        1. 分块读取明细写入文件 (临时文件 + rename 保证原子性)
+        2. 标记 archived_at / archive_path 并提交, 此后报告改读归档文件
+        3. 分块删除数据库中的明细 (见 purge_archived)
+
+        第 3 步中途失败时批次已是归档状态, 文件中有完整的明细, 剩余的行由下次
+        run() 继续删除; 已归档的批次不会再次写文件, 不会用残缺的明细覆盖归档。
+
+        Returns:
+            int: 归档的明细行数
+        """
+        pa = _require_pyarrow()
+        import pyarrow.parquet as pq
+
+        stmt = select(
+            TestHistory.case_id, TestHistory.question, history_actual_sql,
+            TestHistory.result, TestHistory.error_message, TestHistory.duration, TestHistory.run_at,
+            TestCase.expected_sql, TestCase.expected_keywords, TestCase.expected_conditions,
+            TestHistory.similarity
+        ).outerjoin(
+            TestCase, TestHistory.case_id == TestCase.id
+        ).outerjoin(
+            SqlText, SqlText.hash == TestHistory.sql_hash
+        ).where(TestHistory.batch_id == batch.id).order_by(TestHistory.id)
+
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        filename = f"{batch.id}.parquet"
+        final_path = os.path.join(ARCHIVE_DIR, filename)
+        tmp_path = final_path + ".tmp"
+
+        # 每块写成一个 row group, 内存占用与批次大小无关
+        row_count = 0
+        writer = pq.ParquetWriter(tmp_path, _archive_schema(pa), compression="zstd")
+        try:
+            result = db.execute(stmt.execution_options(yield_per=READ_CHUNK_SIZE))
+            for rows in result.partitions():
+                schema = writer.schema
+                arrays = [pa.array([row[i] for row in rows], schema.field(i).type) for i in range(len(ARCHIVE_COLUMNS))]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                row_count += len(rows)
+        except BaseException:
+            writer.close()
+            os.remove(tmp_path)
+            raise
+        writer.close()
+        os.replace(tmp_path, final_path)
+
+        # 先标记归档再删除明细, 删除中途失败也不会留下 "未归档但明细残缺" 的批次
+        batch.archived_at = datetime.now()
+        batch.archive_path = filename
+        db.commit()
+
+        HistoryArchiver.purge_archived(db, batch)
+        logger.info(f"Archived batch {batch.id}: {row_count} rows -> {final_path}")
+        return row_count
+
+    @staticmethod
+    def purge_archived(db, batch: TestBatch):
+        """分块删除已归档批次在数据库中的明细和事件, 可重复执行 (从上次中断处继续)"""
+        # 每块单独提交 (先取 id 再删除, MySQL 不支持 IN 子查询中的 LIMIT)
+        while True:
+            ids = db.scalars(
+                select(TestHistory.id).where(TestHistory.batch_id == batch.id).limit(DELETE_CHUNK_SIZE)
+            ).all()
+            if ids:
+                db.execute(
+                    delete(TestHistory).where(TestHistory.id.in_(ids)).execution_options(synchronize_session=False)
+                )
+            db.commit()
+            if len(ids) < DELETE_CHUNK_SIZE:
+                break
+
+        # sql_texts 中不再被引用的正文
+        db.execute(text(
+            "DELETE FROM sql_texts WHERE NOT EXISTS "
+            "(SELECT 1 FROM test_history h WHERE h.sql_hash = sql_texts.hash)"
+        ))
+
+        # 事件日志只用于运行中的断线重连, 已结束批次不再需要
+        db.query(BatchEvent).filter(BatchEvent.batch_id == batch.id).delete(synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def pending_purges(db) -> List[TestBatch]:
+        """已标记归档但明细未删完的批次 (上次归档在删除阶段中断)"""
+        return db.query(TestBatch).filter(
+            TestBatch.archived_at.isnot(None),
+            select(TestHistory.id).where(TestHistory.batch_id == TestBatch.id).exists()
+        ).all()
+
+    @staticmethod
+    def read_results(batch: TestBatch) -> List[Dict[str, Any]]:
+        """读取已归档批次的明细, 字段与 ARCHIVE_COLUMNS 一致"""
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+
+        path = os.path.join(ARCHIVE_DIR, batch.archive_path)
+        return pq.read_table(path).to_pylist()
+
+    @staticmethod
+    def iter_results(batch: TestBatch) -> Iterator[Dict[str, Any]]:
+        """逐块读取已归档批次的明细 (字段同 read_results), 内存占用与批次大小无关"""
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+
+        path = os.path.join(ARCHIVE_DIR, batch.archive_path)
+        for record_batch in pq.ParquetFile(path).iter_batches(batch_size=READ_CHUNK_SIZE):
+            yield from record_batch.to_pylist()
+
+    @staticmethod
+    def read_test_results(batch: TestBatch) -> List[schemas.TestResult]:
+        """以 TestResult 形式返回已归档批次的明细, 供报告/历史接口使用"""
+        return [
+            schemas.TestResult(
+                case_id=r["case_id"],
+                question=r["question"],
+                actual_sql=r["actual_sql"] or "",
+                expected_sql=r["expected_sql"],
+                result=r["result"],
+                message=r["error_message"] or "",
+                duration=r["duration"] or 0.0,
+                similarity=r.get("similarity")  # 早期的归档文件没有该列
+            )
+            for r in HistoryArchiver.read_results(batch)
+        ]
+
+    @staticmethod
+    def reclaim_space(pages: int = 0):
+        """
+        增量回收 SQLite 空闲页
+
+        auto_vacuum 需要 INCREMENTAL 模式; 旧库第一次执行时切换模式并做一次完整 VACUUM。
+        pages 为 0 时回收全部空闲页。
+        """
+        if not IS_SQLITE:
+            return
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+            if mode != 2:
+                logger.info("Switching SQLite auto_vacuum to INCREMENTAL (one-time VACUUM)")
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+            else:
+                conn.exec_driver_sql(f"PRAGMA incremental_vacuum({int(pages)})")
+
+    @staticmethod
+    def run(keep_days: Optional[int] = None, keep_latest: Optional[int] = None) -> Dict[str, Any]:
+        """按保留策略归档, 参数缺省时取配置 HISTORY_RETENTION_DAYS / HISTORY_KEEP_LATEST"""
+        if keep_days is None:
+            keep_days = int(Config.get("HISTORY_RETENTION_DAYS", 90))
+        if keep_latest is None:
+            keep_latest = int(Config.get("HISTORY_KEEP_LATEST", 50))
+
+        db = SessionLocal()
+        try:
+            for batch in HistoryArchiver.pending_purges(db):
+                logger.info(f"Resuming purge of archived batch {batch.id}")
+                HistoryArchiver.purge_archived(db, batch)
+            batches = HistoryArchiver.select_batches(db, keep_days, keep_latest)
+            archived_rows = 0
+            for batch in batches:
+                archived_rows += HistoryArchiver.archive_batch(db, batch)
+        finally:
+            db.close()
+
+        if batches:
+            HistoryArchiver.reclaim_space()
+
+        return {
+            "archived_batches": len(batches),
+            "archived_rows": archived_rows,
+            "keep_days": keep_days,
+            "keep_latest": keep_latest
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(HistoryArchiver.run())
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+批次控制状态
+
+运行中批次的归属、停止信号和进度心跳保存在 batch_control 表中,
+而不是进程内字典。uvicorn 多 worker (或多台主机共享同一数据库) 时,
+任意 worker 都能接收停止请求、查询进度; 消息推送则通过 batch_events
+事件日志完成 (见 events.py), 同样与进程无关。
+"""
+
+import os
+import time
+import socket
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from .models import SessionLocal, BatchControl, TestBatch
+from .database import upsert
+from .events import event_log
+from backend.core.config import Config
+
+logger = logging.getLogger("Backend.BatchState")
+
+# 当前进程标识
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# 心跳最小写入间隔 (秒), 其余调用只读取停止信号
+HEARTBEAT_INTERVAL = 2.0
+
+
+class BatchStateStore:
+    """批次控制状态的读写, 每个方法使用独立的短会话"""
+
+    # { batch_id: 上次写入心跳的时间 }, 仅用于限制本进程的写入频率
+    _last_beat: Dict[str, float] = {}
+
+    @staticmethod
+    def claim(batch_id: str):
+        """当前进程接管批次执行"""
+        db = SessionLocal()
+        try:
+            # 单条 upsert, 不需要先查询是否存在
+            db.execute(
+                upsert(BatchControl, ["batch_id"], ["owner", "heartbeat_at"]),
+                {"batch_id": batch_id, "owner": OWNER_ID, "heartbeat_at": datetime.now(),
+                 "stop_requested": False, "completed_count": 0}
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def heartbeat(batch_id: str, completed_count: int, current_case_id: Optional[int] = None) -> bool:
+        """
+        上报进度并刷新心跳
+
+        Returns:
+            bool: 是否收到了停止信号
+        """
+        now = time.monotonic()
+        db = SessionLocal()
+        try:
+            if now - BatchStateStore._last_beat.get(batch_id, 0.0) < HEARTBEAT_INTERVAL:
+                stop = db.query(BatchControl.stop_requested).filter(BatchControl.batch_id == batch_id).scalar()
+                return bool(stop)
+
+            ctrl = db.query(BatchControl).filter(BatchControl.batch_id == batch_id).first()
+            if ctrl is None:
+                return False
+            ctrl.completed_count = completed_count
+            ctrl.current_case_id = current_case_id
+            ctrl.heartbeat_at = datetime.now()
+            stop = bool(ctrl.stop_requested)
+            db.commit()
+            BatchStateStore._last_beat[batch_id] = now
+            return stop
+        finally:
+            db.close()
+
+    @staticmethod
+    def request_stop(batch_id: str) -> bool:
+        """发出停止信号, 批次不存在或已结束时返回 False"""
+        db = SessionLocal()
+        try:
+            updated = db.query(BatchControl).filter(BatchControl.batch_id == batch_id).update(
+                {"stop_requested": True}, synchronize_session=False
+            )
+            db.commit()
+            return updated > 0
+        finally:
+            db.close()
+
+    @staticmethod
+    def release(batch_id: str):
+        """批次结束, 删除控制记录"""
+        BatchStateStore._last_beat.pop(batch_id, None)
+        db = SessionLocal()
+        try:
+            db.query(BatchControl).filter(BatchControl.batch_id == batch_id).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    @staticmethod
+    def reap_stale() -> int:
+        """
+        回收执行进程已退出的批次
+
+        心跳超过 BATCH_LEASE_TIMEOUT 未更新 (或没有控制记录) 的 RUNNING 批次
+        标记为 STOPPED, 并补发 done 事件让等待中的客户端结束。
+        """
+        lease = timedelta(seconds=int(Config.get("BATCH_LEASE_TIMEOUT", 300)))
+        deadline = datetime.now() - lease
+        db = SessionLocal()
+        try:
+            rows = db.query(TestBatch, BatchControl).outerjoin(
+                BatchControl, BatchControl.batch_id == TestBatch.id
+            ).filter(TestBatch.status == "RUNNING").all()
+
+            reaped = []
+            for batch, ctrl in rows:
+                last_seen = ctrl.heartbeat_at if ctrl else batch.start_time
+                if last_seen is not None and last_seen > deadline:
+                    continue
+                batch.status = "STOPPED"
+                batch.end_time = datetime.now()
+                if ctrl is not None:
+                    db.delete(ctrl)
+                reaped.append(batch.id)
+            db.commit()
+        finally:
+            db.close()
+
+        for batch_id in reaped:
+            logger.warning(f"Batch {batch_id} lost its runner, marked as STOPPED")
+            event_log.append(batch_id, {"type": "done"})
+            event_log.flush()
+        return len(reaped)
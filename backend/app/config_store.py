@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+系统配置的进程内缓存
+
+system_config 整表在首次使用时加载一次, 之后的读取 (配置接口、runner 执行批次) 都走内存,
+不再逐个 key 查询数据库。加载结果同时写入 Config._cache, Config.get 与这里读到的是同一份数据。
+
+失效通过版本号完成: POST /config/ 在写入配置的同一事务内递增 config_version 行;
+每个 worker 的后台线程每 CONFIG_POLL_INTERVAL 秒只按主键读这一行, 版本变化时重新加载整表,
+多 worker / 多主机部署无需重启即可生效。
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import Integer, String, cast, update
+
+from .database import insert_ignore
+from .models import SessionLocal, SystemConfig
+from backend.core.config import Config, refresh_config
+from backend.core.validator import VALIDATION_MODES
+
+logger = logging.getLogger("Backend.ConfigStore")
+
+# 版本号所在的配置行
+CONFIG_VERSION_KEY = "config_version"
+# test_history 被原地改写 / 删除时递增 (见 analytics.HistorySnapshot)
+HISTORY_VERSION_KEY = "history_version"
+
+
+def bump_version(db, key: str, description: str):
+    """
+    在当前事务内递增 system_config 中的计数器行 (不存在时从 0 开始), 由调用方提交
+
+    版本号在 SQL 中递增, 并发的修改不会读到同一个旧值; 应作为事务的第一条写语句,
+    SQLite 下事务开始即持有写锁, 并发请求按 busy_timeout 排队而不是在升级写锁时报 database is locked
+    """
+    db.execute(insert_ignore(SystemConfig).values(key=key, value="0", description=description))
+    db.execute(
+        update(SystemConfig).where(SystemConfig.key == key).values(
+            value=cast(cast(SystemConfig.value, Integer) + 1, String)
+        )
+    )
+
+
+class RuntimeSettings(BaseModel):
+    """配置页维护的运行参数 (已做类型转换)"""
+    user_token: str = ""
+    max_workers: int = 5
+    headers: Dict[str, str] = {}
+    validation_mode: str = "keywords"
+
+    @classmethod
+    def parse(cls, values: Dict[str, str]) -> "RuntimeSettings":
+        """由 system_config 的原始字符串解析, 格式错误的值退回默认值"""
+        settings = cls(user_token=values.get("user_token", ""))
+        # 未在配置页设置时取环境变量 / 默认值
+        mode = values.get("VALIDATION_MODE") or Config.get("VALIDATION_MODE", "keywords")
+        if mode in VALIDATION_MODES:
+            settings.validation_mode = mode
+        else:
+            logger.warning(f"Invalid VALIDATION_MODE: {mode!r}")
+        try:
+            settings.max_workers = int(values.get("max_workers", settings.max_workers))
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid max_workers in system_config: {values.get('max_workers')!r}")
+        try:
+            headers = json.loads(values.get("headers", "{}"))
+            if isinstance(headers, dict):
+                settings.headers = {str(k): str(v) for k, v in headers.items()}
+        except ValueError:
+            logger.warning("Invalid headers JSON in system_config")
+        return settings
+
+
+class ConfigStore:
+    """
+    system_config 的内存副本
+
+    - settings / get(): 只读内存, 首次调用时加载
+    - update(): 写入配置并递增版本号, 本进程立即重新加载
+    - refresh(): 版本号变化时重新加载, 由后台线程定时调用
+    """
+
+    def __init__(self, poll_interval: float = 2.0):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._values: Dict[str, str] = {}
+        self._settings = RuntimeSettings()
+        self._version: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def version(self) -> int:
+        self._ensure_loaded()
+        return self._version
+
+    @property
+    def settings(self) -> RuntimeSettings:
+        self._ensure_loaded()
+        return self._settings
+
+    def get(self, key: str, default=None):
+        self._ensure_loaded()
+        return self._values.get(key, default)
+
+    def _ensure_loaded(self):
+        if self._version is None:
+            self.load()
+
+    @staticmethod
+    def _parse_version(value) -> int:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+
+    def load(self, db=None):
+        """整表加载 system_config"""
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            values = {row.key: row.value for row in db.query(SystemConfig).all()}
+        finally:
+            if own_session:
+                db.close()
+
+        version = self._parse_version(values.pop(CONFIG_VERSION_KEY, None))
+        # 计数器行不属于配置项
+        values.pop(HISTORY_VERSION_KEY, None)
+        settings = RuntimeSettings.parse(values)
+        with self._lock:
+            self._values = values
+            self._settings = settings
+            self._version = version
+            # 整体替换而不是 clear + update, 并发的 Config.get 不会读到空的配置
+            Config._cache = dict(values)
+            refresh_config()
+        logger.info(f"Loaded system config (version {version})")
+
+    def refresh(self) -> bool:
+        """数据库中的版本号与内存不同时重新加载, 返回是否重新加载"""
+        db = SessionLocal()
+        try:
+            row = db.get(SystemConfig, CONFIG_VERSION_KEY)
+            version = self._parse_version(row.value if row else None)
+            if version == self._version:
+                return False
+            self.load(db)
+            return True
+        finally:
+            db.close()
+
+    def update(self, db, values: Dict[str, str]):
+        """写入配置 (None 表示不修改) 并在同一事务内递增版本号"""
+        bump_version(db, CONFIG_VERSION_KEY, "配置版本号, 每次修改递增")
+        for key, value in values.items():
+            if value is None:
+                continue
+            item = db.get(SystemConfig, key)
+            if item is None:
+                db.add(SystemConfig(key=key, value=str(value)))
+            else:
+                item.value = str(value)
+        db.commit()
+        self.load(db)
+
+    def start(self):
+        """启动版本轮询线程"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="config-poller", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Config refresh failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval * 2)
+            self._thread = None
+
+
+config_store = ConfigStore(poll_interval=float(Config.get("CONFIG_POLL_INTERVAL", 2.0)))
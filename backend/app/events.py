@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+批次事件日志
+
+每条推送给前端的批次消息都带一个批次内单调递增的 seq, 经写后缓冲批量写入 batch_events 表,
+落库后再唤醒等待中的连接。seq 在写入事务内按数据库中该批次的最大 seq 分配, 不依赖进程内计数,
+多个 worker 先后为同一批次写事件 (回收后重新认领、其他 worker 处理停止请求) 也不会重复或乱序;
+并发写入的冲突由 (batch_id, seq) 唯一索引拦下, 这一批行随写后缓冲的重试重新分配 seq。
+WebSocket 重连时携带 since=<seq>, 服务端按 seq 分页从数据库补发缺失的事件,
+补完后沿用同一个游标继续等待新事件, 因此补发与实时推送之间不会重复也不会遗漏。
+"""
+
+import json
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import func, select
+
+from .models import SessionLocal, AsyncSessionLocal, BatchEvent
+from .history_writer import history_writer
+
+logger = logging.getLogger("Backend.Events")
+
+# 每次从数据库补发的事件条数
+REPLAY_PAGE_SIZE = 200
+
+
+class EventNotifier:
+    """
+    事件唤醒器
+
+    runner 在独立线程的事件循环中运行, WebSocket 在主事件循环中运行,
+    这里通过 call_soon_threadsafe 跨线程唤醒正在等待新事件的连接。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def subscribe(self, batch_id: str) -> Tuple[asyncio.AbstractEventLoop, asyncio.Event]:
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(batch_id, set()).add(waiter)
+        return waiter
+
+    def unsubscribe(self, batch_id: str, waiter: Tuple[asyncio.AbstractEventLoop, asyncio.Event]):
+        with self._lock:
+            waiters = self._waiters.get(batch_id)
+            if waiters is None:
+                return
+            waiters.discard(waiter)
+            if not waiters:
+                del self._waiters[batch_id]
+
+    def notify(self, batch_id: str):
+        with self._lock:
+            waiters = list(self._waiters.get(batch_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # 对应的事件循环已关闭
+                pass
+
+
+class EventLog:
+    """批次事件的持久化与按 seq 分页读取"""
+
+    def __init__(self, notifier: EventNotifier):
+        self.notifier = notifier
+        history_writer.add_listener(self._on_flush)
+        history_writer.add_preparer(BatchEvent, self._assign_seqs)
+
+    def append(self, batch_id: str, message: dict):
+        """把消息放入写后缓冲, seq 在落库时分配"""
+        history_writer.add(BatchEvent, {
+            "batch_id": batch_id,
+            "message": message,
+            "created_at": datetime.now()
+        })
+
+    @staticmethod
+    def _assign_seqs(db, rows: List[dict]) -> List[dict]:
+        """在写入事务内为缓冲中的事件分配 seq (接在数据库中已有的最大 seq 之后), 生成 batch_events 行"""
+        next_seq: Dict[str, int] = {}
+        stored = []
+        for row in rows:
+            batch_id = row["batch_id"]
+            if batch_id not in next_seq:
+                last = db.scalar(select(func.max(BatchEvent.seq)).where(BatchEvent.batch_id == batch_id))
+                next_seq[batch_id] = (last or 0) + 1
+            seq = next_seq[batch_id]
+            next_seq[batch_id] = seq + 1
+            message = {**row["message"], "seq": seq}
+            stored.append({
+                "batch_id": batch_id,
+                "seq": seq,
+                "type": message.get("type", ""),
+                "payload": json.dumps(message, ensure_ascii=False),
+                "created_at": row["created_at"]
+            })
+        return stored
+
+    def _on_flush(self, batch_ids: Set[str]):
+        for batch_id in batch_ids:
+            self.notifier.notify(batch_id)
+
+    @staticmethod
+    def flush():
+        """批次结束时立即落库剩余的事件, 不等下一次定时刷新"""
+        history_writer.flush()
+
+    @staticmethod
+    def fetch(batch_id: str, since: int, limit: int = REPLAY_PAGE_SIZE) -> List[dict]:
+        """读取 seq > since 的事件, 按 seq 升序, 最多 limit 条"""
+        db = SessionLocal()
+        try:
+            rows = db.query(BatchEvent.payload).filter(
+                BatchEvent.batch_id == batch_id,
+                BatchEvent.seq > since
+            ).order_by(BatchEvent.seq).limit(limit).all()
+            return [json.loads(payload) for (payload,) in rows]
+        finally:
+            db.close()
+
+    @staticmethod
+    async def fetch_async(batch_id: str, since: int, limit: int = REPLAY_PAGE_SIZE) -> List[dict]:
+        """fetch 的异步版本, 供 WebSocket 使用, 查询期间不阻塞事件循环"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(BatchEvent.payload).where(
+                    BatchEvent.batch_id == batch_id,
+                    BatchEvent.seq > since
+                ).order_by(BatchEvent.seq).limit(limit)
+            )
+            return [json.loads(payload) for payload in result.scalars()]
+
+    @staticmethod
+    async def last_seq_async(batch_id: str) -> int:
+        async with AsyncSessionLocal() as db:
+            last = await db.scalar(
+                select(func.max(BatchEvent.seq)).where(BatchEvent.batch_id == batch_id)
+            )
+            return last or 0
+
+
+notifier = EventNotifier()
+event_log = EventLog(notifier)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+流式导出 (CSV / NDJSON / Parquet)
+
+查询结果用 yield_per 分块读取, 每块编码后立即写入响应, 不在内存中拼出完整文件,
+百万行的用例库或历史记录导出也只占用一块的内存。
+Parquet 每块写成一个 row group, 通过 _ChunkSink 把 writer 的输出逐块交给响应。
+"""
+
+import io
+import csv
+import json
+import logging
+from datetime import datetime
+from typing import Any, Iterator, List, Sequence, Tuple
+
+from sqlalchemy import select
+
+from .models import SessionLocal, TestCase, TestHistory, SqlText, history_actual_sql
+from .archive import _require_pyarrow
+
+logger = logging.getLogger("Backend.Exporter")
+
+# 每块行数
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# (列名, 查询表达式, Parquet 类型名)
+CASE_COLUMNS = [
+    ("id", TestCase.id, "int64"),
+    ("external_id", TestCase.external_id, "string"),
+    ("question", TestCase.question, "string"),
+    ("expected_keywords", TestCase.expected_keywords, "string"),
+    ("expected_conditions", TestCase.expected_conditions, "string"),
+    ("expected_sql", TestCase.expected_sql, "string"),
+    ("category", TestCase.category, "string"),
+    ("expect_company", TestCase.expect_company, "string"),
+    ("expect_indicator", TestCase.expect_indicator, "string"),
+    ("expect_time", TestCase.expect_time, "string"),
+    ("description", TestCase.description, "string"),
+    ("is_active", TestCase.is_active, "bool"),
+    ("last_result", TestCase.last_result, "string"),
+    ("last_run_at", TestCase.last_run_at, "timestamp"),
+    ("created_at", TestCase.created_at, "timestamp"),
+    ("updated_at", TestCase.updated_at, "timestamp"),
+]
+
+HISTORY_COLUMNS = [
+    ("id", TestHistory.id, "int64"),
+    ("batch_id", TestHistory.batch_id, "string"),
+    ("case_id", TestHistory.case_id, "int64"),
+    ("question", TestHistory.question, "string"),
+    ("actual_sql", history_actual_sql, "string"),
+    ("sql_hash", TestHistory.sql_hash, "string"),
+    ("result", TestHistory.result, "string"),
+    ("error_message", TestHistory.error_message, "string"),
+    ("duration", TestHistory.duration, "float64"),
+    ("similarity", TestHistory.similarity, "float64"),
+    ("run_at", TestHistory.run_at, "timestamp"),
+]
+
+
+class _ChunkSink:
+    """ParquetWriter 的输出目标: 缓存写入的字节, 由 drain() 逐块取走"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class StreamExporter:
+    """把 select 语句的结果按格式逐块编码"""
+
+    @staticmethod
+    def _rows(stmt) -> Iterator[Sequence[Tuple]]:
+        """独立会话 + yield_per 分块读取; 响应流结束 (或客户端断开) 时关闭会话"""
+        db = SessionLocal()
+        try:
+            result = db.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            for partition in result.partitions():
+                yield partition
+        finally:
+            db.close()
+
+    @staticmethod
+    def _csv(names: List[str], chunks) -> Iterator[bytes]:
+        # BOM 让 Excel 正确识别 UTF-8 中文
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        yield ("\ufeff" + buffer.getvalue()).encode("utf-8")
+        for rows in chunks:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+
+    @staticmethod
+    def _ndjson(names: List[str], chunks) -> Iterator[bytes]:
+        def encode(value):
+            return value.isoformat() if isinstance(value, datetime) else value
+
+        for rows in chunks:
+            yield "".join(
+                json.dumps({n: encode(v) for n, v in zip(names, row)}, ensure_ascii=False) + "\n"
+                for row in rows
+            ).encode("utf-8")
+
+    @staticmethod
+    def _parquet(columns, chunks) -> Iterator[bytes]:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"int64": pa.int64(), "float64": pa.float64(), "string": pa.string(),
+                 "bool": pa.bool_(), "timestamp": pa.timestamp("us")}
+        schema = pa.schema([(name, types[kind]) for name, _, kind in columns])
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        try:
+            for rows in chunks:
+                arrays = [pa.array([row[i] for row in rows], schema.field(i).type) for i in range(len(columns))]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    @staticmethod
+    def stream(stmt, columns, fmt: str) -> Iterator[bytes]:
+        names = [name for name, _, _ in columns]
+        chunks = StreamExporter._rows(stmt)
+        if fmt == "csv":
+            return StreamExporter._csv(names, chunks)
+        if fmt == "ndjson":
+            return StreamExporter._ndjson(names, chunks)
+        if fmt == "parquet":
+            # 在开始输出之前检查依赖, 缺失时接口直接返回错误而不是中途断流
+            _require_pyarrow()
+            return StreamExporter._parquet(columns, chunks)
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    @staticmethod
+    def cases_statement(conditions: Sequence[Any]):
+        return select(*[expr for _, expr, _ in CASE_COLUMNS]).where(*conditions).order_by(TestCase.id)
+
+    @staticmethod
+    def history_statement(conditions: Sequence[Any]):
+        return select(*[expr for _, expr, _ in HISTORY_COLUMNS]).outerjoin(
+            SqlText, SqlText.hash == TestHistory.sql_hash
+        ).where(*conditions).order_by(TestHistory.id)
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+写后缓冲 (write-behind)
+
+runner 产生的 TestHistory / BatchEvent 行先进入内存缓冲, 由后台线程按行数或时间间隔
+批量插入 (executemany), 一次事务、一次 fsync 写入多行, 取代逐行 commit。
+TestBatch 上的运行计数和 TestCase 的最近一次结果在同一事务内更新, 列表/概览接口直接读取即可。
+actual_sql 正文按内容 hash 写入 sql_texts (已存在则忽略), 历史行只保存 sql_hash。
+进程正常退出时 (FastAPI shutdown / atexit) 会把剩余的行全部落库。
+
+整体写入失败时按批次拆开各自在单独的事务中重试, 一个批次的坏数据不影响其他批次落库;
+失败批次的行放回缓冲, 该批次连续失败 MAX_RETRIES 次后转存到 data/history_spill/*.jsonl
+(每行 {"table", "row"}), 不丢弃。涉及的批次由 runner 标记为 FAILED, 不会显示为已完成。
+"""
+
+import os
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, List, Set, Tuple
+
+from sqlalchemy import bindparam, insert, or_, update
+
+from .models import DATA_DIR, SessionLocal, TestHistory, TestBatch, TestCase, SqlText
+from .database import insert_ignore
+from backend.core.config import Config
+from backend.core.sql_digest import SqlDigest
+
+logger = logging.getLogger("Backend.HistoryWriter")
+
+SPILL_DIR = os.path.join(DATA_DIR, "history_spill")
+
+
+class HistoryWriter:
+    """
+    批量写入缓冲
+
+    - add(): 追加一行, 达到 max_rows 时立即同步刷新
+    - flush(): 把缓冲中的行在一个事务内批量插入, 之后回调 on_flush 监听器
+    - 后台线程每 flush_interval 秒刷新一次
+    """
+
+    # 连续写入失败达到该次数后把这批行转存到 SPILL_DIR, 避免坏数据永久阻塞缓冲
+    MAX_RETRIES = 3
+
+    def __init__(self, max_rows: int = 200, flush_interval: float = 0.5):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[Tuple[type, dict]] = []
+        self._failures: Dict[str, int] = {}  # batch_id -> 连续写入失败次数
+        self._spilled_batches: Set[str] = set()
+        self._listeners: List[Callable[[Set[str]], None]] = []
+        self._preparers: Dict[type, Callable[[object, List[dict]], List[dict]]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback: Callable[[Set[str]], None]):
+        """注册刷新回调, 参数为本次写入涉及的 batch_id 集合"""
+        self._listeners.append(callback)
+
+    def add_preparer(self, model, callback: Callable[[object, List[dict]], List[dict]]):
+        """注册插入前的处理: callback(db, rows) 在写入事务内调用, 返回实际插入的行"""
+        self._preparers[model] = callback
+
+    def add(self, model, row: dict):
+        with self._lock:
+            self._pending.append((model, row))
+            full = len(self._pending) >= self.max_rows
+            if self._thread is None:
+                self._start()
+        if full:
+            self.flush()
+
+    def _start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"History flush failed: {e}")
+
+    def flush(self):
+        """
+        写入缓冲中的全部行
+
+        Raises:
+            Exception: 有批次写入失败 (其他批次已写入, 失败批次的行放回缓冲或已转存)
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            error = None
+            try:
+                self._write(pending)
+                written = pending
+            except Exception as e:
+                error = e
+                written = self._write_per_batch(pending)
+            batch_ids = {row["batch_id"] for _, row in written if row.get("batch_id")}
+            for batch_id in batch_ids:
+                self._failures.pop(batch_id, None)
+
+        if written:
+            for callback in self._listeners:
+                try:
+                    callback(batch_ids)
+                except Exception as e:
+                    logger.error(f"History flush listener failed: {e}")
+        if error is not None and len(written) < len(pending):
+            raise error
+
+    def _write(self, pending: List[Tuple[type, dict]]):
+        """在一个事务内批量插入"""
+        # 同一张表的行保持原有顺序, 按表分组后批量插入
+        grouped: Dict[type, List[dict]] = {}
+        for model, row in pending:
+            grouped.setdefault(model, []).append(row)
+
+        db = SessionLocal()
+        try:
+            if TestHistory in grouped:
+                self._apply_batch_counters(db, grouped[TestHistory])
+                self._apply_case_results(db, grouped[TestHistory])
+                grouped[TestHistory] = self._store_sql_texts(db, grouped[TestHistory])
+            for model, rows in grouped.items():
+                if model in self._preparers:
+                    rows = self._preparers[model](db, rows)
+                db.execute(insert(model), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_per_batch(self, pending: List[Tuple[type, dict]]) -> List[Tuple[type, dict]]:
+        """整体写入失败后按批次分别写入, 返回写入成功的行; 失败批次的行放回缓冲或转存"""
+        by_batch: Dict[str, List[Tuple[type, dict]]] = {}
+        for model, row in pending:
+            by_batch.setdefault(row.get("batch_id") or "", []).append((model, row))
+
+        written, retry = [], []
+        for batch_id, rows in by_batch.items():
+            try:
+                self._write(rows)
+                written.extend(rows)
+                continue
+            except Exception as e:
+                logger.error(f"History flush failed for batch {batch_id or '-'}: {e}")
+            failures = self._failures.get(batch_id, 0) + 1
+            if failures >= self.MAX_RETRIES and self._spill(rows, failures):
+                self._failures.pop(batch_id, None)
+            else:
+                self._failures[batch_id] = failures
+                retry.extend(rows)
+
+        if retry:
+            # 放回缓冲头部, 下次刷新重试
+            with self._lock:
+                self._pending = retry + self._pending
+        return written
+
+    def _spill(self, pending: List[Tuple[type, dict]], failures: int) -> bool:
+        """把无法写入数据库的行转存到文件, 返回是否成功"""
+        path = os.path.join(SPILL_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl")
+        try:
+            os.makedirs(SPILL_DIR, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for model, row in pending:
+                    f.write(json.dumps({"table": model.__tablename__, "row": row}, ensure_ascii=False, default=str) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to spill {len(pending)} buffered rows to {path}: {e}")
+            return False
+        batch_ids = {row["batch_id"] for _, row in pending if row.get("batch_id")}
+        with self._lock:
+            self._spilled_batches |= batch_ids
+        logger.error(f"Spilled {len(pending)} buffered rows to {path} after {failures} failed flushes "
+                     f"(batches: {', '.join(sorted(batch_ids))})")
+        return True
+
+    def pop_spilled(self, batch_id: str) -> bool:
+        """批次是否有行被转存 (结果不完整), 查询后清除标记"""
+        with self._lock:
+            if batch_id in self._spilled_batches:
+                self._spilled_batches.discard(batch_id)
+                return True
+            return False
+
+    def drain(self):
+        """写入缓冲中的全部行, 失败时重试直到写入或转存 (不抛出异常)"""
+        for _ in range(self.MAX_RETRIES):
+            try:
+                self.flush()
+                return
+            except Exception as e:
+                logger.error(f"History flush failed: {e}")
+
+    @staticmethod
+    def _store_sql_texts(db, rows: List[dict]) -> List[dict]:
+        """把 actual_sql 正文写入 sql_texts, 返回改为引用 sql_hash 的历史行"""
+        texts: Dict[str, str] = {}
+        stored = []
+        for row in rows:
+            actual_sql = row.get("actual_sql")
+            sql_hash = SqlDigest.digest(actual_sql)
+            if sql_hash is not None:
+                texts.setdefault(sql_hash, actual_sql)
+            stored.append({**row, "actual_sql": None, "sql_hash": sql_hash})
+
+        if texts:
+            db.execute(
+                insert_ignore(SqlText),
+                [{"hash": h, "sql": sql} for h, sql in texts.items()]
+            )
+        return stored
+
+    @staticmethod
+    def _apply_batch_counters(db, rows: List[dict]):
+        """按批次汇总本次写入的结果, 累加到 TestBatch 计数列"""
+        deltas: Dict[str, Dict[str, float]] = {}
+        for row in rows:
+            delta = deltas.setdefault(row["batch_id"], {
+                "completed": 0, "passed": 0, "failed": 0, "errored": 0, "duration": 0.0
+            })
+            delta["completed"] += 1
+            actual_sql = row.get("actual_sql")
+            if row.get("result") == "PASS":
+                delta["passed"] += 1
+            elif not actual_sql or actual_sql.startswith("Error"):
+                # 与 Validator 的判定一致: 接口报错或没有拿到 SQL
+                delta["errored"] += 1
+            else:
+                delta["failed"] += 1
+            delta["duration"] += row.get("duration") or 0.0
+
+        for batch_id, delta in deltas.items():
+            db.execute(
+                update(TestBatch).where(TestBatch.id == batch_id).values(
+                    completed_count=TestBatch.completed_count + delta["completed"],
+                    pass_count=TestBatch.pass_count + delta["passed"],
+                    fail_count=TestBatch.fail_count + delta["failed"],
+                    error_count=TestBatch.error_count + delta["errored"],
+                    duration_sum=TestBatch.duration_sum + delta["duration"]
+                )
+            )
+
+    @staticmethod
+    def _apply_case_results(db, rows: List[dict]):
+        """把每个用例本次写入中最新的结果记到 TestCase.last_result / last_run_at"""
+        latest: Dict[int, dict] = {}
+        for row in rows:
+            current = latest.get(row["case_id"])
+            if current is None or row["run_at"] >= current["run_at"]:
+                latest[row["case_id"]] = row
+
+        # 走 Core executemany (ORM 的按主键批量更新不支持附加 WHERE 条件)
+        db.connection().execute(
+            update(TestCase).where(
+                TestCase.id == bindparam("b_case_id"),
+                or_(TestCase.last_run_at.is_(None), TestCase.last_run_at <= bindparam("b_run_at"))
+            ).values(
+                last_result=bindparam("b_result"),
+                last_run_at=bindparam("b_run_at"),
+                updated_at=TestCase.updated_at  # 运行结果不算用例修改
+            ),
+            [
+                {"b_case_id": case_id, "b_result": row["result"], "b_run_at": row["run_at"]}
+                for case_id, row in latest.items()
+            ]
+        )
+
+    def close(self):
+        """停止后台线程并写入剩余的行"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval * 4)
+            self._thread = None
+        self.drain()
+
+
+history_writer = HistoryWriter(
+    max_rows=int(Config.get("HISTORY_FLUSH_ROWS", 200)),
+    flush_interval=float(Config.get("HISTORY_FLUSH_INTERVAL", 0.5))
+)
+atexit.register(history_writer.close)
@@ -2,7 +2,12 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from .models import init_db
+from .models import init_db, async_engine
+from .batch_state import BatchStateStore
+from .history_writer import history_writer
+from .config_store import config_store
+from backend.core.validation_pool import validation_pool
+from .pagination import PAGINATION_HEADERS
 from .routers import cases, runner, generator, config, reports, templates, tools
 
 # Initialize DB tables
@@ -18,6 +23,19 @@ app = FastAPI(
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    # 回收上次进程退出时遗留的 RUNNING 批次
+    BatchStateStore.reap_stale()
+    # 加载系统配置, 并轮询版本号以感知其他 worker 的修改
+    config_store.load()
+    config_store.start()
+
+# 关闭前把缓冲中的执行结果写入数据库
+@app.on_event("shutdown")
+async def shutdown_event():
+    config_store.close()
+    history_writer.close()
+    validation_pool.close()
+    await async_engine.dispose()
 
 # CORS Configuration
 # 开发环境下允许所有来源以支持局域网访问
@@ -27,6 +45,7 @@ app.add_middleware(
     allow_credentials=False,  # 当 allow_origins 为 ["*"] 时，allow_credentials 必须为 False
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=PAGINATION_HEADERS,
 )
 
 app.include_router(cases.router)
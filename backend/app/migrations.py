@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+轻量级数据库迁移
+
+create_all 只会创建缺失的表, 已部署的 data/autotest.db 需要额外处理:
+1. 结构同步: 补齐模型中新增的列和索引 (由模型定义推导, 每次启动检查)
+2. 版本迁移: 数据回填等一次性操作, 按版本号顺序执行, 执行记录保存在 schema_migrations 表
+   (SchemaMigration, 与其他表一样由 create_all 按方言建表)
+"""
+
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+from .models import Base, SqlText
+from .database import insert_ignore
+
+logger = logging.getLogger("Backend.Migrations")
+
+# (版本号, 说明, 执行函数)
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+
+def migration(version: int, description: str):
+    """注册一个版本迁移, 版本号必须递增且不可复用"""
+    def decorator(func: Callable[[Connection], None]):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def add_missing_columns(conn: Connection) -> List[Tuple[str, str]]:
+    """为已有表补齐模型中新增的列, 返回新增的 (表名, 列名)"""
+    added = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            quoted = conn.dialect.identifier_preparer.quote(column.name)
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {quoted} {column.type.compile(dialect=conn.dialect)}"
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg}"
+            conn.execute(text(ddl))
+            added.append((table.name, column.name))
+    return added
+
+
+def add_missing_indexes(conn: Connection) -> List[str]:
+    """创建模型中声明但数据库中不存在的索引, 返回新建的索引名"""
+    created = []
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {idx["name"] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(conn)
+            created.append(index.name)
+    return created
+
+
+# PostgreSQL advisory lock 的键, 任意固定值即可
+MIGRATION_LOCK_KEY = 727001
+
+def _lock_for_migration(conn: Connection):
+    """
+    多个 worker 同时启动时串行执行迁移
+
+    pysqlite 默认不为 DDL 开启事务, 这里显式 BEGIN IMMEDIATE 拿到写锁,
+    后启动的 worker 会等待 (busy_timeout) 并在拿到锁后看到已完成的结构变更。
+    PostgreSQL 使用事务级 advisory lock; MySQL 的 DDL 隐式提交, 依赖
+    CREATE ... IF NOT EXISTS / schema_migrations 主键保证重复执行无害。
+    """
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+
+def run_migrations(engine: Engine):
+    """创建缺失的表, 同步列和索引, 再执行尚未执行的版本迁移"""
+    with engine.begin() as conn:
+        _lock_for_migration(conn)
+        Base.metadata.create_all(conn)
+        for table_name, column_name in add_missing_columns(conn):
+            logger.info(f"Added column {table_name}.{column_name}")
+        created = add_missing_indexes(conn)
+        for index_name in created:
+            logger.info(f"Created index {index_name}")
+
+    for version, description, func in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock_for_migration(conn)
+            applied = conn.execute(
+                text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": version}
+            ).first()
+            if applied:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            func(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.now()}
+            )
+
+    # 新建索引后刷新统计信息, 让查询规划器用上它们
+    if created and engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("PRAGMA optimize"))
+
+
+def explain_query_plan(conn: Connection, sql: str, params: dict = None) -> List[str]:
+    """返回 SQLite EXPLAIN QUERY PLAN 的 detail 列, 用于确认查询命中了索引"""
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params or {})
+    return [row[-1] for row in rows]
+
+
+# ================= 版本迁移 =================
+
+@migration(1, "backfill batch counters from test_history")
+def _backfill_batch_counters(conn: Connection):
+    conn.execute(text("""
+        UPDATE test_batches SET
+            completed_count = (SELECT COUNT(*) FROM test_history h WHERE h.batch_id = test_batches.id),
+            pass_count = (SELECT COUNT(*) FROM test_history h WHERE h.batch_id = test_batches.id AND h.result = 'PASS'),
+            error_count = (SELECT COUNT(*) FROM test_history h WHERE h.batch_id = test_batches.id
+                           AND h.result != 'PASS' AND (h.actual_sql IS NULL OR h.actual_sql = '' OR h.actual_sql LIKE 'Error%')),
+            fail_count = (SELECT COUNT(*) FROM test_history h WHERE h.batch_id = test_batches.id
+                          AND h.result != 'PASS' AND h.actual_sql != '' AND h.actual_sql NOT LIKE 'Error%'),
+            duration_sum = (SELECT COALESCE(SUM(h.duration), 0) FROM test_history h WHERE h.batch_id = test_batches.id)
+    """))
+
+@migration(2, "move test_history.actual_sql into content-addressed sql_texts")
+def _backfill_sql_texts(conn: Connection):
+    from backend.core.sql_digest import SqlDigest
+
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, actual_sql FROM test_history "
+            "WHERE id > :last_id AND actual_sql IS NOT NULL AND sql_hash IS NULL "
+            "ORDER BY id LIMIT 5000"
+        ), {"last_id": last_id}).all()
+        if not rows:
+            break
+
+        texts, updates = {}, []
+        for row_id, actual_sql in rows:
+            sql_hash = SqlDigest.digest(actual_sql)
+            if sql_hash is not None:
+                texts.setdefault(sql_hash, actual_sql)
+            updates.append({"id": row_id, "sql_hash": sql_hash})
+        if texts:
+            conn.execute(
+                insert_ignore(SqlText, conn.dialect.name),
+                [{"hash": h, "sql": sql} for h, sql in texts.items()]
+            )
+        conn.execute(
+            text("UPDATE test_history SET sql_hash = :sql_hash, actual_sql = NULL WHERE id = :id"),
+            updates
+        )
+        last_id = rows[-1][0]
+
+@migration(3, "backfill test_cases.last_result / last_run_at from test_history")
+def _backfill_case_last_result(conn: Connection):
+    # 相关子查询走 ix_test_history_case_run_at, 每个用例只读一行
+    conn.execute(text("""
+        UPDATE test_cases SET
+            last_run_at = (SELECT h.run_at FROM test_history h WHERE h.case_id = test_cases.id
+                           ORDER BY h.run_at DESC LIMIT 1),
+            last_result = (SELECT h.result FROM test_history h WHERE h.case_id = test_cases.id
+                           ORDER BY h.run_at DESC LIMIT 1)
+    """))
+
+@migration(4, "full-text index over test_cases (FTS5 trigram)")
+def _create_case_fts(conn: Connection):
+    from .search import create_fts_index
+    create_fts_index(conn)
+
+@migration(5, "backfill test_cases.question_hash for idempotent imports")
+def _backfill_question_hash(conn: Connection):
+    from backend.core.case_importer import CaseImporter
+
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, question FROM test_cases WHERE id > :last_id ORDER BY id LIMIT 5000"
+        ), {"last_id": last_id}).all()
+        if not rows:
+            break
+        conn.execute(
+            text("UPDATE test_cases SET question_hash = :h WHERE id = :id"),
+            [{"id": row_id, "h": CaseImporter.question_hash(question or "")} for row_id, question in rows]
+        )
+        last_id = rows[-1][0]
+
+
+@migration(6, "precompile test_cases expectations")
+def _backfill_compiled_expectations(conn: Connection):
+    import json
+    from backend.core.expectations import Expectations, ExpectationError, EXPECTATIONS_VERSION
+
+    last_id = 0
+    malformed = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, expected_keywords, expected_conditions FROM test_cases "
+            "WHERE id > :last_id ORDER BY id LIMIT 5000"
+        ), {"last_id": last_id}).all()
+        if not rows:
+            break
+        params = []
+        for row_id, keywords, conditions in rows:
+            try:
+                compiled = Expectations.compile(keywords, conditions)
+            except ExpectationError:
+                # 存量用例不拒绝, 按原有规则编译, 下次编辑保存时再提示
+                malformed += 1
+                compiled = Expectations.compile(keywords, conditions, strict=False)
+            params.append({"id": row_id, "c": json.dumps(compiled, ensure_ascii=False), "v": EXPECTATIONS_VERSION})
+        conn.execute(
+            text("UPDATE test_cases SET compiled_expectations = :c, expectations_version = :v WHERE id = :id"),
+            params
+        )
+        last_id = rows[-1][0]
+    if malformed:
+        logger.warning(f"{malformed} existing cases have malformed expectations")
+
+
+# 模型中已不再声明的索引 (被新的复合索引取代); add_missing_indexes 只建不删, 需要在迁移中删除
+SUPERSEDED_INDEXES = [
+    ("test_batches", "ix_test_batches_start_time"),  # -> ix_test_batches_start_id
+]
+
+@migration(7, "drop indexes superseded by newer composite indexes")
+def _drop_superseded_indexes(conn: Connection):
+    inspector = inspect(conn)
+    for table_name, index_name in SUPERSEDED_INDEXES:
+        if not inspector.has_table(table_name):
+            continue
+        if index_name not in {idx["name"] for idx in inspector.get_indexes(table_name)}:
+            continue
+        # MySQL 的 DROP INDEX 需要指定表名, 且不支持 IF EXISTS
+        on_table = f" ON {table_name}" if conn.dialect.name == "mysql" else ""
+        conn.execute(text(f"DROP INDEX {index_name}{on_table}"))
+        logger.info(f"Dropped superseded index {index_name}")
@@ -1,90 +1,193 @@
 # -*- coding: utf-8 -*-
-from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, create_engine, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Text, Boolean, DateTime, ForeignKey, Index, JSON, func, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import relationship, aliased
 from datetime import datetime
-import os
 
-# SQLite database URL
-BASE_DIR = os.path.dirname(os.path.abspath(__file__)) # .../backend/app
-PROJECT_ROOT = os.path.dirname(os.path.dirname(BASE_DIR)) # .../apiautotest
-DATA_DIR = os.path.join(PROJECT_ROOT, "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(DATA_DIR, 'autotest.db')}"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# 连接配置见 database.py, 这里重新导出以兼容 from .models import engine / SessionLocal 的写法
+from .database import (
+    DATA_DIR, SQLALCHEMY_DATABASE_URL, ASYNC_DATABASE_URL, SQLITE_PRAGMAS, IS_SQLITE,
+    engine, async_engine, SessionLocal, AsyncSessionLocal
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 class SystemConfig(Base):
     """系统配置表"""
     __tablename__ = "system_config"
-    key = Column(String, primary_key=True, index=True)
+    key = Column(String(255), primary_key=True, index=True)
     value = Column(Text, nullable=False)
-    description = Column(String, nullable=True)
+    description = Column(String(255), nullable=True)
+
+class SchemaMigration(Base):
+    """已执行的版本迁移 (见 migrations.py)"""
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    description = Column(String(255), nullable=True)
+    applied_at = Column(DateTime, nullable=True)
 
 class TestBatch(Base):
     """测试批次表"""
     __tablename__ = "test_batches"
+    __table_args__ = (
+        Index("ix_test_batches_status_start", "status", "start_time"), # 运行中批次
+        Index("ix_test_batches_start_id", "start_time", "id"),         # 报告列表按时间倒序 (游标分页)
+    )
     
-    id = Column(String, primary_key=True, index=True) # UUID
+    id = Column(String(255), primary_key=True, index=True) # UUID
     start_time = Column(DateTime, default=datetime.now)
     end_time = Column(DateTime, nullable=True)
-    status = Column(String, default="RUNNING") # RUNNING, COMPLETED, STOPPED
+    status = Column(String(255), default="RUNNING") # RUNNING, COMPLETED, STOPPED, FAILED (部分结果未能写入, 见 history_writer)
     total_count = Column(Integer, default=0)
-    pass_count = Column(Integer, default=0)
+    # 运行中计数, 与执行结果在同一事务内累加 (见 history_writer)
+    completed_count = Column(Integer, default=0, server_default="0")
+    pass_count = Column(Integer, default=0, server_default="0")
+    fail_count = Column(Integer, default=0, server_default="0")   # 校验未通过 (不含 error)
+    error_count = Column(Integer, default=0, server_default="0")  # 接口报错 / 无 SQL
+    duration_sum = Column(Float, default=0.0, server_default="0") # 执行耗时合计 (秒)
+    # 归档: 明细已移出 test_history, 保存在 data/archive/<archive_path>
+    archived_at = Column(DateTime, nullable=True)
+    archive_path = Column(String(255), nullable=True)
 
 class TestCase(Base):
     __tablename__ = "test_cases"
+    __table_args__ = (
+        Index("ix_test_cases_active_category", "is_active", "category"),
+        Index("ix_test_cases_last_result", "last_result"),
+        Index("ix_test_cases_created_at", "created_at"),
+        Index("ix_test_cases_question_hash", "question_hash"), # 导入时按问题去重
+        Index("ix_test_cases_external_id", "external_id"),     # 导入时按外部编号去重
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text, nullable=False)
     expected_keywords = Column(Text, nullable=True)
     expected_conditions = Column(Text, nullable=True)
     expected_sql = Column(Text, nullable=True) # New field for SQL Diff
-    category = Column(String, index=True, nullable=True)
+    # 预期关键字 / 条件的编译结果 (见 backend/core/expectations.py), 保存 / 导入 / 生成用例时写入
+    compiled_expectations = Column(JSON, nullable=True)
+    expectations_version = Column(Integer, nullable=True)
+    category = Column(String(255), index=True, nullable=True)
+    # 导入文件中的预期实体 / 说明 (生成脚本输出的 CSV 自带这些列)
+    expect_company = Column(String(255), nullable=True)
+    expect_indicator = Column(String(255), nullable=True)
+    expect_time = Column(String(255), nullable=True)
+    description = Column(Text, nullable=True)
+    # 导入去重键: 标准化问题的 hash (见 CaseImporter.question_hash), 以及可选的外部编号
+    question_hash = Column(String(40), nullable=True)
+    external_id = Column(String(255), nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # 最近一次运行结果, 随历史记录写入更新 (见 history_writer), 用于列表筛选
+    last_result = Column(String(255), nullable=True)
+    last_run_at = Column(DateTime, nullable=True)
 
 class TestHistory(Base):
     __tablename__ = "test_history"
+    __table_args__ = (
+        Index("ix_test_history_case_run_at", "case_id", "run_at"),   # 用例历史 / 最近一次结果
+        Index("ix_test_history_batch_result", "batch_id", "result"), # 批次内按结果统计 (覆盖索引)
+        Index("ix_test_history_sql_hash", "sql_hash"),                # 归档后清理无引用的 sql_texts
+        Index("ix_test_history_batch_similarity", "batch_id", "similarity"), # 批次内按相似度排序
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    batch_id = Column(String, ForeignKey("test_batches.id"), index=True)
+    batch_id = Column(String(255), ForeignKey("test_batches.id"), index=True)
     case_id = Column(Integer, ForeignKey("test_cases.id"))
     question = Column(Text)
-    actual_sql = Column(Text)
-    result = Column(String) # PASS / FAIL
+    actual_sql = Column(Text) # 旧数据; 新记录的 SQL 正文存放在 sql_texts, 这里为空
+    sql_hash = Column(String(40), nullable=True) # -> SqlText.hash
+    result = Column(String(255)) # PASS / FAIL
     error_message = Column(Text, nullable=True)
+    duration = Column(Float, nullable=True) # 执行耗时 (秒)
+    similarity = Column(Float, nullable=True) # 与预期的相似度 0~1 (见 core/similarity.py), 无从比较时为空
     run_at = Column(DateTime, default=datetime.now)
 
+class SqlText(Base):
+    """SQL 正文 (内容寻址, 相同 SQL 只存一份)"""
+    __tablename__ = "sql_texts"
+
+    hash = Column(String(40), primary_key=True) # SqlDigest.digest(sql)
+    sql = Column(Text, nullable=False)
+
+# 历史记录的实际 SQL: 优先取 sql_texts, 兼容仍保存在 actual_sql 列中的旧数据
+# 查询时需要 .outerjoin(SqlText, SqlText.hash == TestHistory.sql_hash)
+history_actual_sql = func.coalesce(SqlText.sql, TestHistory.actual_sql).label("actual_sql")
+
+def previous_sql_hash():
+    """
+    同一用例上一次运行的 sql_hash (相关子查询, 走 ix_test_history_case_run_at)
+    没有上一次运行时为 NULL, 上一次没有拿到 SQL 时为 ''
+    """
+    prev = aliased(TestHistory)
+    return (
+        select(func.coalesce(prev.sql_hash, ""))
+        .where(prev.case_id == TestHistory.case_id, prev.run_at < TestHistory.run_at)
+        .order_by(prev.run_at.desc())
+        .limit(1)
+        .correlate(TestHistory)
+        .scalar_subquery()
+        .label("prev_sql_hash")
+    )
+
+def sql_changed(sql_hash, prev_sql_hash):
+    """与上一次运行相比 SQL 是否变化, 没有上一次运行时返回 None"""
+    if prev_sql_hash is None:
+        return None
+    return (sql_hash or "") != prev_sql_hash
+
+class BatchEvent(Base):
+    """批次事件日志 (WebSocket 断线重连时按 seq 补发)"""
+    __tablename__ = "batch_events"
+    __table_args__ = (
+        Index("ux_batch_events_batch_seq", "batch_id", "seq", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String(255), ForeignKey("test_batches.id"), nullable=False)
+    seq = Column(Integer, nullable=False) # 批次内单调递增序号, 从 1 开始
+    type = Column(String(255), nullable=False) # init / running / update / done / error
+    payload = Column(Text, nullable=False) # 完整消息 JSON
+    created_at = Column(DateTime, default=datetime.now)
+
+class BatchControl(Base):
+    """批次控制状态 (多 worker / 多主机共享: 归属、停止信号、进度心跳)"""
+    __tablename__ = "batch_control"
+
+    batch_id = Column(String(255), ForeignKey("test_batches.id"), primary_key=True)
+    owner = Column(String(255), nullable=False) # 执行该批次的 worker, hostname:pid
+    stop_requested = Column(Boolean, default=False)
+    completed_count = Column(Integer, default=0)
+    current_case_id = Column(Integer, nullable=True)
+    heartbeat_at = Column(DateTime, default=datetime.now)
+
 class InterfaceTemplate(Base):
     """API 接口定义模板表"""
     __tablename__ = "interface_templates"
+    __table_args__ = (
+        Index("ix_interface_templates_active", "is_active"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     project_id = Column(Integer, default=1, index=True)
-    code = Column(String, unique=True, index=True, nullable=False) # 唯一标识
-    name = Column(String, nullable=False)
+    code = Column(String(255), unique=True, index=True, nullable=False) # 唯一标识
+    name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
-    version = Column(String, default="v1.0")
+    version = Column(String(255), default="v1.0")
     
     # Request Config
-    base_url = Column(String, nullable=False)
-    method = Column(String, nullable=False) # GET/POST/PUT...
-    endpoint = Column(String, nullable=False) # /api/v1/users/{id}
+    base_url = Column(String(255), nullable=False)
+    method = Column(String(255), nullable=False) # GET/POST/PUT...
+    endpoint = Column(String(255), nullable=False) # /api/v1/users/{id}
     
-    body_type = Column(String, default="json") # json/form-data/raw/none
+    body_type = Column(String(255), default="json") # json/form-data/raw/none
     body_template = Column(Text, nullable=True) # Jinja2 template
     query_params = Column(Text, nullable=True) # JSON String
     headers = Column(Text, nullable=True)      # JSON String
     
     # Auth Config
-    auth_type = Column(String, default="none") # none/bearer/apikey...
+    auth_type = Column(String(255), default="none") # none/bearer/apikey...
     auth_config = Column(Text, nullable=True)  # JSON String
     
     # Response Config
@@ -95,11 +198,12 @@ class InterfaceTemplate(Base):
     retry_count = Column(Integer, default=0)
     
     is_active = Column(Boolean, default=True)
-    created_by = Column(String, default="system")
+    created_by = Column(String(255), default="system")
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 # Create tables
 def init_db():
-    # 仅创建不存在的表，不再删除已有数据
-    Base.metadata.create_all(bind=engine)
+    # 仅创建不存在的表，不再删除已有数据; 已有库的新增列/索引/数据回填由迁移完成
+    from .migrations import run_migrations
+    run_migrations(engine)
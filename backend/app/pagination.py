@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+列表接口的游标 (keyset) 分页
+
+游标是排序键 (例如 id, 或 start_time + id) 的 base64 JSON 编码。下一页直接
+WHERE 排序键 > / < 游标, 由索引定位起点, 翻到多深都不用扫描并丢弃前面的行。
+响应体保持为列表, 分页信息放在响应头:
+- X-Next-Cursor: 下一页游标, 没有下一页时不返回
+- X-Total-Count: 满足筛选条件的总数 (超过 COUNT_ESTIMATE_CAP 时只数到上限,
+  并返回 X-Total-Count-Estimated: true)
+"""
+
+import json
+import base64
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+
+from fastapi import HTTPException, Response
+from sqlalchemy import func, select
+
+# 单页最多返回的条数 (limit 参数的上限)
+MAX_PAGE_SIZE = 1000
+
+# 总数统计的上限, 避免大表上的精确 COUNT(*) 拖慢每次翻页
+COUNT_ESTIMATE_CAP = 10000
+
+# 响应头 (需要在 CORS expose_headers 中声明, 前端才能读取)
+PAGINATION_HEADERS = ["X-Next-Cursor", "X-Total-Count", "X-Total-Count-Estimated"]
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(raw).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """解析游标, 格式错误时返回 400"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid datetime: {value}")
+
+
+def count_statement(key_column, conditions: Sequence[Any]):
+    """满足筛选条件 (不含游标) 的封顶计数语句, 最多数到 COUNT_ESTIMATE_CAP + 1"""
+    capped = select(key_column).where(*conditions).limit(COUNT_ESTIMATE_CAP + 1).subquery()
+    return select(func.count()).select_from(capped)
+
+
+def set_page_headers(response: Response, total: int, next_cursor: Optional[str]):
+    if total > COUNT_ESTIMATE_CAP:
+        response.headers["X-Total-Count"] = str(COUNT_ESTIMATE_CAP)
+        response.headers["X-Total-Count-Estimated"] = "true"
+    else:
+        response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+报告文件缓存
+
+已结束的批次内容不再变化, 其 Excel 报告只生成一次, 存放在 data/report_cache/<batch_id>-<key>.xlsx:
+- key 由批次状态 (状态、计数、结束 / 归档时间) 和所含用例的最后修改时间计算,
+  任一变化 (或 REPORT_VERSION 递增) 都会得到新的 key; 重新校验写回结果后主动失效
+- 先写唯一的临时文件再 rename, 并发下载同一批次不会读到写了一半的文件
+- 以 key 作为 ETag, 客户端带 If-None-Match 时直接返回 304; Range 请求由 FileResponse 处理
+- 总大小超过 REPORT_CACHE_MAX_MB 时按最近使用时间 (命中时刷新 mtime) 淘汰最旧的文件
+
+运行中的批次每次生成到唯一的临时文件, 响应发送完后删除。
+"""
+
+import os
+import glob
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import func, select
+
+from .models import DATA_DIR, TestBatch, TestCase, TestHistory
+from backend.core.config import Config
+
+logger = logging.getLogger("Backend.ReportCache")
+
+REPORT_CACHE_DIR = os.path.join(DATA_DIR, "report_cache")
+
+# 报告格式版本, 报告内容或样式变化时递增, 旧缓存自然失效
+REPORT_VERSION = 1
+
+# 最近使用过的文件在该时间 (秒) 内不淘汰, 避免删除正在发送的文件
+EVICTION_GRACE_SECONDS = 60
+
+# 遗留的临时文件 (进程在写入中途退出) 超过该时间 (秒) 后清理
+STALE_TMP_SECONDS = 3600
+
+
+class ReportArtifact(NamedTuple):
+    path: str
+    etag: Optional[str]     # 运行中的批次没有 ETag
+    temporary: bool         # True 时发送完后删除
+
+
+class ReportCache:
+    """批次报告的磁盘缓存"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # 同一 key 只生成一次; 按 key 的哈希分到固定数量的锁上
+        self._locks = [threading.Lock() for _ in range(32)]
+        self._evict_lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(db, batch: TestBatch) -> Optional[str]:
+        """批次内容的 key, 运行中的批次返回 None (不缓存)"""
+        if batch.status == "RUNNING":
+            return None
+        cases_updated = None
+        if not batch.archived_at:
+            # 报告中的预期关键字 / 条件取自用例当前内容 (归档文件中是归档时的快照)
+            cases_updated = db.execute(
+                select(func.max(TestCase.updated_at)).where(
+                    TestCase.id.in_(select(TestHistory.case_id).where(TestHistory.batch_id == batch.id))
+                )
+            ).scalar()
+        state = "|".join(str(v) for v in (
+            REPORT_VERSION, batch.id, batch.status, batch.end_time, batch.archived_at,
+            batch.completed_count, batch.pass_count, batch.fail_count, batch.error_count, cases_updated
+        ))
+        return hashlib.sha1(state.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def etag(key: str) -> str:
+        return f'"{key}"'
+
+    def _path(self, batch_id: str, key: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}-{key[:20]}.xlsx")
+
+    def _tmp_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+
+    def get(self, db, batch: TestBatch, build: Callable[[str], Dict[str, Any]]) -> ReportArtifact:
+        """
+        取批次报告, 没有缓存时调用 build(path) 生成
+
+        Args:
+            build: 把报告写到给定路径, 返回 Reporter.write_report 的统计信息
+
+        Raises:
+            ValueError: 批次没有结果
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        key = self.cache_key(db, batch)
+        if key is None:
+            path = self._tmp_path(f"running-{batch.id}")
+            self._build(build, path)
+            return ReportArtifact(path, None, True)
+
+        path = self._path(batch.id, key)
+        with self._locks[int(key[:8], 16) % len(self._locks)]:
+            if os.path.exists(path):
+                # 刷新 mtime, 作为 LRU 的最近使用时间
+                os.utime(path, None)
+                return ReportArtifact(path, self.etag(key), False)
+
+            tmp_path = self._tmp_path(os.path.basename(path))
+            self._build(build, tmp_path)
+            os.replace(tmp_path, path)
+            logger.info(f"Cached report for batch {batch.id}: {path}")
+
+        self._remove_stale(batch.id, keep=path)
+        self.evict()
+        return ReportArtifact(path, self.etag(key), False)
+
+    @staticmethod
+    def _build(build: Callable[[str], Dict[str, Any]], path: str):
+        try:
+            stats = build(path)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        if not stats["total"]:
+            os.remove(path)
+            raise ValueError("No results to export")
+
+    def _remove_stale(self, batch_id: str, keep: Optional[str] = None):
+        for path in glob.glob(os.path.join(glob.escape(self.directory), f"{glob.escape(batch_id)}-*.xlsx")):
+            if path != keep:
+                self._unlink(path)
+
+    def invalidate(self, batch_id: str):
+        """删除批次的缓存报告 (批次结果被改写后调用)"""
+        self._remove_stale(batch_id)
+
+    def evict(self):
+        """总大小超过上限时按 mtime 从旧到新删除, 同时清理遗留的临时文件"""
+        with self._evict_lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory) if os.path.isdir(self.directory) else ():
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith(".tmp"):
+                    if now - stat.st_mtime > STALE_TMP_SECONDS:
+                        self._unlink(entry.path)
+                elif entry.name.endswith(".xlsx"):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if now - mtime < EVICTION_GRACE_SECONDS:
+                    continue
+                if self._unlink(path):
+                    total -= size
+                    logger.info(f"Evicted cached report: {path}")
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        """删除文件, 返回是否已不存在; Windows 上正在被其他下载读取的文件删除失败, 留到下次淘汰时再删"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove cached report {path}: {e}")
+            return False
+        return True
+
+
+report_cache = ReportCache(REPORT_CACHE_DIR, max_bytes=int(float(Config.get("REPORT_CACHE_MAX_MB", 512)) * 2 ** 20))
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+历史批次重新校验
+
+用例的预期关键字 / 条件 (或标准 SQL、校验模式) 修改后, 已执行批次的 SQL 不必重新提问, 用当前预期重新判定即可。
+整批结果用 BatchValidator 一次校验 (使用用例保存时编译好的预期, 相同 SQL 只标准化一次;
+CPU 密集的校验模式分包交给校验进程池),
+apply 时只回写判定发生变化的行, 并同步批次计数和用例的最近一次结果。
+相似度分数同时按当前预期重新计算, apply 时回写有变化的分数 (也用于补齐升级前的历史行)。
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from sqlalchemy import bindparam, select, update
+
+from .analytics import mark_history_changed
+from .config_store import config_store
+from .models import SessionLocal, TestBatch, TestCase, TestHistory, SqlText, history_actual_sql
+from .report_cache import report_cache
+from backend.core.validator import BatchValidator
+from backend.core.validation_pool import validation_pool
+from backend.core.expectations import Expectations
+from backend.core.similarity import SimilarityScorer
+
+logger = logging.getLogger("Backend.Revalidation")
+
+
+class HistoryRevalidator:
+    """按当前用例预期重新校验一个批次"""
+
+    @staticmethod
+    def run(batch_id: str, apply: bool = False) -> Dict[str, Any]:
+        """
+        Args:
+            apply: False 时只返回判定变化, True 时写回数据库
+
+        Returns:
+            {"batch_id", "total", "passed", "failed", "avg_similarity", "applied", "changes": [...]}
+
+        Raises:
+            LookupError: 批次不存在
+            ValueError: 批次仍在运行或已归档
+        """
+        db = SessionLocal()
+        try:
+            batch = db.get(TestBatch, batch_id)
+            if batch is None:
+                raise LookupError(f"Batch not found: {batch_id}")
+            if batch.status == "RUNNING":
+                raise ValueError("Batch is still running")
+            if batch.archived_at:
+                raise ValueError("Batch is archived")
+
+            rows = db.execute(
+                select(
+                    TestHistory.id, TestHistory.case_id, TestHistory.result, TestHistory.run_at, TestHistory.similarity,
+                    history_actual_sql, TestCase.expected_keywords, TestCase.expected_conditions,
+                    TestCase.compiled_expectations, TestCase.expectations_version, TestCase.expected_sql
+                ).join(
+                    TestCase, TestHistory.case_id == TestCase.id
+                ).outerjoin(
+                    SqlText, SqlText.hash == TestHistory.sql_hash
+                ).where(TestHistory.batch_id == batch_id).order_by(TestHistory.id)
+            ).all()
+
+            compiled = [
+                Expectations.load(r.compiled_expectations, r.expectations_version,
+                                  r.expected_keywords, r.expected_conditions)
+                for r in rows
+            ]
+            expected_sqls = [r.expected_sql for r in rows]
+            actual_sqls = [row.actual_sql or "" for row in rows]
+            validator = BatchValidator(compiled, expected_sqls=expected_sqls, mode=config_store.settings.validation_mode)
+            results = validation_pool.validate_all(validator, actual_sqls)
+            scores = SimilarityScorer.score_batch(actual_sqls, expected_sqls, compiled)
+            rescored = [
+                {"b_id": row.id, "similarity": score}
+                for row, score in zip(rows, scores) if score != row.similarity
+            ]
+            changes = []
+            passed = 0
+            for row, (is_pass, message) in zip(rows, results):
+                result = "PASS" if is_pass else "FAIL"
+                passed += is_pass
+                if result != row.result:
+                    changes.append({
+                        "history_id": row.id, "case_id": row.case_id, "run_at": row.run_at,
+                        "old_result": row.result, "result": result, "message": message
+                    })
+
+            if apply and (changes or rescored):
+                # 分析快照按 id 增量追加, 看不到原地改写, 需要通知其重建
+                mark_history_changed(db)
+            if apply and changes:
+                HistoryRevalidator._apply(db, batch, changes)
+            if apply and rescored:
+                db.connection().execute(
+                    update(TestHistory.__table__).where(TestHistory.__table__.c.id == bindparam("b_id")),
+                    rescored
+                )
+            if apply and (changes or rescored):
+                db.commit()
+                # 相似度改写不影响批次计数, 缓存的报告须主动删除
+                report_cache.invalidate(batch_id)
+                logger.info(f"Revalidated batch {batch_id}: {len(changes)} results changed, {len(rescored)} rescored")
+
+            return {
+                "batch_id": batch_id,
+                "total": len(rows),
+                "passed": passed,
+                "failed": len(rows) - passed,
+                "avg_similarity": HistoryRevalidator._mean(scores),
+                "applied": apply,
+                "changes": [
+                    {k: c[k] for k in ("case_id", "old_result", "result", "message")} for c in changes
+                ],
+            }
+        finally:
+            db.close()
+
+    @staticmethod
+    def _mean(scores) -> Optional[float]:
+        values = [s for s in scores if s is not None]
+        return round(sum(values) / len(values), 4) if values else None
+
+    @staticmethod
+    def _apply(db, batch: TestBatch, changes):
+        conn = db.connection()
+        conn.execute(
+            update(TestHistory.__table__).where(TestHistory.__table__.c.id == bindparam("b_id")),
+            [{"b_id": c["history_id"], "result": c["result"], "error_message": c["message"]} for c in changes]
+        )
+
+        # 报错的行重新校验仍是 FAIL, 判定变化只发生在 PASS / FAIL 之间
+        gained = sum(1 for c in changes if c["result"] == "PASS") - sum(1 for c in changes if c["old_result"] == "PASS")
+        batch.pass_count = (batch.pass_count or 0) + gained
+        batch.fail_count = (batch.fail_count or 0) - gained
+
+        # 只有该批次仍是用例最近一次运行时才更新 last_result
+        conn.execute(
+            update(TestCase).where(
+                TestCase.id == bindparam("b_case_id"),
+                TestCase.last_run_at == bindparam("b_run_at")
+            ).values(
+                last_result=bindparam("b_result"),
+                updated_at=TestCase.updated_at
+            ),
+            [{"b_case_id": c["case_id"], "b_run_at": c["run_at"], "b_result": c["result"]} for c in changes]
+        )
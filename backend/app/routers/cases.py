@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Response, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
-import pandas as pd
-import io
+from typing import List, Optional
+from datetime import datetime
+import json
 
 from .. import models, schemas
 from ..models import SessionLocal, TestCase
+from ..pagination import MAX_PAGE_SIZE, encode_cursor, decode_cursor, count_statement, set_page_headers
+from ..search import CaseSearch, text_filter
+from ..exporter import StreamExporter, EXPORT_FORMATS, CASE_COLUMNS
+from ..analytics import mark_history_changed
+from backend.core.case_importer import CaseImporter, CaseImportError
+from backend.core.expectations import Expectations, ExpectationError
 
 router = APIRouter(
     prefix="/cases",
@@ -21,14 +29,118 @@ def get_db():
     finally:
         db.close()
 
+def _case_conditions(
+    db: Session,
+    category: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    last_result: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+) -> list:
+    """列表 / 导出共用的筛选条件"""
+    conditions = []
+    if category is not None:
+        conditions.append(TestCase.category == category)
+    if is_active is not None:
+        conditions.append(TestCase.is_active == is_active)
+    if last_result is not None:
+        # NONE 表示从未运行过
+        conditions.append(TestCase.last_result.is_(None) if last_result == "NONE" else TestCase.last_result == last_result)
+    if created_from is not None:
+        conditions.append(TestCase.created_at >= created_from)
+    if created_to is not None:
+        conditions.append(TestCase.created_at < created_to)
+    if q and q.strip():
+        conditions.append(text_filter(db, q))
+    return conditions
+
 @router.get("/", response_model=List[schemas.TestCase])
-def read_cases(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    cases = db.query(TestCase).offset(skip).limit(limit).all()
+def read_cases(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0),
+    category: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    last_result: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    用例列表 (按 id 升序, 游标分页)
+
+    下一页游标见响应头 X-Next-Cursor, 总数见 X-Total-Count。
+    skip 仅为兼容旧调用保留, 传入 cursor 时忽略。
+    """
+    conditions = _case_conditions(db, category, is_active, last_result, created_from, created_to, q)
+
+    stmt = select(TestCase).where(*conditions).order_by(TestCase.id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        stmt = stmt.where(TestCase.id > last_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    cases = db.scalars(stmt.limit(limit + 1)).all()
+    next_cursor = encode_cursor([cases[limit - 1].id]) if len(cases) > limit else None
+    set_page_headers(response, db.scalar(count_statement(TestCase.id, conditions)), next_cursor)
+    return cases[:limit]
+
+@router.get("/export")
+def export_cases(
+    format: str = "csv",
+    category: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    last_result: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    q: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    流式导出用例库 (format: csv / ndjson / parquet), 筛选参数与列表接口相同
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    conditions = _case_conditions(db, category, is_active, last_result, created_from, created_to, q)
+    try:
+        body = StreamExporter.stream(StreamExporter.cases_statement(conditions), CASE_COLUMNS, format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        body, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="cases.{extension}"'}
+    )
+
+@router.get("/search", response_model=List[schemas.TestCase])
+def search_cases(response: Response, q: str, offset: int = Query(0, ge=0),
+                 limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE), db: Session = Depends(get_db)):
+    """
+    全文检索用例 (问题 / 预期关键字 / 标准 SQL), 按相关度排序
+
+    总数见响应头 X-Total-Count。
+    """
+    cases, total = CaseSearch.search(db, q, offset=offset, limit=limit)
+    response.headers["X-Total-Count"] = str(total)
     return cases
 
+def _compile_expectations(db_case: TestCase):
+    """保存前编译预期, 格式错误时返回 400"""
+    try:
+        for key, value in Expectations.columns(db_case.expected_keywords, db_case.expected_conditions).items():
+            setattr(db_case, key, value)
+    except ExpectationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/", response_model=schemas.TestCase)
 def create_case(case: schemas.TestCaseCreate, db: Session = Depends(get_db)):
     db_case = TestCase(**case.dict())
+    db_case.question_hash = CaseImporter.question_hash(db_case.question)
+    _compile_expectations(db_case)
     db.add(db_case)
     db.commit()
     db.refresh(db_case)
@@ -42,6 +154,8 @@ def update_case(case_id: int, case: schemas.TestCaseUpdate, db: Session = Depend
     
     for key, value in case.dict(exclude_unset=True).items():
         setattr(db_case, key, value)
+    db_case.question_hash = CaseImporter.question_hash(db_case.question)
+    _compile_expectations(db_case)
     
     db.commit()
     db.refresh(db_case)
@@ -80,6 +194,7 @@ def batch_delete(case_ids: List[int], db: Session = Depends(get_db)):
 def clear_all_cases(db: Session = Depends(get_db)):
     """清空所有用例及其关联数据"""
     try:
+        mark_history_changed(db)
         # First clear history and batches to satisfy foreign key constraints
         db.query(models.TestHistory).delete(synchronize_session=False)
         db.query(models.TestBatch).delete(synchronize_session=False)
@@ -101,63 +216,46 @@ def delete_case(case_id: int, db: Session = Depends(get_db)):
     return {"ok": True}
 
 @router.post("/import")
-async def import_cases(file: UploadFile = File(...), db: Session = Depends(get_db)):
+def import_cases(file: UploadFile = File(...), stream: bool = False, db: Session = Depends(get_db)):
     """
     Import cases from Excel/CSV.
     Compatible with existing V3.0 format.
+
+    上传内容由框架暂存在临时文件中, 这里直接分块解析并批量写入, 不整体读入内存。
+    按 external_id / 标准化问题 upsert, 重复导入不会产生重复用例。
+    返回 {"imported", "inserted", "updated", "unchanged", "invalid", "errors"},
+    预期格式错误的行不导入, 行号和原因见 errors;
+    stream=true 时以 NDJSON 逐块返回进度, 最后一行 type 为 done。
+
+    导入按块提交, 不是原子的: 中途失败时之前的块已写入, 错误信息 (stream 时为 error 行) 中带有已提交的统计;
+    修正文件后重新导入即可 (upsert, 已导入的行不会重复)。
     """
-    contents = await file.read()
-    
+    if stream:
+        def progress():
+            # 依赖注入的会话在响应开始前就会关闭, 流式导入使用自己的会话
+            session = SessionLocal()
+            totals = {}
+            try:
+                for event in CaseImporter.import_stream(session, file.file, file.filename):
+                    totals = {k: v for k, v in event.items() if k in ("inserted", "updated", "unchanged", "invalid")}
+                    yield json.dumps(event, ensure_ascii=False) + "\n"
+            except Exception as e:
+                session.rollback()
+                yield json.dumps(
+                    {"type": "error", "detail": f"Import failed: {str(e)}", **totals}, ensure_ascii=False
+                ) + "\n"
+            finally:
+                session.close()
+        return StreamingResponse(progress(), media_type="application/x-ndjson")
+
     try:
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        else:
-            df = pd.read_excel(io.BytesIO(contents))
-            
-        # 辅助函数：在 DataFrame 列中查找第一个匹配的列名
-        def find_col(names):
-            for name in names:
-                if name in df.columns:
-                    return name
-            return None
-        
-        # 字段别名映射 (优先级从高到低)
-        q_col = find_col(['question', '问题', 'query'])
-        k_col = find_col(['expected_keywords', '预期关键字', 'keywords'])
-        c_col = find_col(['expected_conditions', '预期条件', 'conditions'])
-        s_col = find_col(['expected_sql', '预期SQL', 'sql', 'standard_sql'])
-        
-        if not q_col:
-            raise HTTPException(status_code=400, detail="未找到问题列 (question/问题/query)")
-        
-        count = 0
-        
-        for _, row in df.iterrows():
-            question = str(row.get(q_col, ''))
-            if not question or question == 'nan':
-                continue
-                
-            keywords = str(row.get(k_col, '')) if k_col else ''
-            conditions = str(row.get(c_col, '')) if c_col else ''
-            expected_sql = str(row.get(s_col, '')) if s_col else ''
-            
-            if keywords == 'nan': keywords = ""
-            if conditions == 'nan': conditions = ""
-            if expected_sql == 'nan': expected_sql = ""
-            
-            # Create case
-            db_case = TestCase(
-                question=question,
-                expected_keywords=keywords,
-                expected_conditions=conditions,
-                expected_sql=expected_sql,
-                is_active=True
-            )
-            db.add(db_case)
-            count += 1
-            
-        db.commit()
-        return {"imported": count}
-        
+        return CaseImporter.import_file(db, file.file, file.filename)
+    except CaseImportError as e:
+        committed = e.totals.get("inserted", 0) + e.totals.get("updated", 0)
+        detail = f"Import failed: {str(e)}"
+        if committed:
+            detail += f" ({committed} rows before the error were already imported; re-import the fixed file to continue)"
+        raise HTTPException(status_code=400, detail=detail)
     except Exception as e:
+        db.rollback()
         raise HTTPException(status_code=400, detail=f"Import failed: {str(e)}")
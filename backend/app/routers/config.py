@@ -5,7 +5,9 @@ from pydantic import BaseModel
 from typing import Optional, Dict, Any
 import json
 
-from ..models import SessionLocal, SystemConfig
+from ..models import SessionLocal
+from ..config_store import config_store
+from backend.core.validator import VALIDATION_MODES
 
 router = APIRouter(
     prefix="/config",
@@ -24,55 +26,29 @@ class ConfigUpdate(BaseModel):
     user_token: Optional[str] = None
     max_workers: Optional[int] = None
     headers: Optional[Dict[str, str]] = None
+    validation_mode: Optional[str] = None  # keywords / structure / both / execution
 
 class ConfigResponse(BaseModel):
     user_token: str
     max_workers: int
     headers: Dict[str, str]
+    validation_mode: str
 
 @router.get("/", response_model=ConfigResponse)
-def get_config(db: Session = Depends(get_db)):
-    """Get current system configuration"""
-    # Helper to get value or default
-    def get_val(key, default):
-        item = db.query(SystemConfig).filter(SystemConfig.key == key).first()
-        return item.value if item else default
-
-    token = get_val("user_token", "")
-    workers = get_val("max_workers", "5")
-    headers_str = get_val("headers", "{}")
-    
-    try:
-        headers = json.loads(headers_str)
-    except:
-        headers = {}
-
-    return {
-        "user_token": token,
-        "max_workers": int(workers),
-        "headers": headers
-    }
+def get_config():
+    """Get current system configuration (served from the in-process cache)"""
+    return config_store.settings
 
 @router.post("/", response_model=ConfigResponse)
 def update_config(config: ConfigUpdate, db: Session = Depends(get_db)):
-    """Update system configuration"""
-    def set_val(key, value):
-        if value is None: return
-        item = db.query(SystemConfig).filter(SystemConfig.key == key).first()
-        if not item:
-            item = SystemConfig(key=key, value=str(value))
-            db.add(item)
-        else:
-            item.value = str(value)
-
-    if config.user_token is not None:
-        set_val("user_token", config.user_token)
-    
-    if config.max_workers is not None:
-        set_val("max_workers", str(config.max_workers))
-
-    if config.headers is not None:
-        set_val("headers", json.dumps(config.headers))
-    
-    db.commit()
-    return get_config(db)
+    """Update system configuration and bump the config version"""
+    if config.validation_mode is not None and config.validation_mode not in VALIDATION_MODES:
+        raise HTTPException(status_code=400, detail=f"validation_mode must be one of {', '.join(VALIDATION_MODES)}")
+    config_store.update(db, {
+        "user_token": config.user_token,
+        "max_workers": config.max_workers,
+        "headers": json.dumps(config.headers) if config.headers is not None else None,
+        # 与环境变量同名, Config.get("VALIDATION_MODE") 读到的也是这里的值
+        "VALIDATION_MODE": config.validation_mode,
+    })
+    return config_store.settings
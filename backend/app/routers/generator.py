@@ -36,8 +36,13 @@ def generate_cases(
     
     - **count**: 每个指标生成几条用例 (1-10)
     """
-    generated = CaseGeneratorService.generate_and_save(db, count_per_indicator=count)
-    return {"generated": generated, "message": f"成功生成 {generated} 条用例"}
+    result = CaseGeneratorService.generate_and_save(db, count_per_indicator=count)
+    generated = result["inserted"]
+    return {
+        "generated": generated,
+        **result,
+        "message": f"成功生成 {generated} 条用例" + (f"，{result['unchanged']} 条已存在" if result["unchanged"] else "")
+    }
 
 
 @router.get("/preview")
@@ -1,10 +1,24 @@
 # -*- coding: utf-8 -*-
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Any, Dict, Iterator, List, Optional
+from datetime import datetime
 
 from .. import models, schemas
-from ..models import SessionLocal, TestBatch, TestHistory, TestCase
+from ..models import (
+    SessionLocal, AsyncSessionLocal, TestBatch, TestHistory, TestCase, SqlText,
+    history_actual_sql, previous_sql_hash, sql_changed
+)
+from ..archive import HistoryArchiver
+from ..report_cache import report_cache
+from ..analytics import HistoryAnalytics
+from ..revalidation import HistoryRevalidator
+from ..exporter import StreamExporter, EXPORT_FORMATS, HISTORY_COLUMNS
+from ..pagination import MAX_PAGE_SIZE, encode_cursor, decode_cursor, parse_datetime, count_statement, set_page_headers
 
 router = APIRouter(
     prefix="/reports",
@@ -18,58 +32,336 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 @router.get("/", response_model=List[schemas.TestBatch])
-def get_reports(skip: int = 0, limit: int = 50, db: Session = Depends(get_db)):
+async def get_reports(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0),
+    status: Optional[str] = None,
+    start_from: Optional[datetime] = None,
+    start_to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    获取历史测试报告列表 (按开始时间倒序, 游标分页, 分页信息见响应头)
+    """
+    conditions = []
+    if status is not None:
+        conditions.append(TestBatch.status == status)
+    if start_from is not None:
+        conditions.append(TestBatch.start_time >= start_from)
+    if start_to is not None:
+        conditions.append(TestBatch.start_time < start_to)
+
+    stmt = select(TestBatch).where(*conditions).order_by(TestBatch.start_time.desc(), TestBatch.id.desc())
+    if cursor:
+        last_start, last_id = decode_cursor(cursor, 2)
+        stmt = stmt.where(tuple_(TestBatch.start_time, TestBatch.id) < (parse_datetime(last_start), last_id))
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    batches = (await db.scalars(stmt.limit(limit + 1))).all()
+    next_cursor = None
+    if len(batches) > limit:
+        last = batches[limit - 1]
+        next_cursor = encode_cursor([last.start_time, last.id])
+    set_page_headers(response, await db.scalar(count_statement(TestBatch.id, conditions)), next_cursor)
+    return batches[:limit]
+
+@router.post("/archive")
+def archive_reports(keep_days: Optional[int] = None, keep_latest: Optional[int] = None):
+    """
+    按保留策略归档历史批次 (明细移入 data/archive 下的 Parquet 文件)
+    """
+    try:
+        return HistoryArchiver.run(keep_days=keep_days, keep_latest=keep_latest)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analytics/pass-rate")
+def analytics_pass_rate(days: int = 90, by_category: bool = True):
+    """
+    跨批次通过率趋势 (按天, 可按分类拆分)
+    """
+    try:
+        return HistoryAnalytics.pass_rate_trend(days=days, by_category=by_category)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analytics/flips")
+def analytics_flips(days: Optional[int] = 90, direction: str = "pass_to_fail",
+                    latest_only: bool = True, limit: int = 100):
+    """
+    结果翻转的用例 (pass_to_fail: 回归, fail_to_pass: 修复)
+    """
+    if direction not in ("pass_to_fail", "fail_to_pass"):
+        raise HTTPException(status_code=400, detail="direction must be pass_to_fail or fail_to_pass")
+    try:
+        return HistoryAnalytics.flips(days=days, direction=direction, latest_only=latest_only, limit=limit)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analytics/latency")
+def analytics_latency(days: int = 90, by_category: bool = True, bins: int = 20):
     """
-    获取历史测试报告列表 (分页)
+    耗时分布 (分位数 + 直方图)
     """
-    batches = db.query(TestBatch).order_by(TestBatch.start_time.desc()).offset(skip).limit(limit).all()
-    return batches
+    try:
+        return HistoryAnalytics.latency(days=days, by_category=by_category, bins=max(1, bins))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/history/export")
+def export_history(
+    format: str = "csv",
+    batch_id: Optional[str] = None,
+    case_id: Optional[int] = None,
+    result: Optional[str] = None,
+    run_from: Optional[datetime] = None,
+    run_to: Optional[datetime] = None,
+):
+    """
+    流式导出执行历史 (format: csv / ndjson / parquet)
+
+    只包含数据库中的明细; 已归档批次的明细本身就是 data/archive 下的 Parquet 文件。
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    conditions = []
+    if batch_id is not None:
+        conditions.append(TestHistory.batch_id == batch_id)
+    if case_id is not None:
+        conditions.append(TestHistory.case_id == case_id)
+    if result is not None:
+        conditions.append(TestHistory.result == result)
+    if run_from is not None:
+        conditions.append(TestHistory.run_at >= run_from)
+    if run_to is not None:
+        conditions.append(TestHistory.run_at < run_to)
+    try:
+        body = StreamExporter.stream(StreamExporter.history_statement(conditions), HISTORY_COLUMNS, format)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        body, media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="history.{extension}"'}
+    )
 
 @router.get("/{batch_id}", response_model=schemas.TestBatch)
-def get_report_summary(batch_id: str, db: Session = Depends(get_db)):
+async def get_report_summary(batch_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     获取单个批次的概览信息
     """
-    batch = db.query(TestBatch).filter(TestBatch.id == batch_id).first()
+    batch = await db.get(TestBatch, batch_id)
     if not batch:
         raise HTTPException(status_code=404, detail="Report not found")
     return batch
 
 @router.get("/{batch_id}/details", response_model=List[schemas.TestResult])
-def get_report_details(batch_id: str, db: Session = Depends(get_db)):
+async def get_report_details(batch_id: str, db: AsyncSession = Depends(get_async_db)):
     """
     获取单个批次的详细测试结果
     """
     # 检查批次是否存在
-    batch = db.query(TestBatch).filter(TestBatch.id == batch_id).first()
+    batch = await db.get(TestBatch, batch_id)
     if not batch:
         raise HTTPException(status_code=404, detail="Report not found")
 
+    # 已归档批次从归档文件读取
+    if batch.archived_at:
+        try:
+            return await run_in_threadpool(HistoryArchiver.read_test_results, batch)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
     # 查询历史记录并关联用例信息
-    results = db.query(TestHistory, TestCase).join(
-        TestCase, TestHistory.case_id == TestCase.id
-    ).filter(TestHistory.batch_id == batch_id).all()
+    results = (await db.execute(
+        select(TestHistory, TestCase, history_actual_sql, previous_sql_hash()).join(
+            TestCase, TestHistory.case_id == TestCase.id
+        ).outerjoin(
+            SqlText, SqlText.hash == TestHistory.sql_hash
+        ).where(TestHistory.batch_id == batch_id)
+    )).all()
     
     return [
         schemas.TestResult(
             case_id=h.case_id,
             question=h.question,
-            actual_sql=h.actual_sql,
+            actual_sql=actual_sql or "",
             expected_sql=c.expected_sql,
             result=h.result,
             message=h.error_message or "",
-            duration=0.0 
+            duration=h.duration or 0.0,
+            sql_changed=sql_changed(h.sql_hash, prev_hash),
+            similarity=h.similarity
         )
-        for h, c in results
+        for h, c, actual_sql, prev_hash in results
     ]
 
+@router.get("/{batch_id}/near-misses", response_model=List[schemas.TestResult])
+async def get_near_misses(batch_id: str, limit: int = 20, db: AsyncSession = Depends(get_async_db)):
+    """
+    批次中与预期最接近的失败结果 (按相似度从高到低), 通常只差一个条件或字段
+    """
+    batch = await db.get(TestBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Report not found")
+    limit = max(1, min(limit, 500))
+
+    if batch.archived_at:
+        try:
+            results = await run_in_threadpool(HistoryArchiver.read_test_results, batch)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        failed = [r for r in results if r.result != "PASS" and r.similarity is not None]
+        return sorted(failed, key=lambda r: r.similarity, reverse=True)[:limit]
+
+    rows = (await db.execute(
+        select(TestHistory, TestCase, history_actual_sql).join(
+            TestCase, TestHistory.case_id == TestCase.id
+        ).outerjoin(
+            SqlText, SqlText.hash == TestHistory.sql_hash
+        ).where(
+            TestHistory.batch_id == batch_id,
+            TestHistory.result != "PASS",
+            TestHistory.similarity.isnot(None)
+        ).order_by(TestHistory.similarity.desc()).limit(limit)
+    )).all()
+    return [
+        schemas.TestResult(
+            case_id=h.case_id,
+            question=h.question,
+            actual_sql=actual_sql or "",
+            expected_sql=c.expected_sql,
+            result=h.result,
+            message=h.error_message or "",
+            duration=h.duration or 0.0,
+            similarity=h.similarity
+        )
+        for h, c, actual_sql in rows
+    ]
+
+@router.get("/{batch_id}/clusters")
+async def get_failure_clusters(batch_id: str, threshold: float = 0.6, examples: int = 3, limit: int = 50,
+                               db: AsyncSession = Depends(get_async_db)):
+    """
+    按失败模式 (SQL 形状 + 缺失的预期) 聚类批次中的失败结果
+
+    返回按大小降序的分组, 每组带用例 id、共同缺失项和示例; threshold 越高分组越细。
+    """
+    from backend.core.failure_cluster import FailureClusterer
+
+    batch = await db.get(TestBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if not 0 < threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be in (0, 1]")
+
+    if batch.archived_at:
+        try:
+            rows = await run_in_threadpool(HistoryArchiver.read_results, batch)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        failed = [
+            {"case_id": r["case_id"], "question": r["question"], "actual_sql": r["actual_sql"] or "",
+             "message": r["error_message"] or ""}
+            for r in rows if r["result"] != "PASS"
+        ]
+    else:
+        rows = (await db.execute(
+            select(TestHistory.case_id, TestHistory.question, history_actual_sql, TestHistory.error_message).outerjoin(
+                SqlText, SqlText.hash == TestHistory.sql_hash
+            ).where(
+                TestHistory.batch_id == batch_id,
+                TestHistory.result != "PASS"
+            ).order_by(TestHistory.id)
+        )).all()
+        failed = [
+            {"case_id": case_id, "question": question, "actual_sql": actual_sql or "", "message": message or ""}
+            for case_id, question, actual_sql, message in rows
+        ]
+
+    clusters = await run_in_threadpool(
+        FailureClusterer.cluster, failed, threshold=threshold, examples=max(0, min(examples, 20))
+    )
+    return {
+        "batch_id": batch_id,
+        "failed": len(failed),
+        "cluster_count": len(clusters),
+        "clusters": clusters[:max(1, limit)],
+    }
+
+@router.post("/{batch_id}/revalidate")
+def revalidate_report(batch_id: str, apply: bool = False):
+    """
+    按用例当前的预期关键字 / 条件重新校验批次结果
+
+    默认只返回判定发生变化的用例; apply=true 时写回结果、批次计数和用例最近一次结果。
+    """
+    try:
+        return HistoryRevalidator.run(batch_id, apply=apply)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+# 导出报告时每次从数据库读取的历史行数
+REPORT_CHUNK_SIZE = 2000
+
+def _report_rows(batch: TestBatch) -> Iterator[Dict[str, Any]]:
+    """按执行顺序逐块读取批次结果 (已归档批次读归档文件), 转为报告行"""
+    if batch.archived_at:
+        results = HistoryArchiver.iter_results(batch)
+    else:
+        results = _history_rows(batch.id)
+    for idx, r in enumerate(results, 1):
+        yield {
+            "Index": idx,
+            "问题": r["question"],
+            "预期关键字": r["expected_keywords"],
+            "预期条件": r["expected_conditions"],
+            "实际生成的SQL": r["actual_sql"],
+            "测试结果": "通过" if r["result"] == "PASS" else "失败",
+            "备注": r["error_message"] or ""
+        }
+
+def _history_rows(batch_id: str) -> Iterator[Dict[str, Any]]:
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            select(
+                TestHistory.question, TestCase.expected_keywords, TestCase.expected_conditions,
+                history_actual_sql, TestHistory.result, TestHistory.error_message
+            ).join(
+                TestCase, TestHistory.case_id == TestCase.id
+            ).outerjoin(
+                SqlText, SqlText.hash == TestHistory.sql_hash
+            ).where(TestHistory.batch_id == batch_id).order_by(TestHistory.id).execution_options(
+                yield_per=REPORT_CHUNK_SIZE
+            )
+        )
+        for partition in result.partitions():
+            for row in partition:
+                yield row._mapping
+    finally:
+        db.close()
+
 @router.get("/{batch_id}/export")
-def export_report(batch_id: str, db: Session = Depends(get_db)):
+def export_report(batch_id: str, request: Request, db: Session = Depends(get_db)):
     """
     导出测试报告 (Excel)
+
+    结果逐块读取并流式写入 (见 Reporter.write_report), 大批次导出时内存占用保持平稳。
+    已结束的批次报告只生成一次, 之后直接返回缓存的文件 (见 report_cache), 支持 ETag / Range。
     """
     from fastapi.responses import FileResponse
+    from starlette.background import BackgroundTask
     from backend.core.reporter import Reporter
     import os
     
@@ -78,36 +370,26 @@ def export_report(batch_id: str, db: Session = Depends(get_db)):
     if not batch:
         raise HTTPException(status_code=404, detail="Batch not found")
 
-    # 查询数据
-    results = db.query(TestHistory, TestCase).join(
-        TestCase, TestHistory.case_id == TestCase.id
-    ).filter(TestHistory.batch_id == batch_id).all()
-    
-    if not results:
-        raise HTTPException(status_code=400, detail="No results to export")
-        
-    # 生成报告
-    reporter = Reporter()
-    for idx, (h, c) in enumerate(results, 1):
-        reporter.add_result({
-            "Index": idx,
-            "问题": h.question,
-            "预期关键字": c.expected_keywords,
-            "预期条件": c.expected_conditions, # Assuming this field exists on TestCase model based on usage in runner.py
-            "实际生成的SQL": h.actual_sql,
-            "测试结果": "通过" if h.result == "PASS" else "失败",
-            "备注": h.error_message or ""
-        })
-    
-    # 使用 absolute path 避免相对路径问题
-    # 使用 batch_id 作为文件名的一部分
-    filename = f"report_{batch_id}.xlsx"
-    output_path = os.path.join(os.getcwd(), "data", "output", filename)
-    
-    file_path = reporter.generate_report(output_path)
-    
+    # 客户端已有当前版本的报告
+    key = report_cache.cache_key(db, batch)
+    if key is not None and report_cache.etag(key) in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": report_cache.etag(key)})
+
+    try:
+        artifact = report_cache.get(db, batch, lambda path: Reporter.write_report(_report_rows(batch), path))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"Cache-Control": "private, no-cache"}
+    if artifact.etag:
+        headers["ETag"] = artifact.etag
     return FileResponse(
-        path=file_path, 
-        filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        path=artifact.path,
+        filename=f"report_{batch_id}.xlsx",
+        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        headers=headers,
+        # 运行中批次的报告是一次性的临时文件
+        background=BackgroundTask(os.remove, artifact.path) if artifact.temporary else None
     )
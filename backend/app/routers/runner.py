@@ -1,17 +1,33 @@
 from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException, WebSocket, WebSocketDisconnect
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 from typing import List, Dict, Set
 import uuid
 import logging
 import time
 import asyncio
+import itertools
 import json
 
 from .. import models, schemas
-from ..models import SessionLocal, TestCase, TestHistory, SystemConfig, TestBatch
+from ..models import (
+    SessionLocal, AsyncSessionLocal, TestCase, TestHistory, TestBatch, SqlText,
+    history_actual_sql, previous_sql_hash, sql_changed
+)
+from ..database import new_async_engine, new_async_sessionmaker
+from ..events import event_log, notifier, REPLAY_PAGE_SIZE
+from ..batch_state import BatchStateStore
+from ..history_writer import history_writer
+from ..archive import HistoryArchiver
+from ..config_store import config_store
 from backend.core.auth import AuthManager
 from backend.core.test_engine import TestEngine
-from backend.core.validator import Validator
+from backend.core.validator import BatchValidator
+from backend.core.validation_pool import validation_pool
+from backend.core.expectations import Expectations
+from backend.core.similarity import SimilarityScorer
 
 router = APIRouter(
     prefix="/run",
@@ -20,10 +36,13 @@ router = APIRouter(
 
 logger = logging.getLogger("Backend.Runner")
 
-# Global dict to track running status: { batch_id: {"stop": False}}
-RUNNING_BATCHES: Dict[str, Dict] = {}
-
 class ConnectionManager:
+    """
+    批次消息分发
+
+    broadcast 先把消息写入事件日志 (分配 seq), 再唤醒订阅该批次的 WebSocket,
+    由各连接按自己的 seq 游标从事件日志读取, 不再直接向 socket 写数据。
+    """
     def __init__(self):
         self.active_connections: Dict[str, Set[WebSocket]] = {}
 
@@ -32,20 +51,21 @@ class ConnectionManager:
         if batch_id not in self.active_connections:
             self.active_connections[batch_id] = set()
         self.active_connections[batch_id].add(websocket)
+        return notifier.subscribe(batch_id)
 
-    def disconnect(self, batch_id: str, websocket: WebSocket):
+    def disconnect(self, batch_id: str, websocket: WebSocket, waiter=None):
+        if waiter is not None:
+            notifier.unsubscribe(batch_id, waiter)
         if batch_id in self.active_connections:
-            self.active_connections[batch_id].remove(websocket)
+            self.active_connections[batch_id].discard(websocket)
             if not self.active_connections[batch_id]:
                 del self.active_connections[batch_id]
 
     async def broadcast(self, batch_id: str, message: dict):
-        if batch_id in self.active_connections:
-            for connection in self.active_connections[batch_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except Exception as e:
-                    logger.error(f"Error broadcasting to {batch_id}: {e}")
+        try:
+            event_log.append(batch_id, message)
+        except Exception as e:
+            logger.error(f"Error broadcasting to {batch_id}: {e}")
 
 manager = ConnectionManager()
 
@@ -56,31 +76,34 @@ def get_db():
     finally:
         db.close()
 
-async def run_tests_background(case_ids: List[int], batch_id: str, preloaded_cases: List[TestCase] = None):
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def run_tests_background(case_ids: List[int], batch_id: str, preloaded_cases: List[TestCase] = None,
+                               session_factory=AsyncSessionLocal):
     """
     Background task to run tests
+
+    session_factory must be bound to an engine created for the loop this coroutine runs on.
     """
     logger.info(f"Starting background task for batch {batch_id}")
-    RUNNING_BATCHES[batch_id] = {"stop": False}
     
     # Wait a bit longer to ensure frontend WS is connected before broadcasting 'running'
     await asyncio.sleep(1.0)
     
-    db = SessionLocal()
+    db = session_factory()
     try:
         # 0. Update batch in DB
-        batch = db.query(TestBatch).filter(TestBatch.id == batch_id).first()
+        batch = await db.get(TestBatch, batch_id)
         if not batch:
             batch = TestBatch(id=batch_id, status="RUNNING")
             db.add(batch)
-            db.commit()
+            await db.commit()
+        BatchStateStore.claim(batch_id)
 
-        # Load Config (Token, Workers, etc.)
-        def get_config(key, default):
-            item = db.query(SystemConfig).filter(SystemConfig.key == key).first()
-            return item.value if item else default
-
-        user_token = get_config("user_token", "")
+        # Config comes from the in-process cache, no database round trip
+        user_token = config_store.settings.user_token
         
         # 1. Login
         tenant_id = ""
@@ -103,12 +126,69 @@ async def run_tests_background(case_ids: List[int], batch_id: str, preloaded_cas
         if preloaded_cases:
             cases = preloaded_cases
         elif not case_ids:
-            cases = db.query(TestCase).filter(TestCase.is_active == True).all()
+            cases = (await db.scalars(select(TestCase).where(TestCase.is_active == True))).all()
         else:
-            cases = db.query(TestCase).filter(TestCase.id.in_(case_ids)).all()
+            cases = (await db.scalars(select(TestCase).where(TestCase.id.in_(case_ids)))).all()
             
         batch.total_count = len(cases)
-        db.commit()
+        await db.commit()
+
+        # Expectations were compiled when the cases were saved; only legacy rows are parsed here
+        compiled = [
+            Expectations.load(c.compiled_expectations, c.expectations_version, c.expected_keywords, c.expected_conditions)
+            for c in cases
+        ]
+        validator = BatchValidator(
+            compiled,
+            expected_sqls=[c.expected_sql for c in cases],
+            mode=config_store.settings.validation_mode
+        )
+
+        # CPU-heavy validation modes run in the validation process pool, keywords inline
+        stage = validation_pool.stage(validator)
+        pending = {}
+
+        async def record(results):
+            # Similarity is scored for each group of completed results at once
+            scores = SimilarityScorer.score_batch(
+                [pending[index][1] for index, _, _ in results],
+                [cases[index].expected_sql for index, _, _ in results],
+                [compiled[index] for index, _, _ in results]
+            )
+            for (index, is_pass, message), similarity in zip(results, scores):
+                await record_one(index, is_pass, message, similarity)
+
+        async def record_one(index: int, is_pass: bool, message: str, similarity):
+            case, actual_sql, duration, run_at = pending.pop(index)
+
+            # Save Result (buffered, flushed in bulk by the history writer)
+            history_writer.add(TestHistory, {
+                "batch_id": batch_id,
+                "case_id": case.id,
+                "question": case.question,
+                "actual_sql": actual_sql,
+                "result": "PASS" if is_pass else "FAIL",
+                "error_message": message,
+                "duration": duration,
+                "similarity": similarity,
+                "run_at": run_at
+            })
+
+            # Notify UI
+            await manager.broadcast(batch_id, {
+                "type": "update",
+                "case_id": case.id,
+                "result": {
+                    "case_id": case.id,
+                    "question": case.question,
+                    "actual_sql": actual_sql,
+                    "expected_sql": case.expected_sql,
+                    "result": "PASS" if is_pass else "FAIL",
+                    "message": message,
+                    "duration": duration,
+                    "similarity": similarity
+                }
+            })
 
         # Notify UI about initial state
         await manager.broadcast(batch_id, {
@@ -117,10 +197,9 @@ async def run_tests_background(case_ids: List[int], batch_id: str, preloaded_cas
         })
 
         # 3. Execute
-        pass_count = 0
         for i, case in enumerate(cases):
-            # CHECK STOP SIGNAL
-            if RUNNING_BATCHES.get(batch_id, {}).get("stop"):
+            # CHECK STOP SIGNAL (heartbeat also reports progress to other workers)
+            if BatchStateStore.heartbeat(batch_id, i, case.id):
                 logger.warning(f"Batch {batch_id} stopped by user.")
                 batch.status = "STOPPED"
                 break
@@ -140,59 +219,39 @@ async def run_tests_background(case_ids: List[int], batch_id: str, preloaded_cas
             
             duration = round(time.time() - start_time, 2)
             
-            # Validate
-            is_pass, message = Validator.validate(
-                actual_sql, 
-                case.expected_keywords, 
-                case.expected_conditions
-            )
-            
-            if is_pass:
-                pass_count += 1
-
-            # Save Result
-            history = TestHistory(
-                batch_id=batch_id,
-                case_id=case.id,
-                question=case.question,
-                actual_sql=actual_sql,
-                result="PASS" if is_pass else "FAIL",
-                error_message=message
-            )
-            db.add(history)
-            
-            # Notify UI
-            await manager.broadcast(batch_id, {
-                "type": "update",
-                "case_id": case.id,
-                "result": {
-                    "case_id": case.id,
-                    "question": case.question,
-                    "actual_sql": actual_sql,
-                    "expected_sql": case.expected_sql,
-                    "result": "PASS" if is_pass else "FAIL",
-                    "message": message,
-                    "duration": duration
-                }
-            })
+            # Validate (results may come back later and out of order)
+            pending[i] = (case, actual_sql, duration, models.datetime.now())
+            stage.submit(i, actual_sql)
+            await record(stage.completed())
             
-            db.commit()
             await asyncio.sleep(0.1) # Yield
+
+        # Wait for validations still in the pool
+        await record(await run_in_threadpool(stage.drain))
             
-        batch.status = "COMPLETED" if batch.status == "RUNNING" else batch.status
-        batch.pass_count = pass_count
+        # Results must be in the database (or spilled to a file after repeated failures) before the status is final
+        await run_in_threadpool(history_writer.drain)
+        if history_writer.pop_spilled(batch_id):
+            batch.status = "FAILED"
+        else:
+            batch.status = "COMPLETED" if batch.status == "RUNNING" else batch.status
         batch.end_time = models.datetime.now()
-        db.commit()
-        
-        await manager.broadcast(batch_id, {"type": "done"})
+        await db.commit()
+
+        if batch.status == "FAILED":
+            await manager.broadcast(batch_id, {
+                "type": "error", "message": "Some results could not be saved (spilled to data/history_spill)"
+            })
+        else:
+            await manager.broadcast(batch_id, {"type": "done"})
     
     except Exception as e:
         logger.error(f"Batch run failed: {e}")
         await manager.broadcast(batch_id, {"type": "error", "message": str(e)})
     finally:
-        if batch_id in RUNNING_BATCHES:
-            del RUNNING_BATCHES[batch_id]
-        db.close()
+        BatchStateStore.release(batch_id)
+        event_log.flush()
+        await db.close()
 
 @router.post("/", response_model=schemas.TestRunResponse)
 def trigger_run(request: schemas.TestRunRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
@@ -209,14 +268,29 @@ def trigger_run(request: schemas.TestRunRequest, background_tasks: BackgroundTas
         cases = db.query(TestCase).filter(TestCase.id.in_(case_ids)).all()
     
     case_list = [{"id": c.id, "question": c.question} for c in cases]
+
+    # Register the batch and its owner up front so any worker can stop or observe it.
+    # Detach the pre-fetched cases first, otherwise the commit expires them for the runner thread.
+    db.expunge_all()
+    db.add(TestBatch(id=batch_id, status="RUNNING", total_count=len(cases)))
+    db.commit()
+    BatchStateStore.claim(batch_id)
     
     # Wrap the async function to be run in the background
     def run_wrapper():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
-        # Pass pre-fetched cases to avoid redundant DB call
-        loop.run_until_complete(run_tests_background(case_ids, batch_id, cases))
-        loop.close()
+        # This thread runs its own event loop, so it needs its own async engine:
+        # the shared pool (and aiomysql / asyncpg connections) is bound to the server loop.
+        batch_engine = new_async_engine()
+        try:
+            # Pass pre-fetched cases to avoid redundant DB call
+            loop.run_until_complete(
+                run_tests_background(case_ids, batch_id, cases, new_async_sessionmaker(batch_engine))
+            )
+        finally:
+            loop.run_until_complete(batch_engine.dispose())
+            loop.close()
     
     import threading
     thread = threading.Thread(target=run_wrapper)
@@ -233,8 +307,7 @@ def stop_run(batch_id: str):
     """
     Signal a batch to stop
     """
-    if batch_id in RUNNING_BATCHES:
-        RUNNING_BATCHES[batch_id]["stop"] = True
+    if BatchStateStore.request_stop(batch_id):
         return {"message": "Stop signal sent"}
     return {"message": "Batch not found or already finished"}
 
@@ -244,96 +317,194 @@ def get_active_batches(db: Session = Depends(get_db)):
     获取所有正在运行的批次
     用于页面刷新后恢复运行状态
     """
+    BatchStateStore.reap_stale()
     batches = db.query(TestBatch).filter(
         TestBatch.status == "RUNNING"
     ).order_by(TestBatch.start_time.desc()).all()
     
-    result = []
-    for batch in batches:
-        completed_count = db.query(TestHistory).filter(
-            TestHistory.batch_id == batch.id
-        ).count()
-        
-        result.append({
+    return [
+        {
             "batch_id": batch.id,
             "start_time": batch.start_time.isoformat() if batch.start_time else None,
             "total_count": batch.total_count,
-            "completed_count": completed_count,
-            "pass_count": batch.pass_count
-        })
-    
-    return result
+            "completed_count": batch.completed_count,
+            "pass_count": batch.pass_count,
+            "fail_count": batch.fail_count,
+            "error_count": batch.error_count
+        }
+        for batch in batches
+    ]
 
 @router.get("/history/{batch_id}", response_model=List[schemas.TestResult])
-def get_run_history(batch_id: str, db: Session = Depends(get_db)):
+async def get_run_history(batch_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Archived batches are served from their archive file
+    batch = await db.get(TestBatch, batch_id)
+    if batch and batch.archived_at:
+        try:
+            return await run_in_threadpool(HistoryArchiver.read_test_results, batch)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
     # Join TestCase to get expected_sql
-    results = db.query(TestHistory, TestCase).join(
-        TestCase, TestHistory.case_id == TestCase.id
-    ).filter(TestHistory.batch_id == batch_id).all()
+    results = (await db.execute(
+        select(TestHistory, TestCase, history_actual_sql, previous_sql_hash()).join(
+            TestCase, TestHistory.case_id == TestCase.id
+        ).outerjoin(
+            SqlText, SqlText.hash == TestHistory.sql_hash
+        ).where(TestHistory.batch_id == batch_id)
+    )).all()
     
     return [
         schemas.TestResult(
             case_id=h.case_id,
             question=h.question,
-            actual_sql=h.actual_sql,
+            actual_sql=actual_sql or "",
             expected_sql=c.expected_sql,
             result=h.result,
             message=h.error_message or "",
-            duration=0.0 # Historical data might not have duration saved yet
+            duration=h.duration or 0.0, # Rows saved before durations were recorded have none
+            sql_changed=sql_changed(h.sql_hash, prev_hash),
+            similarity=h.similarity
         )
-        for h, c in results
+        for h, c, actual_sql, prev_hash in results
     ]
 
+# 没有新事件时的兜底轮询间隔 (秒), 其他 worker 执行的批次依赖轮询获取新事件
+WS_POLL_INTERVAL = 0.5
+
+async def _wait_disconnect(websocket: WebSocket):
+    """持续读取客户端消息, 直到连接断开"""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+def _result_message(case_id, question, actual_sql, expected_sql, result, message, duration, similarity) -> str:
+    return json.dumps({
+        "type": "update",
+        "case_id": case_id,
+        "result": {
+            "case_id": case_id,
+            "question": question,
+            "actual_sql": actual_sql or "",
+            "expected_sql": expected_sql,
+            "result": result,
+            "message": message or "",
+            "duration": duration or 0.0,
+            "similarity": similarity
+        }
+    })
+
+async def _replay_legacy_history(websocket: WebSocket, batch: TestBatch):
+    """
+    没有事件日志的批次 (升级前产生, 或已归档: 归档时事件和明细都已从数据库删除) 按结果补发
+
+    未归档的按 TestHistory.id 分页读取, 已归档的从归档文件逐块读取。
+    """
+    if batch.archived_at:
+        rows = HistoryArchiver.iter_results(batch)
+        while True:
+            page = await run_in_threadpool(lambda: list(itertools.islice(rows, REPLAY_PAGE_SIZE)))
+            for r in page:
+                await websocket.send_text(_result_message(
+                    r["case_id"], r["question"], r["actual_sql"], r["expected_sql"],
+                    r["result"], r["error_message"], r["duration"], r.get("similarity")
+                ))
+            if len(page) < REPLAY_PAGE_SIZE:
+                break
+        await websocket.send_text(json.dumps({"type": "done"}))
+        return
+
+    last_id = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            page = (await db.execute(
+                select(TestHistory, TestCase, history_actual_sql).join(
+                    TestCase, TestHistory.case_id == TestCase.id
+                ).outerjoin(
+                    SqlText, SqlText.hash == TestHistory.sql_hash
+                ).where(
+                    TestHistory.batch_id == batch.id,
+                    TestHistory.id > last_id
+                ).order_by(TestHistory.id).limit(REPLAY_PAGE_SIZE)
+            )).all()
+
+        for h, c, actual_sql in page:
+            await websocket.send_text(_result_message(
+                h.case_id, h.question, actual_sql, c.expected_sql,
+                h.result, h.error_message, h.duration, h.similarity
+            ))
+            last_id = h.id
+        if len(page) < REPLAY_PAGE_SIZE:
+            break
+    await websocket.send_text(json.dumps({"type": "done"}))
+
 @router.websocket("/ws/{batch_id}")
-async def websocket_endpoint(websocket: WebSocket, batch_id: str):
-    await manager.connect(batch_id, websocket)
-    
-    # 获取数据库会话来查询批次状态
-    db = SessionLocal()
+async def websocket_endpoint(websocket: WebSocket, batch_id: str, since: int = 0):
+    """
+    批次实时消息
+
+    每条消息带批次内递增的 seq。客户端重连时传入 since=<最后收到的 seq>,
+    服务端先从事件日志分页补发 seq > since 的事件, 再以同一游标继续推送新事件。
+    """
+    waiter = await manager.connect(batch_id, websocket)
+    _, wakeup = waiter
+    receiver = asyncio.create_task(_wait_disconnect(websocket))
+
     try:
-        # 发送当前批次状态和已完成的结果（用于重连恢复）
-        batch = db.query(TestBatch).filter(TestBatch.id == batch_id).first()
+        async with AsyncSessionLocal() as db:
+            batch = await db.get(TestBatch, batch_id)
+
+        last_seq = 0
         if batch:
+            last_seq = await event_log.last_seq_async(batch_id)
             # 1. 发送批次基本信息
             await websocket.send_text(json.dumps({
                 "type": "batch_status",
                 "status": batch.status,
                 "total_count": batch.total_count,
+                "completed_count": batch.completed_count,
                 "pass_count": batch.pass_count,
-                "start_time": batch.start_time.isoformat() if batch.start_time else None
+                "start_time": batch.start_time.isoformat() if batch.start_time else None,
+                "last_seq": last_seq
             }))
-            
-            # 2. 发送已完成的测试结果（用于恢复进度显示）
-            completed_results = db.query(TestHistory, TestCase).join(
-                TestCase, TestHistory.case_id == TestCase.id
-            ).filter(TestHistory.batch_id == batch_id).all()
-            
-            for h, c in completed_results:
-                await websocket.send_text(json.dumps({
-                    "type": "update",
-                    "case_id": h.case_id,
-                    "result": {
-                        "case_id": h.case_id,
-                        "question": h.question,
-                        "actual_sql": h.actual_sql,
-                        "expected_sql": c.expected_sql,
-                        "result": h.result,
-                        "message": h.error_message or "",
-                        "duration": 0.0
-                    }
-                }))
-            
-            # 3. 如果批次已完成，发送完成消息
-            if batch.status in ["COMPLETED", "STOPPED"]:
-                await websocket.send_text(json.dumps({"type": "done"}))
-        
-        # 保持连接，等待客户端消息或关闭
-        while True:
-            await websocket.receive_text()
+
+            # 2. 升级前产生的批次和已归档的批次没有事件日志, 退回按历史结果补发
+            if last_seq == 0 and since == 0 and batch.status in ["COMPLETED", "STOPPED", "FAILED"]:
+                await _replay_legacy_history(websocket, batch)
+                await receiver
+                return
+
+        # 3. 按 seq 游标补发缺失事件, 补完后等待新事件; 发出 (或客户端已收到) done / error 后不再轮询
+        cursor = since
+        finished = False
+        if 0 < last_seq <= since:
+            last_event = await event_log.fetch_async(batch_id, last_seq - 1, 1)
+            finished = bool(last_event) and last_event[0].get("type") in ["done", "error"]
+        while not receiver.done() and not finished:
+            wakeup.clear()
+            page = await event_log.fetch_async(batch_id, cursor, REPLAY_PAGE_SIZE)
+            for message in page:
+                await websocket.send_text(json.dumps(message))
+                cursor = message["seq"]
+                finished = finished or message.get("type") in ["done", "error"]
+            if finished or len(page) == REPLAY_PAGE_SIZE:
+                continue
+            wakeup_task = asyncio.create_task(wakeup.wait())
+            await asyncio.wait(
+                [receiver, wakeup_task],
+                timeout=WS_POLL_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            wakeup_task.cancel()
+
+        # 保持连接，等待客户端关闭
+        await receiver
     except WebSocketDisconnect:
-        manager.disconnect(batch_id, websocket)
+        pass
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        manager.disconnect(batch_id, websocket)
     finally:
-        db.close()
+        receiver.cancel()
+        manager.disconnect(batch_id, websocket, waiter)
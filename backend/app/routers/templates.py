@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from sqlalchemy import select, or_
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import json
 import requests
 from datetime import datetime
 
 from .. import models, schemas
 from ..models import SessionLocal, InterfaceTemplate
+from ..pagination import MAX_PAGE_SIZE, encode_cursor, decode_cursor, count_statement, set_page_headers
 
 router = APIRouter(
     prefix="/templates",
@@ -23,8 +25,39 @@ def get_db():
 
 # CRUD
 @router.get("/", response_model=List[schemas.TemplateResponse])
-def read_templates(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(InterfaceTemplate).offset(skip).limit(limit).all()
+def read_templates(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0),
+    project_id: Optional[int] = None,
+    is_active: Optional[bool] = None,
+    q: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """接口模板列表 (按 id 升序, 游标分页, 分页信息见响应头)"""
+    conditions = []
+    if project_id is not None:
+        conditions.append(InterfaceTemplate.project_id == project_id)
+    if is_active is not None:
+        conditions.append(InterfaceTemplate.is_active == is_active)
+    if q:
+        conditions.append(or_(
+            InterfaceTemplate.name.contains(q, autoescape=True),
+            InterfaceTemplate.code.contains(q, autoescape=True)
+        ))
+
+    stmt = select(InterfaceTemplate).where(*conditions).order_by(InterfaceTemplate.id)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        stmt = stmt.where(InterfaceTemplate.id > last_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    items = db.scalars(stmt.limit(limit + 1)).all()
+    next_cursor = encode_cursor([items[limit - 1].id]) if len(items) > limit else None
+    set_page_headers(response, db.scalar(count_statement(InterfaceTemplate.id, conditions)), next_cursor)
+    return items[:limit]
 
 @router.get("/{template_id}", response_model=schemas.TemplateResponse)
 def read_template(template_id: int, db: Session = Depends(get_db)):
@@ -9,6 +9,11 @@ class TestCaseBase(BaseModel):
     expected_keywords: Optional[str] = None
     expected_conditions: Optional[str] = None
     expected_sql: Optional[str] = None  # New field
+    expect_company: Optional[str] = None
+    expect_indicator: Optional[str] = None
+    expect_time: Optional[str] = None
+    description: Optional[str] = None
+    external_id: Optional[str] = None
     is_active: bool = True
 
 
@@ -22,8 +27,11 @@ class TestCaseUpdate(TestCaseBase):
 
 class TestCase(TestCaseBase):
     id: int
+    category: Optional[str] = None
     created_at: datetime
     updated_at: datetime
+    last_result: Optional[str] = None
+    last_run_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
@@ -79,6 +87,8 @@ class TestResult(BaseModel):
     result: str  # "PASS" or "FAIL"
     message: str
     duration: float = 0.0
+    sql_changed: Optional[bool] = None # 与该用例上一次运行相比 SQL 是否变化
+    similarity: Optional[float] = None # 与预期的相似度 0~1
 
 class TestBatch(BaseModel):
     id: str
@@ -87,6 +97,10 @@ class TestBatch(BaseModel):
     status: str
     total_count: int
     pass_count: int
+    completed_count: int = 0
+    fail_count: int = 0
+    error_count: int = 0
+    duration_sum: float = 0.0
 
     class Config:
         from_attributes = True
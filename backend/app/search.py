@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+用例全文检索
+
+SQLite FTS5 外部内容表 test_cases_fts 索引 question / expected_keywords / expected_sql,
+使用 trigram 分词器: 中文没有空格分词, trigram 按 3 个字符切片, 任意子串
+(如 "深华发"、"现金分红") 都能命中索引。表由迁移创建, 触发器保证新增/修改/删除/
+导入/生成的用例自动同步, 无需应用层维护。
+
+trigram 要求检索词至少 3 个字符, 更短的词退化为 LIKE 过滤。
+数据库不支持 FTS5 trigram 时整个检索退化为 LIKE。
+"""
+
+import logging
+from typing import List, Optional, Tuple
+
+from sqlalchemy import Float, Integer, and_, func, or_, select, text
+from sqlalchemy.orm import Session
+
+from .models import TestCase
+
+logger = logging.getLogger("Backend.Search")
+
+FTS_TABLE = "test_cases_fts"
+FTS_COLUMNS = ("question", "expected_keywords", "expected_sql")
+TRIGRAM_MIN_LENGTH = 3
+
+_fts_available: Optional[bool] = None
+
+
+def create_fts_index(conn) -> bool:
+    """创建 FTS 表和同步触发器并重建索引, 不支持时返回 False"""
+    if conn.dialect.name != "sqlite":
+        return False
+    columns = ", ".join(FTS_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+    try:
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{columns}, content='test_cases', content_rowid='id', tokenize='trigram')"
+        ))
+    except Exception as e:
+        logger.warning(f"FTS5 trigram tokenizer unavailable, case search falls back to LIKE: {e}")
+        return False
+
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS test_cases_fts_ai AFTER INSERT ON test_cases BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS test_cases_fts_ad AFTER DELETE ON test_cases BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+    ))
+    # 只在被索引的列变化时更新 (运行结果回写 last_result 不触发)
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS test_cases_fts_au AFTER UPDATE OF {columns} ON test_cases BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+    ))
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    return True
+
+
+def fts_available(db: Session) -> bool:
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = db.get_bind().dialect.name == "sqlite" and db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first() is not None
+    return _fts_available
+
+
+def _split_terms(query: str) -> Tuple[List[str], List[str]]:
+    """按空白拆分检索词, 返回 (可走 trigram 的长词, 需要 LIKE 的短词)"""
+    terms = [t for t in query.split() if t]
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN_LENGTH]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN_LENGTH]
+    return long_terms, short_terms
+
+
+def _match_expression(terms: List[str]) -> str:
+    # 每个词作为短语 (双引号转义), 多个词之间为 AND
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _like_condition(term: str):
+    return or_(*[getattr(TestCase, c).contains(term, autoescape=True) for c in FTS_COLUMNS])
+
+
+def text_filter(db: Session, query: str):
+    """列表筛选用的检索条件 (不排序)"""
+    long_terms, short_terms = _split_terms(query)
+    if not fts_available(db):
+        return and_(*[_like_condition(t) for t in long_terms + short_terms])
+    conditions = [_like_condition(t) for t in short_terms]
+    if long_terms:
+        matched = text(
+            f"SELECT rowid AS id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        ).bindparams(match=_match_expression(long_terms)).columns(id=Integer).subquery("matched")
+        conditions.append(TestCase.id.in_(select(matched.c.id)))
+    return and_(*conditions)
+
+
+class CaseSearch:
+    """按相关度排序的用例检索"""
+
+    @staticmethod
+    def search(db: Session, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[TestCase], int]:
+        """
+        Returns:
+            (当前页用例, 命中总数)
+        """
+        long_terms, short_terms = _split_terms(query)
+        if not long_terms and not short_terms:
+            return [], 0
+
+        if not long_terms or not fts_available(db):
+            # 只有短词 / 不支持 FTS: LIKE 过滤, 按 id 排序
+            condition = and_(*[_like_condition(t) for t in long_terms + short_terms])
+            total = db.scalar(select(func.count()).select_from(select(TestCase.id).where(condition).subquery()))
+            cases = db.scalars(
+                select(TestCase).where(condition).order_by(TestCase.id).offset(offset).limit(limit)
+            ).all()
+            return cases, total
+
+        # bm25 排序, 列权重: 问题 > 关键字 > 标准 SQL
+        ranked = text(
+            f"SELECT rowid AS id, bm25({FTS_TABLE}, 10.0, 5.0, 1.0) AS score "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+        ).bindparams(match=_match_expression(long_terms)).columns(id=Integer, score=Float).subquery("ranked")
+
+        stmt = select(TestCase).join(ranked, ranked.c.id == TestCase.id)
+        for term in short_terms:
+            stmt = stmt.where(_like_condition(term))
+
+        total = db.scalar(select(func.count()).select_from(stmt.subquery()))
+        cases = db.scalars(
+            stmt.order_by(ranked.c.score, TestCase.id).offset(offset).limit(limit)
+        ).all()
+        return cases, total
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+测试共用的 fixture
+
+temp_db: 在临时目录中建库并执行迁移, 测试期间 SessionLocal / AsyncSessionLocal 改为连接该库,
+结束后恢复; 不会读写 data/autotest.db。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.app import database
+from backend.app.migrations import run_migrations
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    path = tmp_path / "autotest.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database._set_sqlite_pragmas)
+    run_migrations(engine)
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    event.listen(async_engine.sync_engine, "connect", database._set_sqlite_pragmas)
+
+    sync_bind, async_bind = database.SessionLocal.kw["bind"], database.AsyncSessionLocal.kw["bind"]
+    database.SessionLocal.configure(bind=engine)
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    try:
+        yield engine
+    finally:
+        database.SessionLocal.configure(bind=sync_bind)
+        database.AsyncSessionLocal.configure(bind=async_bind)
+        asyncio.run(async_engine.dispose())
+        engine.dispose()
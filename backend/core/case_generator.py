@@ -200,18 +200,20 @@ class CaseGeneratorService:
         return cases
     
     @staticmethod
-    def generate_and_save(db_session, count_per_indicator: int = 2) -> int:
+    def generate_and_save(db_session, count_per_indicator: int = 2) -> Dict[str, int]:
         """
         生成用例并直接保存到数据库
+
+        与文件导入走同一条 upsert 路径, 已存在的相同问题不会重复生成。
         
         Args:
             db_session: SQLAlchemy 数据库会话
             count_per_indicator: 每个指标生成几条
             
         Returns:
-            生成的用例数量
+            {"inserted": n, "updated": n, "unchanged": n, "invalid": n}
         """
-        from ..app.models import TestCase
+        from .case_importer import CaseImporter, CHUNK_SIZE
         
         # 1. 提取元数据
         fetcher = DataFetcher()
@@ -219,24 +221,21 @@ class CaseGeneratorService:
         
         if not indicators or not companies:
             logger.warning("元数据为空，无法生成用例")
-            return 0
+            return {"inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0}
         
         # 2. 生成用例
         cases = CaseGeneratorService.generate_cases(indicators, companies, count_per_indicator)
         
-        # 3. 写入数据库
-        count = 0
-        for case_data in cases:
-            db_case = TestCase(
-                question=case_data['question'],
-                expected_keywords=case_data['expected_keywords'],
-                expected_conditions=case_data['expected_conditions'],
-                category=case_data.get('category'),
-                is_active=True
-            )
-            db_session.add(db_case)
-            count += 1
+        # 3. 分块 upsert 写入数据库
+        totals = {"inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0}
+        for start in range(0, len(cases), CHUNK_SIZE):
+            chunk = [
+                {k: v for k, v in case.items() if k != "is_active"}
+                for case in cases[start:start + CHUNK_SIZE]
+            ]
+            for key, value in CaseImporter.upsert_cases(db_session, chunk).items():
+                totals[key] += value
         
         db_session.commit()
-        logger.info(f"成功生成并保存 {count} 条用例")
-        return count
+        logger.info(f"成功生成并保存用例: {totals}")
+        return totals
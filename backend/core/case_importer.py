@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+用例批量导入
+
+上传文件不整体读入内存: CSV 用 pandas 分块读取, Excel 用 openpyxl 只读模式逐行读取,
+每 CHUNK_SIZE 行做一次 executemany 批量写入并提交, 内存占用与文件大小无关。
+旧版 .xls (最多 65536 行) openpyxl 不支持, 经 pandas + xlrd 整表读取后同样分块写入。
+导入过程以进度事件的形式逐块产出, 接口可以直接流式返回 (NDJSON)。
+
+导入是幂等的 upsert: 有 external_id 时按外部编号匹配, 否则按标准化问题的 hash 匹配。
+每块只做一次 IN 查询 (走 ix_test_cases_external_id / ix_test_cases_question_hash),
+内容没有变化的行不写库, 重复导入同一份表格只统计为 unchanged。
+
+写入前编译预期关键字 / 条件 (见 expectations.py), 格式错误的行不写库, 统计为 invalid
+并附带行号和原因返回, 不会带着坏数据进入批次执行。
+
+导入不是原子的: 文件在中途解析失败时, 之前已提交的块保留在库中 (CaseImportError 带有这部分的统计)。
+由于导入是幂等的 upsert, 修正文件后重新导入即可, 已导入的行统计为 unchanged。
+"""
+
+import re
+import hashlib
+import logging
+import unicodedata
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from .expectations import Expectations, ExpectationError
+
+logger = logging.getLogger("Backend.CaseImporter")
+
+# 每块行数 (解析 + 插入 + 提交)
+CHUNK_SIZE = 2000
+
+# 导入结果中最多返回的错误明细条数
+MAX_REPORTED_ERRORS = 100
+
+# 字段别名映射 (优先级从高到低)
+COLUMN_ALIASES = {
+    "question": ["question", "问题", "query"],
+    "expected_keywords": ["expected_keywords", "预期关键字", "keywords"],
+    "expected_conditions": ["expected_conditions", "预期条件", "conditions"],
+    "expected_sql": ["expected_sql", "预期SQL", "sql", "standard_sql"],
+    "category": ["category", "分类"],
+    "expect_company": ["expect_company", "预期公司", "company"],
+    "expect_indicator": ["expect_indicator", "预期指标", "indicator"],
+    "expect_time": ["expect_time", "预期时间", "time"],
+    # 不含 "备注": 那是导出报告中的校验信息列, 重新导入报告时不能写进用例描述
+    "description": ["description", "描述"],
+    "external_id": ["external_id", "外部编号", "case_no"],
+}
+
+# 导入写入的用例字段
+IMPORT_FIELDS = list(COLUMN_ALIASES.keys())
+
+_WHITESPACE = re.compile(r'\s+')
+
+# 生成脚本在 description 开头写入 "[分类] ...", 没有分类列时从这里提取
+_CATEGORY_PREFIX = re.compile(r'^\[([^\]]+)\]')
+
+
+class CaseImportError(ValueError):
+    """导入中途失败, totals 为失败前已提交的统计 (inserted / updated / unchanged / invalid)"""
+
+    def __init__(self, message: str, totals: Dict[str, int]):
+        super().__init__(message)
+        self.totals = totals
+
+
+class CaseImporter:
+    """流式用例导入"""
+
+    @staticmethod
+    def _resolve_columns(header: List[str]) -> Dict[str, int]:
+        """表头 -> {字段: 列下标}"""
+        cleaned = [str(h).strip().lstrip('\ufeff') if h is not None else "" for h in header]
+        mapping = {}
+        for field, aliases in COLUMN_ALIASES.items():
+            for alias in aliases:
+                if alias in cleaned:
+                    mapping[field] = cleaned.index(alias)
+                    break
+        if "question" not in mapping:
+            raise ValueError("未找到问题列 (question/问题/query)")
+        return mapping
+
+    @staticmethod
+    def _read_csv(fileobj: BinaryIO) -> Iterator[List[List[Any]]]:
+        reader = pd.read_csv(
+            fileobj, chunksize=CHUNK_SIZE, dtype=str, keep_default_na=False, encoding="utf-8-sig"
+        )
+        header_sent = False
+        for chunk in reader:
+            if not header_sent:
+                yield [list(chunk.columns)]
+                header_sent = True
+            yield chunk.values.tolist()
+
+    @staticmethod
+    def _read_excel(fileobj: BinaryIO) -> Iterator[List[List[Any]]]:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            yield [list(header)]
+            chunk = []
+            for row in rows:
+                chunk.append(list(row))
+                if len(chunk) >= CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def _read_xls(fileobj: BinaryIO) -> Iterator[List[List[Any]]]:
+        try:
+            frame = pd.read_excel(fileobj, dtype=str, keep_default_na=False, engine="xlrd")
+        except ImportError:
+            raise ValueError("读取 .xls 文件需要 xlrd, 请安装 xlrd 或将文件另存为 .xlsx / .csv 后导入")
+        yield [list(frame.columns)]
+        for start in range(0, len(frame), CHUNK_SIZE):
+            yield frame.iloc[start:start + CHUNK_SIZE].values.tolist()
+
+    @staticmethod
+    def _reader(filename: str):
+        name = filename.lower()
+        if name.endswith(".csv"):
+            return CaseImporter._read_csv
+        if name.endswith(".xls"):
+            return CaseImporter._read_xls
+        return CaseImporter._read_excel
+
+    @staticmethod
+    def iter_chunks(fileobj: BinaryIO, filename: str) -> Iterator[List[Dict[str, Any]]]:
+        """
+        逐块产出已按字段映射的用例字典, 跳过问题为空的行
+
+        row_number 为该行在文件中的行号 (表头为第 1 行), 用于报告错误
+        """
+        reader = CaseImporter._reader(filename)
+        mapping = None
+        row_number = 1
+        for rows in reader(fileobj):
+            if mapping is None:
+                mapping = CaseImporter._resolve_columns(rows[0])
+                continue
+            cases = []
+            for row in rows:
+                row_number += 1
+                case = {}
+                for field, idx in mapping.items():
+                    value = row[idx] if idx < len(row) else None
+                    value = "" if value is None else str(value).strip()
+                    case[field] = "" if value == "nan" else value
+                if not case["question"]:
+                    continue
+                case["row_number"] = row_number
+                if not case.get("category"):
+                    # 没有分类列 (或为空) 时不覆盖已有分类
+                    case.pop("category", None)
+                    match = _CATEGORY_PREFIX.match(case.get("description", ""))
+                    if match:
+                        case["category"] = match.group(1)
+                cases.append(case)
+            yield cases
+
+    @staticmethod
+    def question_hash(question: str) -> str:
+        """标准化问题 (全半角统一、折叠空白、忽略大小写) 后取 sha1"""
+        normalized = _WHITESPACE.sub(' ', unicodedata.normalize("NFKC", question)).strip().lower()
+        return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def upsert_cases(db_session, cases: List[Dict[str, Any]], errors: Optional[List[dict]] = None) -> Dict[str, int]:
+        """
+        按 external_id / question_hash 批量 upsert 一块用例 (调用方负责提交)
+
+        只更新文件中提供了的字段, 启用状态等其他字段保持不变。
+        预期格式错误的行跳过, 明细追加到 errors (如果传入)。
+
+        Returns:
+            {"inserted": n, "updated": n, "unchanged": n, "invalid": n}
+        """
+        from sqlalchemy import bindparam, insert, or_, select, update
+        from ..app.models import TestCase
+
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0}
+
+        def compile_into(row: Dict[str, Any], case: Dict[str, Any]) -> bool:
+            try:
+                row.update(Expectations.columns(row["expected_keywords"], row["expected_conditions"]))
+                return True
+            except ExpectationError as e:
+                counts["invalid"] += 1
+                if errors is not None:
+                    errors.append({"row": case.get("row_number"), "question": case["question"], "error": str(e)})
+                return False
+
+        # 块内重复的行以最后一次出现为准
+        by_key: Dict[tuple, Dict[str, Any]] = {}
+        for case in cases:
+            case["question_hash"] = CaseImporter.question_hash(case["question"])
+            key = ("ext", case["external_id"]) if case.get("external_id") else ("q", case["question_hash"])
+            if key in by_key:
+                counts["unchanged"] += 1
+            by_key[key] = case
+        cases = list(by_key.values())
+        if not cases:
+            return counts
+
+        external_ids = [c["external_id"] for c in cases if c.get("external_id")]
+        question_hashes = [c["question_hash"] for c in cases]
+        columns = [TestCase.id, TestCase.question_hash] + [getattr(TestCase, f) for f in IMPORT_FIELDS]
+        conditions = [TestCase.question_hash.in_(question_hashes)]
+        if external_ids:
+            conditions.append(TestCase.external_id.in_(external_ids))
+
+        by_external: Dict[str, dict] = {}
+        by_question: Dict[str, dict] = {}
+        for row in db_session.execute(select(*columns).where(or_(*conditions)).order_by(TestCase.id)):
+            row = row._asdict()
+            if row["external_id"]:
+                by_external.setdefault(row["external_id"], row)
+            by_question.setdefault(row["question_hash"], row)
+
+        inserts, updates = [], []
+        for case in cases:
+            existing = by_external.get(case["external_id"]) if case.get("external_id") else None
+            if existing is None:
+                existing = by_question.get(case["question_hash"])
+
+            if existing is None:
+                row = {f: case.get(f) for f in IMPORT_FIELDS}
+                row.update(question_hash=case["question_hash"], is_active=True)
+                if compile_into(row, case):
+                    inserts.append(row)
+                continue
+
+            provided = [f for f in IMPORT_FIELDS if f in case and (f != "external_id" or case[f])]
+            if all((existing[f] or "") == (case[f] or "") for f in provided):
+                counts["unchanged"] += 1
+                continue
+            row = {f: case[f] if f in provided else existing[f] for f in IMPORT_FIELDS}
+            row.update(b_id=existing["id"], question_hash=case["question_hash"])
+            if compile_into(row, case):
+                updates.append(row)
+
+        if inserts:
+            db_session.execute(insert(TestCase), inserts)
+        if updates:
+            # Core executemany, 参数中的列名即 SET 的列
+            db_session.connection().execute(
+                update(TestCase.__table__).where(TestCase.__table__.c.id == bindparam("b_id")), updates
+            )
+        counts["inserted"] += len(inserts)
+        counts["updated"] += len(updates)
+        return counts
+
+    @staticmethod
+    def import_stream(db_session, fileobj: BinaryIO, filename: str) -> Iterator[Dict[str, Any]]:
+        """
+        导入并逐块产出进度
+
+        Yields:
+            每块一条 {"type": "progress", "inserted": n, "updated": n, "unchanged": n, "invalid": n},
+            最后一条 type 为 "done", 另含 imported (= inserted + updated)
+            和 errors (格式错误的行, 最多 MAX_REPORTED_ERRORS 条)
+        """
+        totals = {"inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0}
+        errors: List[dict] = []
+        for cases in CaseImporter.iter_chunks(fileobj, filename):
+            if cases:
+                chunk_errors: List[dict] = []
+                for key, value in CaseImporter.upsert_cases(db_session, cases, chunk_errors).items():
+                    totals[key] += value
+                db_session.commit()
+                errors.extend(chunk_errors[:MAX_REPORTED_ERRORS - len(errors)])
+            yield {"type": "progress", **totals}
+
+        logger.info(f"Imported cases from {filename}: {totals}")
+        yield {"type": "done", "imported": totals["inserted"] + totals["updated"], **totals, "errors": errors}
+
+    @staticmethod
+    def import_file(db_session, fileobj: BinaryIO, filename: str) -> Dict[str, int]:
+        """
+        导入并返回统计 {"imported", "inserted", "updated", "unchanged", "invalid", "errors"}
+
+        Raises:
+            CaseImportError: 中途失败, 之前的块已提交
+        """
+        result: Optional[Dict[str, Any]] = None
+        try:
+            for result in CaseImporter.import_stream(db_session, fileobj, filename):
+                pass
+        except Exception as e:
+            db_session.rollback()
+            totals = {k: v for k, v in (result or {}).items() if k in ("inserted", "updated", "unchanged", "invalid")}
+            raise CaseImportError(str(e).strip(), totals) from e
+        result = dict(result or {"imported": 0})
+        result.pop("type", None)
+        return result
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+基于执行结果的 SQL 校验
+
+关键字匹配无法判断 SQL 查出来的数是否正确。这里把 expected_sql 和 actual_sql 都放到
+本地的业务表快照 (SQLite, 默认 data/fixture/business.db, 由 A_SHARE_* 等业务表导出)
+上执行, 比较两者的结果集:
+- 列名 (别名) 不参与比较, 只比较列数和每行的值
+- 标准 SQL 带 ORDER BY 时按顺序比较, 否则按多重集 (Counter) 比较
+- 原始值不一致时再把数值统一四舍五入到 6 位小数比较一次, 绝大多数用例不需要逐值标准化
+- 每条语句有执行超时 (EXEC_TIMEOUT 秒, 通过 SQLite progress handler 中断), 结果最多取 EXEC_MAX_ROWS 行;
+  标准 SQL 的结果超过该行数时无法完整比较, 视为无法判定 (不比较截断后的结果)
+
+快照以只读方式打开, 连接池 (EXEC_POOL_SIZE) 中的连接可在多个线程中并行执行
+(sqlite3 执行查询时释放 GIL)。标准 SQL 的结果按 (SQL hash, 快照版本) 缓存,
+快照文件被替换后版本号随之变化, 旧缓存自然失效。
+
+标准 SQL 在快照上无法执行 (例如用到了 SQLite 不支持的 MySQL 函数) 时结果为 "无法判定",
+由调用方退回其他校验方式。
+
+快照生成:
+    python -m backend.core.exec_validator            # 从业务库导出 A_SHARE_* 表
+    python -m backend.core.exec_validator 5000       # 每张表最多导出 5000 行
+"""
+
+import os
+import time
+import queue
+import logging
+import sqlite3
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .config import Config
+from .sql_digest import SqlDigest
+from .sql_fingerprint import SqlParseError, fingerprint_cache
+
+logger = logging.getLogger("Backend.ExecValidator")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_FIXTURE_PATH = os.path.join(PROJECT_ROOT, "data", "fixture", "business.db")
+
+# progress handler 的调用间隔 (SQLite 虚拟机指令数)
+PROGRESS_STEPS = 10000
+
+# 数值比较精度 (小数位)
+FLOAT_DIGITS = 6
+
+
+class ExecutionError(Exception):
+    """SQL 在快照上执行失败 (语法 / 不支持的函数 / 超时)"""
+
+
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, (int, float)):
+        return round(float(value), FLOAT_DIGITS)
+    return value
+
+
+def _normalize_rows(rows: List[Tuple]) -> List[Tuple]:
+    return [tuple(_normalize_value(v) for v in row) for row in rows]
+
+
+def _same_rows(expected: List[Tuple], actual: List[Tuple], ordered: bool) -> bool:
+    # int 与 float 相等时哈希也相同, 1 与 1.0 不需要标准化即可判等
+    if ordered:
+        return expected == actual
+    return Counter(expected) == Counter(actual)
+
+
+class ExecutionValidator:
+    """在只读快照上执行并比较结果集"""
+
+    def __init__(self, path: Optional[str] = None, pool_size: int = 4, timeout: float = 5.0,
+                 max_rows: int = 10000, cache_size: int = 2048):
+        self.path = path or DEFAULT_FIXTURE_PATH
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._version: Optional[str] = None
+        self._created = 0
+        self._cache: "OrderedDict[Tuple[str, str], object]" = OrderedDict()
+
+    # ================= 快照与连接池 =================
+
+    def snapshot_version(self) -> Optional[str]:
+        """快照文件的版本 (大小 + 修改时间), 文件不存在时返回 None"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return f"{st.st_size}-{st.st_mtime_ns}"
+
+    def available(self) -> bool:
+        return self.snapshot_version() is not None
+
+    def _sync_version(self) -> Optional[str]:
+        """快照被替换时丢弃旧连接"""
+        version = self.snapshot_version()
+        with self._lock:
+            if version != self._version:
+                while True:
+                    try:
+                        self._pool.get_nowait().close()
+                    except queue.Empty:
+                        break
+                self._created = 0
+                self._version = version
+        return version
+
+    def _connect(self) -> sqlite3.Connection:
+        # 自动提交模式: 不开启隐式事务, 连接归还时不会持有读锁
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False,
+                               timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def _connection(self, version: str):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                conn = self._connect()
+            else:
+                try:
+                    conn = self._pool.get(timeout=self.timeout * 2)
+                except queue.Empty:
+                    raise ExecutionError("没有空闲的快照连接")
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                current = version == self._version
+            if current:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    # ================= 执行与比较 =================
+
+    def execute(self, sql: str, version: str) -> Tuple[int, List[Tuple]]:
+        """
+        执行一条查询, 返回 (列数, 行); 最多取 max_rows + 1 行, 多出的一行表示结果被截断
+
+        Raises:
+            ExecutionError: 执行失败或超时
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._connection(version) as conn:
+            conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, PROGRESS_STEPS)
+            try:
+                cursor = conn.execute(sql.strip().rstrip(";"))
+                rows = cursor.fetchmany(self.max_rows + 1)
+                width = len(cursor.description or ())
+                cursor.close()
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    raise ExecutionError(f"执行超时 ({self.timeout}s)")
+                raise ExecutionError(str(e))
+            except (sqlite3.Error, ValueError) as e:
+                raise ExecutionError(str(e))
+            finally:
+                conn.set_progress_handler(None, 0)
+        return width, rows
+
+    def _expected(self, expected_sql: str, version: str):
+        """标准 SQL 的结果 (或 ExecutionError), 按 (hash, 快照版本) 缓存"""
+        key = (SqlDigest.digest(expected_sql), version)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+                return entry
+        try:
+            entry = self.execute(expected_sql, version)
+        except ExecutionError as e:
+            entry = e
+        with self._lock:
+            self._cache[key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _ordered(expected_sql: str) -> bool:
+        try:
+            return bool(fingerprint_cache.get(expected_sql).order_by)
+        except SqlParseError:
+            return "ORDER BY" in SqlDigest.normalize(expected_sql).upper()
+
+    def validate(self, actual_sql: str, expected_sql: str) -> Optional[Tuple[bool, str]]:
+        """
+        比较两条 SQL 在快照上的结果
+
+        Returns:
+            (是否一致, 说明); 快照不存在或标准 SQL 无法执行时返回 None (无法判定)
+        """
+        if not expected_sql or not expected_sql.strip():
+            return None
+        if not actual_sql or actual_sql.startswith("Error"):
+            return False, actual_sql or "Empty SQL"
+        version = self._sync_version()
+        if version is None:
+            return None
+
+        expected = self._expected(expected_sql, version)
+        if isinstance(expected, ExecutionError):
+            logger.debug(f"Expected SQL not executable on fixture: {expected}")
+            return None
+        try:
+            actual = self.execute(actual_sql, version)
+        except ExecutionError as e:
+            return False, f"SQL 执行失败: {e}"
+
+        (expected_width, expected_rows), (actual_width, actual_rows) = expected, actual
+        if len(expected_rows) > self.max_rows:
+            logger.debug(f"Expected SQL returns more than {self.max_rows} rows, cannot compare")
+            return None
+        if expected_width != actual_width:
+            return False, f"结果列数不一致: 预期 {expected_width}, 实际 {actual_width}"
+        if len(actual_rows) > self.max_rows:
+            return False, f"结果行数不一致: 预期 {len(expected_rows)}, 实际超过 {self.max_rows}"
+        if len(expected_rows) != len(actual_rows):
+            return False, f"结果行数不一致: 预期 {len(expected_rows)}, 实际 {len(actual_rows)}"
+        ordered = self._ordered(expected_sql)
+        if (_same_rows(expected_rows, actual_rows, ordered)
+                or _same_rows(_normalize_rows(expected_rows), _normalize_rows(actual_rows), ordered)):
+            return True, "Pass"
+        return False, "结果集不一致 (含顺序)" if ordered else "结果集不一致"
+
+    def validate_many(self, pairs: Sequence[Tuple[str, str]]) -> List[Optional[Tuple[bool, str]]]:
+        """并行校验多组 (actual_sql, expected_sql), 并发数为连接池大小"""
+        if len(pairs) <= 1 or self.pool_size <= 1:
+            return [self.validate(actual, expected) for actual, expected in pairs]
+        with ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="exec-validator") as executor:
+            return list(executor.map(lambda pair: self.validate(*pair), pairs))
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    # ================= 快照生成 =================
+
+    def build_snapshot(self, source_url: Optional[str] = None, tables: Optional[Sequence[str]] = None,
+                       row_limit: Optional[int] = None, chunk_size: int = 20000) -> List[Tuple[str, int]]:
+        """
+        从业务库导出业务表到快照文件 (先写临时文件, 完成后原子替换)
+
+        Args:
+            source_url: 业务库连接串, 默认 BusinessDBConfig
+            tables: 导出的表, 默认业务库中全部 A_SHARE_* 表
+            row_limit: 每张表最多导出的行数
+
+        Returns:
+            [(表名, 行数)]
+        """
+        import pandas as pd
+        from sqlalchemy import create_engine, inspect, text
+
+        if source_url is None:
+            from .case_generator import BusinessDBConfig
+            source_url = BusinessDBConfig.get_connection_url()
+        source = create_engine(source_url, connect_args={"connect_timeout": 10} if "mysql" in source_url else {})
+        if tables is None:
+            tables = [t for t in inspect(source).get_table_names() if t.upper().startswith("A_SHARE_")]
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        exported = []
+        target = sqlite3.connect(tmp_path)
+        try:
+            with source.connect() as conn:
+                for table in tables:
+                    query = f"SELECT * FROM {table}" + (f" LIMIT {int(row_limit)}" if row_limit else "")
+                    count = 0
+                    for chunk in pd.read_sql(text(query), conn, chunksize=chunk_size):
+                        chunk.to_sql(table, target, if_exists="append" if count else "replace", index=False)
+                        count += len(chunk)
+                    exported.append((table, count))
+                    logger.info(f"Exported {table}: {count} rows")
+            target.commit()
+        finally:
+            target.close()
+            source.dispose()
+        os.replace(tmp_path, self.path)
+        self.clear_cache()
+        return exported
+
+
+exec_validator = ExecutionValidator(
+    path=Config.get("EXEC_FIXTURE_DB") or None,
+    pool_size=int(Config.get("EXEC_POOL_SIZE", 4)),
+    timeout=float(Config.get("EXEC_TIMEOUT", 5)),
+    max_rows=int(Config.get("EXEC_MAX_ROWS", 10000)),
+    cache_size=int(Config.get("EXEC_CACHE_SIZE", 2048)),
+)
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    print(exec_validator.build_snapshot(row_limit=limit))
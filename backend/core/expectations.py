@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+预编译的用例预期
+
+expected_keywords / expected_conditions 是自由文本 (按半角/全角逗号、分号、换行分隔)。
+用例保存、导入、生成时解析一次, 标准化后的结构连同版本号存入
+TestCase.compiled_expectations / expectations_version, 执行批次时直接使用, 不再逐次拆分。
+
+编译时同时做格式检查, 有问题的预期在保存 / 导入时就报错 (ExpectationError),
+而不是等到批次执行中途才表现为莫名其妙的失败。
+
+编译结果:
+    {"keywords": ["ACC_DIVIDEND_AMOUNT", ...],
+     "conditions": [{"text": "NAME='X'", "match": "NAME=X"}, ...]}
+text 是报告中展示的原文 (大写), match 是去掉引号后用于匹配的形式。
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+# 编译格式版本, 解析或标准化规则变化时递增; 版本不符的存量数据在使用时按文本重新编译
+EXPECTATIONS_VERSION = 1
+
+# 单个关键字 / 条件的最大长度, 更长的一般是把整段 SQL 粘贴进了预期
+MAX_ITEM_LENGTH = 500
+
+# 分隔符: 半角/全角逗号、分号、换行
+_SPLIT_PATTERN = re.compile(r'[,\n\uff0c;]')
+
+
+class ExpectationError(ValueError):
+    """预期关键字 / 条件格式错误"""
+
+
+class Expectations:
+    """预期的解析、检查与编译"""
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def split(expected: Optional[str]) -> Tuple[str, ...]:
+        """拆分预期文本并转为大写, 去掉空项 (相同的字符串只拆分一次)"""
+        if not expected or not str(expected).strip():
+            return ()
+        parts = (part.strip().upper() for part in _SPLIT_PATTERN.split(str(expected)))
+        return tuple(part for part in parts if part)
+
+    @staticmethod
+    def strip_quotes(text: str) -> str:
+        return text.replace("'", "").replace('"', "")
+
+    @staticmethod
+    def _check(keywords: Tuple[str, ...], conditions: Tuple[str, ...]):
+        for kw in keywords:
+            if len(kw) > MAX_ITEM_LENGTH:
+                raise ExpectationError(f"预期关键字过长 ({len(kw)} 字符): {kw[:50]}...")
+        for cond in conditions:
+            if len(cond) > MAX_ITEM_LENGTH:
+                raise ExpectationError(f"预期条件过长 ({len(cond)} 字符): {cond[:50]}...")
+            if cond.count("'") % 2 or cond.count('"') % 2:
+                # 常见于引号内含有逗号的条件被分隔符拆开
+                raise ExpectationError(f"预期条件引号不成对 (引号内不能包含逗号/分号): {cond}")
+            if not Expectations.strip_quotes(cond).strip():
+                raise ExpectationError(f"预期条件去掉引号后为空: {cond}")
+
+    @staticmethod
+    def compile(exp_keywords: Optional[str], exp_conditions: Optional[str], strict: bool = True) -> Dict[str, Any]:
+        """
+        编译预期文本
+
+        Args:
+            strict: 是否做格式检查; 存量数据按文本重新编译时传 False, 判定结果与 Validator.validate 一致
+
+        Raises:
+            ExpectationError: strict 且格式错误
+        """
+        keywords = Expectations.split(exp_keywords)
+        conditions = Expectations.split(exp_conditions)
+        if strict:
+            Expectations._check(keywords, conditions)
+        return {
+            "keywords": list(keywords),
+            "conditions": [{"text": cond, "match": Expectations.strip_quotes(cond)} for cond in conditions],
+        }
+
+    @staticmethod
+    def load(compiled: Optional[Dict[str, Any]], version: Optional[int],
+             exp_keywords: Optional[str], exp_conditions: Optional[str]) -> Dict[str, Any]:
+        """取用例的编译结果; 未编译或版本过期时按文本重新编译 (不做格式检查)"""
+        if compiled is not None and version == EXPECTATIONS_VERSION:
+            return compiled
+        return Expectations.compile(exp_keywords, exp_conditions, strict=False)
+
+    @staticmethod
+    def columns(exp_keywords: Optional[str], exp_conditions: Optional[str]) -> Dict[str, Any]:
+        """用例保存时写入的列 {"compiled_expectations", "expectations_version"}"""
+        return {
+            "compiled_expectations": Expectations.compile(exp_keywords, exp_conditions),
+            "expectations_version": EXPECTATIONS_VERSION,
+        }
+
+    @staticmethod
+    def flatten(compiled: Dict[str, Any]) -> Tuple[List[str], List[Tuple[str, str]]]:
+        """(关键字列表, [(条件原文, 匹配形式)])"""
+        return (
+            list(compiled.get("keywords") or []),
+            [(c["text"], c["match"]) for c in compiled.get("conditions") or []],
+        )
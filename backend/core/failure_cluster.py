@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+失败聚类
+
+机器人回归时几百个用例同时失败, 逐行看 "缺关键字: ..." 很难看出是几种问题。
+这里把失败结果按失败模式分组:
+- SQL 形状: 实际 SQL 的 token 序列, 字符串 / 数字常量替换为 ?, 不同股票、日期的同一种写法视为相同
+- 缺失模式: 校验说明拆成的检查项 (如 "缺关键字:ORDER"), 数字替换为 #
+
+SQL 形状和缺失模式完全相同的结果先合并; 其余用 MinHash 签名做 LSH 分桶 (bands x rows),
+同一个桶内与桶首估计 Jaccard 系数达到阈值的结果用并查集合并。每一条结果只与各个桶的桶首比较,
+整体接近线性, 不做两两比较。
+"""
+
+import re
+from collections import Counter
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from .similarity import MinHasher, hash_items, minhasher, sql_tokens
+
+# LSH 分桶: BANDS x ROWS 须等于签名长度; 估计 Jaccard 约 (1/BANDS)^(1/ROWS) ≈ 0.5 以上的结果才会落入同一个桶
+BANDS = 16
+ROWS = 4
+
+# 合并阈值 (估计的 Jaccard 系数)
+DEFAULT_THRESHOLD = 0.6
+
+_LITERAL = re.compile(r"^'.*'$|^\d+(\.\d+)?$")
+_DIGITS = re.compile(r"\d+")
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+class FailureClusterer:
+    """失败结果聚类"""
+
+    @staticmethod
+    def sql_shape(actual_sql: str) -> List[str]:
+        """SQL 形状: 常量替换为 ? 的 token 序列; 报错信息只把数字替换为 #"""
+        if not actual_sql or actual_sql.startswith("Error"):
+            return [_DIGITS.sub("#", actual_sql or "")]
+        return ["?" if _LITERAL.match(token) else token for token in sql_tokens(actual_sql)]
+
+    @staticmethod
+    def missing_items(message: str) -> List[str]:
+        """校验说明拆成检查项: "缺关键字: A,B; 缺条件: X=1" -> ["缺关键字:A", "缺关键字:B", "缺条件:X=#"]"""
+        items = []
+        for part in (message or "").split("; "):
+            head, sep, body = part.partition(":")
+            if not sep or head.startswith("Error"):
+                items.append(_DIGITS.sub("#", part.strip()))
+                continue
+            items.extend(f"{head.strip()}:{_DIGITS.sub('#', item.strip())}" for item in body.split(",") if item.strip())
+        return items
+
+    @staticmethod
+    def cluster(results: Sequence[Dict[str, Any]], threshold: float = DEFAULT_THRESHOLD,
+                examples: int = 3) -> List[Dict[str, Any]]:
+        """
+        Args:
+            results: 失败结果, 需要 case_id / question / actual_sql / message 字段
+            threshold: 合并阈值 (估计的 Jaccard 系数)
+            examples: 每个分组返回的示例条数
+
+        Returns:
+            按大小降序的分组: {"cluster_id", "size", "pattern", "common_missing", "sql_shape", "case_ids", "examples"}
+        """
+        if not results:
+            return []
+
+        # 1. SQL 形状和缺失模式完全相同的先合并, 只对代表项做 LSH
+        shapes = [FailureClusterer.sql_shape(r.get("actual_sql") or "") for r in results]
+        missing = [FailureClusterer.missing_items(r.get("message") or "") for r in results]
+        exact: Dict[tuple, int] = {}
+        members_of: List[List[int]] = []
+        for i, (shape, items) in enumerate(zip(shapes, missing)):
+            key = (tuple(shape), tuple(sorted(set(items))))
+            if key not in exact:
+                exact[key] = len(members_of)
+                members_of.append([])
+            members_of[exact[key]].append(i)
+
+        # 2. 代表项的 MinHash 签名: SQL 形状的 token / 相邻 token 对 + 缺失检查项
+        representatives = [members[0] for members in members_of]
+        sets = []
+        for i in representatives:
+            shape = shapes[i]
+            features = [f"s:{t}" for t in shape] + [f"s:{a} {b}" for a, b in zip(shape, shape[1:])]
+            features += [f"m:{item}" for item in missing[i]]
+            sets.append(hash_items(features))
+        signatures = minhasher.signatures(sets)
+
+        # 3. LSH 分桶, 桶内成员与桶首比较后合并
+        uf = _UnionFind(len(representatives))
+        FailureClusterer._merge_buckets(signatures, uf, threshold)
+
+        groups: Dict[int, List[int]] = {}
+        for rep_index, members in enumerate(members_of):
+            groups.setdefault(uf.find(rep_index), []).extend(members)
+
+        clusters = [
+            FailureClusterer._describe(sorted(members), results, shapes, missing, examples)
+            for members in groups.values()
+        ]
+        clusters.sort(key=lambda c: (-c["size"], c["case_ids"][0] if c["case_ids"] else 0))
+        for cluster_id, cluster in enumerate(clusters, 1):
+            cluster["cluster_id"] = cluster_id
+        return clusters
+
+    @staticmethod
+    def _merge_buckets(signatures: np.ndarray, uf: _UnionFind, threshold: float):
+        n, num_perm = signatures.shape
+        if n < 2:
+            return
+        rows = num_perm // BANDS
+        weights = np.arange(1, rows + 1, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+        for band in range(BANDS):
+            block = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+            with np.errstate(over="ignore"):
+                keys = (block * weights).sum(axis=1)
+            order = np.argsort(keys, kind="stable")
+            sorted_keys = keys[order]
+            # 每个桶的桶首 (排序后同一键的第一个)
+            starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+            leaders = order[np.maximum.accumulate(np.where(starts, np.arange(n), 0))]
+            candidates = leaders != order
+            if not candidates.any():
+                continue
+            left, right = order[candidates], leaders[candidates]
+            similar = MinHasher.jaccard(signatures[left], signatures[right]) >= threshold
+            for a, b in zip(left[similar].tolist(), right[similar].tolist()):
+                uf.union(a, b)
+
+    @staticmethod
+    def _describe(members: List[int], results, shapes, missing, examples: int) -> Dict[str, Any]:
+        first = members[0]
+        item_counts = Counter(item for i in members for item in set(missing[i]))
+        # 所有成员共有的检查项, 即这一组的共同失败原因
+        common = [item for item, count in item_counts.most_common() if count == len(members)]
+        pattern = Counter(_DIGITS.sub("#", results[i].get("message") or "") for i in members).most_common(1)[0][0]
+        return {
+            "cluster_id": 0,
+            "size": len(members),
+            "pattern": pattern,
+            "common_missing": common[:20],
+            "sql_shape": " ".join(shapes[first]),
+            "case_ids": [results[i].get("case_id") for i in members],
+            "examples": [
+                {k: results[i].get(k) for k in ("case_id", "question", "actual_sql", "message")}
+                for i in members[:examples]
+            ],
+        }
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+多模式子串匹配 (Aho-Corasick)
+
+一组模式串构建一次自动机, 之后每段文本只需扫描一遍即可得到其中出现过的全部模式,
+代价与文本长度成正比, 与模式数量无关。批量校验时, 一个用例集合的全部预期关键字 /
+条件共用一个自动机; 只有单个用例的检查项足够多 (BatchValidator.AUTOMATON_MIN_PATTERNS)
+时才用它取代 "每个关键字一次 in 扫描", 常规用例仍逐项 in。
+"""
+
+from collections import deque
+from typing import Dict, Iterable, List, Set
+
+
+class MultiPatternMatcher:
+    """
+    Aho-Corasick 自动机
+
+    状态用整数编号, _goto[s] 为状态 s 的转移表, _fail[s] 为失败指针,
+    _output[s] 为在状态 s 结束的模式编号, _link[s] 指向失败链上最近的有输出的状态。
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._index: Dict[str, int] = {}
+        for pattern in patterns:
+            # 空串总是 "出现", 不进入自动机
+            if pattern and pattern not in self._index:
+                self._index[pattern] = len(self.patterns)
+                self.patterns.append(pattern)
+
+        self._goto: List[Dict[str, int]] = [{}]
+        self._output: List[int] = [-1]
+        for pid, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._output.append(-1)
+                state = nxt
+            self._output[state] = pid
+
+        self._fail = [0] * len(self._goto)
+        self._link = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._link[nxt] = target if self._output[target] >= 0 else self._link[target]
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def find(self, text: str) -> Set[str]:
+        """返回 text 中出现过的模式"""
+        if not self.patterns:
+            return set()
+        goto, fail, output, link = self._goto, self._fail, self._output, self._link
+        found: Set[int] = set()
+        # 已收集过输出的状态; 其失败链上的输出也已收集, 再次到达时无需沿链回溯
+        visited: Set[int] = set()
+        state = 0
+        for ch in text:
+            while True:
+                nxt = goto[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if state == 0:
+                    break
+                state = fail[state]
+            node = state
+            while node and node not in visited:
+                visited.add(node)
+                if output[node] >= 0:
+                    found.add(output[node])
+                node = link[node]
+        return {self.patterns[pid] for pid in found}
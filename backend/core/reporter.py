@@ -3,23 +3,36 @@
 报告模块 - 生成 Excel 测试报告
 
 实现：
-1. Excel 报告生成（带样式）
+1. Excel 报告生成（带样式, write-only 模式流式写入, 内存占用与行数无关）
 2. 统计通过/失败数量
 3. 按原始顺序排序
 """
 
 import logging
-import pandas as pd
 import os
-from typing import List, Dict, Any
+from copy import copy
+from typing import List, Dict, Any, Iterable, Optional, Sequence
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+from openpyxl.utils import get_column_letter
 
 from .config import Config
 
 logger = logging.getLogger("Backend.Reporter")
 
+# 报告的列及列宽
+REPORT_COLUMNS = {
+    "Index": 8,
+    "问题": 40,
+    "预期关键字": 20,
+    "预期条件": 20,
+    "实际生成的SQL": 60,
+    "测试结果": 10,
+    "备注": 30
+}
+
 
 class Reporter:
     """
@@ -55,80 +68,98 @@ class Reporter:
         """
         if output_path is None:
             output_path = Config.get("OUTPUT_FILE")
-        
-        # 确保目录存在
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
         if not self.results:
             logger.warning("没有测试结果，无法生成报告")
-            # 创建一个空文件以免报错
-            pd.DataFrame().to_excel(output_path)
-            return output_path
-        
-        # 按 Index 排序
+
+        # 按 Index 排序; 列为各条结果字段的并集 (按出现顺序)
         sorted_results = sorted(self.results, key=lambda x: x.get("Index", 0))
-        
-        # 创建 DataFrame
-        df = pd.DataFrame(sorted_results)
-        
-        # 创建带样式的 Excel
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "测试报告"
-        
-        # 定义样式
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-        pass_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-        fail_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-        thin_border = Border(
-            left=Side(style='thin'),
-            right=Side(style='thin'),
-            top=Side(style='thin'),
-            bottom=Side(style='thin')
-        )
-        
-        # 写入数据
-        for r_idx, row in enumerate(dataframe_to_rows(df, index=False, header=True), 1):
-            for c_idx, value in enumerate(row, 1):
-                cell = ws.cell(row=r_idx, column=c_idx, value=value)
-                cell.border = thin_border
-                cell.alignment = Alignment(wrap_text=True, vertical='top')
-                
-                # 表头样式
-                if r_idx == 1:
-                    cell.font = header_font
-                    cell.fill = header_fill
-                # 测试结果列的样式
-                elif "测试结果" in df.columns and c_idx == df.columns.get_loc("测试结果") + 1:
-                    if value == "通过":
-                        cell.fill = pass_fill
-                    else:
-                        cell.fill = fail_fill
-        
-        # 调整列宽
-        column_widths = {
-            "Index": 8,
-            "问题": 40,
-            "预期关键字": 20,
-            "预期条件": 20,
-            "实际生成的SQL": 60,
-            "测试结果": 10,
-            "备注": 30
-        }
-        
-        for col_idx, col_name in enumerate(df.columns, 1):
-            ws.column_dimensions[ws.cell(row=1, column=col_idx).column_letter].width = column_widths.get(col_name, 15)
-        
-        # 保存
+        columns = list(dict.fromkeys(key for result in sorted_results for key in result))
+        Reporter.write_report(sorted_results, output_path, columns=columns)
+        return output_path
+
+    @staticmethod
+    def write_report(rows: Iterable[Dict[str, Any]], output_path: str,
+                     columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """
+        流式写出 Excel 测试报告
+
+        使用 openpyxl 的 write-only 模式逐行写入 (不在内存中保留单元格对象),
+        样式注册为共享的 NamedStyle, 每个单元格只引用样式名; rows 可以是逐块读取历史记录的生成器。
+
+        Args:
+            rows: 测试结果 (键为列名)
+            columns: 输出的列, 默认 REPORT_COLUMNS
+
+        Returns:
+            Dict: 统计信息 (同 get_statistics)
+        """
+        columns = list(columns or REPORT_COLUMNS)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+        wb = Workbook(write_only=True)
+        for style in Reporter._named_styles():
+            wb.add_named_style(style)
+        ws = wb.create_sheet("测试报告")
+        for col_idx, col_name in enumerate(columns, 1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = REPORT_COLUMNS.get(col_name, 15)
+
+        # 每种样式解析一次, 之后的单元格直接复制样式索引 (按名称赋值每次都要查找 NamedStyle)
+        prototypes = {}
+        for style in ("report_header", "report_cell", "report_pass", "report_fail"):
+            prototypes[style] = WriteOnlyCell(ws)
+            prototypes[style].style = style
+
+        def styled(value, style: str) -> WriteOnlyCell:
+            if isinstance(value, str):
+                # 控制字符会让 openpyxl 报错, 导致整份报告失败
+                value = ILLEGAL_CHARACTERS_RE.sub("", value)
+            cell = WriteOnlyCell(ws, value=value)
+            cell._style = copy(prototypes[style]._style)
+            return cell
+
+        ws.append([styled(name, "report_header") for name in columns])
+        total = passed = 0
+        for row in rows:
+            outcome = row.get("测试结果")
+            total += 1
+            passed += outcome == "通过"
+            ws.append([
+                styled(row.get(name), ("report_pass" if outcome == "通过" else "report_fail")
+                       if name == "测试结果" else "report_cell")
+                for name in columns
+            ])
+
         try:
             wb.save(output_path)
-            logger.info(f"✓ 测试报告已保存: {output_path}")
+            logger.info(f"✓ 测试报告已保存: {output_path} ({total} 行)")
         except Exception as e:
             logger.error(f"保存报告失败: {e}")
             raise
-        
-        return output_path
+
+        pass_rate = (passed / total * 100) if total > 0 else 0
+        return {"total": total, "passed": passed, "failed": total - passed, "pass_rate": f"{pass_rate:.2f}%"}
+
+    @staticmethod
+    def _named_styles() -> List[NamedStyle]:
+        thin = Side(style='thin')
+        border = Border(left=thin, right=thin, top=thin, bottom=thin)
+        alignment = Alignment(wrap_text=True, vertical='top')
+
+        def named(name: str, fill_color: Optional[str] = None, font: Optional[Font] = None) -> NamedStyle:
+            style = NamedStyle(name=name, border=border, alignment=alignment)
+            if fill_color:
+                style.fill = PatternFill(start_color=fill_color, end_color=fill_color, fill_type="solid")
+            if font:
+                style.font = font
+            return style
+
+        return [
+            named("report_header", "4472C4", Font(bold=True, color="FFFFFF")),
+            named("report_cell"),
+            named("report_pass", "C6EFCE"),
+            named("report_fail", "FFC7CE"),
+        ]
     
     def get_statistics(self) -> Dict[str, Any]:
         """
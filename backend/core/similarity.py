@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+实际 SQL 与预期的相似度
+
+PASS / FAIL 看不出机器人离正确答案有多近。这里给每条结果一个 0~1 的相似度分数:
+- SQL 相似度: 实际 SQL 与 expected_sql 的 token 集合 (单个 token + 相邻两个 token) 的 Jaccard 系数,
+  用 MinHash 估计, 整批 SQL 的签名由 numpy 一次算出
+- 预期覆盖率: 预期关键字 / 条件在实际 SQL 中出现的比例
+
+两者都有时取平均, 只有一项时取该项; 都没有时为 None。SQL 为空或是报错信息时为 0。
+
+MinHash 签名 (MinHasher.signatures) 也用于失败聚类的局部敏感索引。
+"""
+
+import re
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .expectations import Expectations
+from .validator import Validator
+
+# 签名长度 (哈希函数个数), 估计误差约为 1/sqrt(NUM_PERM)
+NUM_PERM = 64
+
+# 分数保留的小数位
+SCORE_DIGITS = 4
+
+# 每次计算签名的集合数: 中间矩阵为 NUM_PERM x 这些集合的元素总数 (uint64), 分块保证大批次内存平稳
+SIGNATURE_CHUNK = 1000
+
+# 相似度只需要粗粒度的 token (字符串常量 / 带引号的标识符 / 小数 / 单词 / 单个符号), 比 sql_fingerprint.tokenize 快得多
+_SHINGLE_TOKEN = re.compile(r"'(?:[^']|'')*'|\"[^\"]*\"|`[^`]*`|\d+\.\d+|\w+|[^\s\w]")
+
+
+def sql_tokens(sql: str) -> List[str]:
+    """粗粒度切分 SQL (大写)"""
+    return _SHINGLE_TOKEN.findall(sql.upper())
+
+
+def hash_items(items: Iterable[str]) -> np.ndarray:
+    """字符串集合的 32 位哈希 (crc32, 跨进程稳定), 已去重"""
+    items = set(items)
+    return np.fromiter((zlib.crc32(item.encode("utf-8")) for item in items), dtype=np.uint64, count=len(items))
+
+
+def shingles(sql: str) -> np.ndarray:
+    """SQL 的 token 集合 (单个 token + 相邻两个 token) 的哈希"""
+    values = sql_tokens(sql)
+    return hash_items(values + [f"{a} {b}" for a, b in zip(values, values[1:])])
+
+
+class MinHasher:
+    """
+    MinHash 签名
+
+    哈希族为 multiply-shift: h(x) = (a * x + b) >> 32 (uint64 溢出即取模 2^64),
+    每 SIGNATURE_CHUNK 个集合拼成一个数组后一次计算 (num_perm x 元素总数), 再按集合用 np.minimum.reduceat 取最小值。
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    def signatures(self, sets: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Args:
+            sets: 每个集合的元素哈希 (见 shingles)
+
+        Returns:
+            (len(sets), num_perm) 的 uint32 数组; 空集合的签名全为 0xFFFFFFFF
+        """
+        result = np.full((len(sets), self.num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+        non_empty = [i for i, s in enumerate(sets) if len(s)]
+        for start in range(0, len(non_empty), SIGNATURE_CHUNK):
+            chunk = non_empty[start:start + SIGNATURE_CHUNK]
+            values = np.concatenate([sets[i] for i in chunk])
+            offsets = np.cumsum([0] + [len(sets[i]) for i in chunk[:-1]])
+            # 原地运算, 只保留一个 num_perm x 元素数 的中间矩阵
+            hashed = np.multiply.outer(self._a, values)
+            with np.errstate(over="ignore"):
+                hashed += self._b[:, None]
+            hashed >>= np.uint64(32)
+            result[chunk] = np.minimum.reduceat(hashed, offsets, axis=1).T
+        return result
+
+    @staticmethod
+    def jaccard(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+        """逐行估计两组签名的 Jaccard 系数"""
+        return (left == right).mean(axis=1)
+
+
+minhasher = MinHasher()
+
+
+class SimilarityScorer:
+    """整批计算相似度分数"""
+
+    @staticmethod
+    def coverage(actual_sql: str, compiled: Dict[str, Any]) -> Optional[float]:
+        """预期关键字 / 条件在实际 SQL 中出现的比例, 没有预期时为 None"""
+        keywords, conditions = Expectations.flatten(compiled)
+        total = len(keywords) + len(conditions)
+        if not total:
+            return None
+        # 与 Validator 的匹配规则一致, 判定为 PASS 的结果覆盖率为 1
+        sql_normalized = Validator._normalize_sql(actual_sql)
+        found = sum(1 for kw in keywords if kw in sql_normalized)
+        if conditions:
+            clean_sql = Expectations.strip_quotes(sql_normalized)
+            found += sum(1 for _, clean in conditions if clean in clean_sql)
+        return found / total
+
+    @staticmethod
+    def score_batch(actual_sqls: Sequence[str], expected_sqls: Sequence[Optional[str]],
+                    compiled: Sequence[Dict[str, Any]]) -> List[Optional[float]]:
+        """
+        Args:
+            actual_sqls / expected_sqls / compiled: 按下标对应的实际 SQL、标准 SQL 和编译预期
+
+        Returns:
+            每条结果的相似度 (0~1), 无从比较时为 None
+        """
+        valid = [bool(sql) and not sql.startswith("Error") for sql in actual_sqls]
+        pairs = [i for i, expected in enumerate(expected_sqls) if valid[i] and expected and expected.strip()]
+
+        sql_similarity = {}
+        if pairs:
+            # 同一批次中重复的 SQL (尤其是 expected_sql) 只切分、计算签名一次
+            unique: Dict[str, int] = {}
+            left = [unique.setdefault(actual_sqls[i], len(unique)) for i in pairs]
+            right = [unique.setdefault(expected_sqls[i], len(unique)) for i in pairs]
+            signatures = minhasher.signatures([shingles(sql) for sql in unique])
+            estimates = MinHasher.jaccard(signatures[left], signatures[right])
+            sql_similarity = dict(zip(pairs, estimates.tolist()))
+
+        scores = []
+        for i, sql in enumerate(actual_sqls):
+            if not valid[i]:
+                scores.append(0.0)
+                continue
+            parts = [part for part in (sql_similarity.get(i), SimilarityScorer.coverage(sql, compiled[i]))
+                     if part is not None]
+            scores.append(round(sum(parts) / len(parts), SCORE_DIGITS) if parts else None)
+        return scores
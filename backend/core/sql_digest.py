@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import re
+import hashlib
+from typing import Optional
+
+# 引号内的内容 (字符串常量 / 带引号的标识符) 原样保留, 只折叠其外的空白
+_LITERAL_OR_WHITESPACE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)|\s+")
+
+class SqlDigest:
+    """
+    SQL 内容寻址
+    只折叠引号外的空白 (不改变大小写, 不改动字符串常量), 对标准化后的文本取 sha1。
+    同一个 hash 即可判定两次生成的 SQL 相同; 常量中空白不同 ('A  B' 与 'A B') 的 SQL 视为不同。
+    """
+
+    @staticmethod
+    def normalize(sql: str) -> str:
+        return _LITERAL_OR_WHITESPACE.sub(lambda m: m.group(1) or ' ', sql).strip()
+
+    @staticmethod
+    def digest(sql: Optional[str]) -> Optional[str]:
+        """返回 SQL 的 hash, 空 SQL 返回 None"""
+        if not sql or not sql.strip():
+            return None
+        return hashlib.sha1(SqlDigest.normalize(sql).encode("utf-8")).hexdigest()
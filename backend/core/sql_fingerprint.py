@@ -0,0 +1,543 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 结构指纹
+
+把 SELECT 语句解析成标准化的结构 (表、查询列、过滤条件、分组、排序、LIMIT) 后再比较,
+用于按 expected_sql 校验生成的 SQL:
+- 关键字、未加引号的标识符不区分大小写, 空白和注释不参与比较
+- 表别名 / 列别名不参与比较: 只有一张表时列引用只保留列名, 多张表时 alias.col 还原为 表名.列名
+  (同一张表出现多次时为 表名#序号.列名, 序号按 FROM 中的顺序); 排序中引用的列别名还原为对应的表达式
+- 过滤条件按 AND 拆分后作为集合比较, 与书写顺序无关; = / <> 两侧、OR 分支、IN 列表同样排序
+- 查询列按集合比较 (忽略顺序), 排序项按顺序比较
+
+只处理单个 SELECT (可含 JOIN、子查询); WITH / UNION 等复合语句抛出 SqlParseError,
+由调用方退回按标准化文本比较。
+
+解析结果按 SqlDigest hash 缓存在 LRU 中 (fingerprint_cache), 同一用例的 expected_sql
+在进程内只解析一次。
+"""
+
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from .config import Config
+from .sql_digest import SqlDigest
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<qident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<ident>[^\W\d]\w*)
+  | (?P<op><=|>=|<>|!=|\|\||::|[-+*/%=<>(),.;])
+  | (?P<other>.)
+""", re.X | re.S)
+
+# 不会被当作别名 / 列名的关键字
+_KEYWORDS = frozenset("""
+    SELECT DISTINCT ALL FROM WHERE GROUP BY HAVING ORDER LIMIT OFFSET AS ON USING JOIN INNER LEFT RIGHT
+    FULL OUTER CROSS NATURAL AND OR NOT IN IS NULL LIKE ILIKE BETWEEN EXISTS CASE WHEN THEN ELSE END ASC
+    DESC NULLS FIRST LAST UNION INTERSECT EXCEPT WITH TRUE FALSE INTERVAL ESCAPE OVER PARTITION
+""".split())
+
+_CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT", "OFFSET")
+_COMPARISONS = {"=", "<>", "!=", "<", ">", "<=", ">="}
+_FLIPPED = {">": "<", ">=": "<="}
+
+
+class SqlParseError(ValueError):
+    """不支持或无法解析的 SQL"""
+
+
+class Token(NamedTuple):
+    kind: str   # ident / string / number / op / other
+    value: str
+
+
+class _Scope:
+    """一层 SELECT 的表引用: 表别名 / 表名 -> 表标识, 找不到时向外层查询查找 (相关子查询)"""
+
+    def __init__(self, qualifiers: Dict[str, str], single: bool, outer: Optional["_Scope"] = None):
+        self.qualifiers = qualifiers
+        self.single = single
+        self.outer = outer
+
+    def qualify(self, qualifier: str) -> str:
+        """列引用的表限定 -> 标准化的限定, 空字符串表示省略"""
+        scope = self
+        while scope is not None:
+            if qualifier in scope.qualifiers:
+                # 本层只有一张表时省略; 引用外层的表时必须保留, 否则 u.code = o.code 会变成 CODE = CODE
+                return "" if scope is self and self.single else scope.qualifiers[qualifier]
+            scope = scope.outer
+        return "" if self.single else qualifier
+
+
+def tokenize(sql: str) -> List[Token]:
+    """切分为 token: 未加引号的标识符和关键字转为大写, 字符串常量保持原样"""
+    tokens = []
+    for match in _TOKEN.finditer(sql):
+        kind = match.lastgroup
+        value = match.group()
+        if kind in ("ws", "comment"):
+            continue
+        if kind == "ident":
+            value = value.upper()
+        elif kind == "qident":
+            kind, value = "ident", value[1:-1].upper()
+        elif kind == "number":
+            value = str(float(value)) if any(c in value for c in ".eE") else str(int(value))
+        tokens.append(Token(kind, value))
+    while tokens and tokens[-1].value == ";":
+        tokens.pop()
+    return tokens
+
+
+def _is_word(token: Token, *words: str) -> bool:
+    return token.kind == "ident" and token.value in words
+
+
+def _split_top(tokens: List[Token], separator) -> List[List[Token]]:
+    """按括号外的分隔符拆分; separator(tokens, i) 返回分隔符占用的 token 数 (0 表示不是分隔符)"""
+    parts, current, depth, i = [], [], 0, 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.value == "(":
+            depth += 1
+        elif token.value == ")":
+            depth -= 1
+        width = separator(tokens, i) if depth == 0 else 0
+        if width:
+            parts.append(current)
+            current = []
+            i += width
+            continue
+        current.append(token)
+        i += 1
+    parts.append(current)
+    return parts
+
+
+def _comma(tokens, i) -> int:
+    return 1 if tokens[i].value == "," else 0
+
+
+def _strip_parens(tokens: List[Token]) -> List[Token]:
+    """去掉包住整个表达式的括号"""
+    while len(tokens) >= 2 and tokens[0].value == "(" and tokens[-1].value == ")":
+        depth = 0
+        for i, token in enumerate(tokens):
+            depth += token.value == "("
+            depth -= token.value == ")"
+            if depth == 0 and i < len(tokens) - 1:
+                return tokens
+        tokens = tokens[1:-1]
+    return tokens
+
+
+def _render(parts: List[str]) -> str:
+    text = " ".join(parts)
+    return text.replace("( ", "(").replace(" )", ")").replace(" ,", ",")
+
+
+def _expr(tokens: List[Token], scope: Optional[_Scope] = None) -> str:
+    """标准化表达式: 列引用的表限定按 scope 还原 (没有 scope 时去掉), 子查询递归取指纹, 常量 IN 列表排序"""
+    parts: List[str] = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.value == "(":
+            close = _matching_paren(tokens, i)
+            inner = tokens[i + 1:close]
+            if inner and _is_word(inner[0], "SELECT"):
+                parts.append("(" + SqlFingerprint.from_tokens(inner, scope).canonical() + ")")
+            elif i > 0 and _is_word(tokens[i - 1], "IN") and all(
+                t.kind in ("string", "number") or t.value == "," for t in inner
+            ):
+                values = sorted(t.value for t in inner if t.value != ",")
+                parts.append("(" + ", ".join(values) + ")")
+            else:
+                parts.append("(" + _expr(inner, scope) + ")")
+            if i > 0 and tokens[i - 1].kind == "ident" and tokens[i - 1].value not in _KEYWORDS:
+                # 函数调用: SUM(x)
+                group = parts.pop()
+                parts[-1] += group
+            i = close + 1
+            continue
+        if token.kind == "ident" and i + 2 < len(tokens) and tokens[i + 1].value == "." \
+                and (tokens[i + 2].kind == "ident" or tokens[i + 2].value == "*"):
+            # t.col / schema.t.col -> TABLE.COL 或 COL; schema.func(...) -> FUNC(...)
+            end = i + 2
+            while end + 2 < len(tokens) and tokens[end + 1].value == "." \
+                    and (tokens[end + 2].kind == "ident" or tokens[end + 2].value == "*"):
+                end += 2
+            qualifier = scope.qualify(tokens[end - 2].value) if scope is not None else ""
+            is_call = end + 1 < len(tokens) and tokens[end + 1].value == "("
+            parts.append(f"{qualifier}.{tokens[end].value}" if qualifier and not is_call else tokens[end].value)
+            i = end + 1
+            continue
+        parts.append(token.value)
+        i += 1
+    return _render(parts)
+
+
+def _matching_paren(tokens: List[Token], start: int) -> int:
+    depth = 0
+    for i in range(start, len(tokens)):
+        depth += tokens[i].value == "("
+        depth -= tokens[i].value == ")"
+        if depth == 0:
+            return i
+    raise SqlParseError("括号不匹配")
+
+
+def _and_separator(tokens, i) -> int:
+    """顶层 AND 分隔符 (BETWEEN x AND y 中的 AND 除外)"""
+    if not _is_word(tokens[i], "AND"):
+        return 0
+    depth = 0
+    for j in range(i - 1, -1, -1):
+        depth += tokens[j].value == ")"
+        depth -= tokens[j].value == "("
+        if depth == 0:
+            if _is_word(tokens[j], "BETWEEN"):
+                return 0
+            if _is_word(tokens[j], "AND", "OR"):
+                return 1
+    return 1
+
+
+def _or_separator(tokens, i) -> int:
+    return 1 if _is_word(tokens[i], "OR") else 0
+
+
+def _atom(tokens: List[Token], scope: Optional[_Scope] = None) -> str:
+    """单个比较条件: = / <> 两侧排序, > / >= 转为 < / <="""
+    depth = 0
+    for i, token in enumerate(tokens):
+        depth += token.value == "("
+        depth -= token.value == ")"
+        if depth == 0 and token.kind == "op" and token.value in _COMPARISONS:
+            left, right = _expr(tokens[:i], scope), _expr(tokens[i + 1:], scope)
+            op = "<>" if token.value == "!=" else token.value
+            if op in _FLIPPED:
+                left, right, op = right, left, _FLIPPED[op]
+            if op in ("=", "<>"):
+                left, right = sorted((left, right))
+            return f"{left} {op} {right}"
+    return _expr(tokens, scope)
+
+
+def _boolean(tokens: List[Token], scope: Optional[_Scope] = None) -> str:
+    """OR / AND 组合条件, 各分支排序"""
+    tokens = _strip_parens(tokens)
+    branches = _split_top(tokens, _or_separator)
+    if len(branches) > 1:
+        return "(" + " OR ".join(sorted(_boolean(b, scope) for b in branches)) + ")"
+    terms = _split_top(tokens, _and_separator)
+    if len(terms) > 1:
+        return "(" + " AND ".join(sorted(_boolean(t, scope) for t in terms)) + ")"
+    return _atom(tokens, scope)
+
+
+def _predicates(tokens: List[Token], scope: Optional[_Scope] = None) -> List[str]:
+    """按顶层 AND 拆分的条件列表"""
+    tokens = _strip_parens(tokens)
+    if not tokens:
+        return []
+    if len(_split_top(tokens, _or_separator)) > 1:
+        return [_boolean(tokens, scope)]
+    return [_boolean(term, scope) for term in _split_top(tokens, _and_separator) if term]
+
+
+class SqlFingerprint(NamedTuple):
+    """SELECT 语句的标准化结构"""
+    tables: FrozenSet[str]
+    columns: Tuple[str, ...]          # 排序后的查询列 (去掉别名)
+    distinct: bool
+    predicates: FrozenSet[str]        # WHERE 与 JOIN ON 条件
+    group_by: FrozenSet[str]
+    having: FrozenSet[str]
+    order_by: Tuple[str, ...]         # "表达式 ASC|DESC"
+    limit: Optional[int]
+    offset: Optional[int]
+
+    @staticmethod
+    def parse(sql: str) -> "SqlFingerprint":
+        tokens = tokenize(sql or "")
+        if not tokens:
+            raise SqlParseError("SQL 为空")
+        return SqlFingerprint.from_tokens(tokens)
+
+    @staticmethod
+    def from_tokens(tokens: List[Token], outer: Optional[_Scope] = None) -> "SqlFingerprint":
+        """outer 为外层查询的表引用 (子查询中解析对外层表的引用)"""
+        if not _is_word(tokens[0], "SELECT"):
+            raise SqlParseError(f"不支持的语句: {tokens[0].value}")
+        for token in tokens:
+            if _is_word(token, "UNION", "INTERSECT", "EXCEPT"):
+                # 子查询里的 UNION 也一并视为不支持
+                raise SqlParseError(f"不支持的复合查询: {token.value}")
+
+        clauses = SqlFingerprint._clauses(tokens)
+        select_tokens = clauses.get("SELECT", [])
+        distinct = bool(select_tokens) and _is_word(select_tokens[0], "DISTINCT")
+        if select_tokens and _is_word(select_tokens[0], "DISTINCT", "ALL"):
+            select_tokens = select_tokens[1:]
+
+        tables, join_predicates, scope = SqlFingerprint._tables(clauses.get("FROM", []), outer)
+
+        columns, aliases = [], {}
+        for item in _split_top(select_tokens, _comma):
+            expr, alias = SqlFingerprint._split_alias(item)
+            columns.append(_expr(expr, scope))
+            if alias:
+                aliases[alias] = columns[-1]
+
+        predicates = set(join_predicates) | set(_predicates(clauses.get("WHERE", []), scope))
+        group_by = {SqlFingerprint._resolve(item, aliases, columns, scope)
+                    for item in _split_top(clauses.get("GROUP BY", []), _comma) if item}
+        having = set(_predicates(clauses.get("HAVING", []), scope))
+
+        order_by = []
+        for item in _split_top(clauses.get("ORDER BY", []), _comma):
+            if not item:
+                continue
+            direction = "ASC"
+            while item and _is_word(item[-1], "ASC", "DESC", "FIRST", "LAST", "NULLS"):
+                if item[-1].value in ("ASC", "DESC"):
+                    direction = item[-1].value
+                item = item[:-1]
+            order_by.append(f"{SqlFingerprint._resolve(item, aliases, columns, scope)} {direction}")
+
+        limit, offset = SqlFingerprint._limit(clauses.get("LIMIT", []), clauses.get("OFFSET", []))
+        return SqlFingerprint(
+            tables=frozenset(tables),
+            columns=tuple(sorted(columns)),
+            distinct=distinct,
+            predicates=frozenset(predicates),
+            group_by=frozenset(group_by),
+            having=frozenset(having),
+            order_by=tuple(order_by),
+            limit=limit,
+            offset=offset,
+        )
+
+    @staticmethod
+    def _clauses(tokens: List[Token]):
+        """按顶层子句关键字切分 {子句: tokens}"""
+        clauses, current, depth, i = {}, None, 0, 0
+        while i < len(tokens):
+            token = tokens[i]
+            depth += token.value == "("
+            depth -= token.value == ")"
+            if depth == 0 and token.kind == "ident":
+                name = token.value
+                if name in ("GROUP", "ORDER") and i + 1 < len(tokens) and _is_word(tokens[i + 1], "BY"):
+                    name, width = f"{name} BY", 2
+                else:
+                    width = 1
+                if name in _CLAUSES:
+                    current = name
+                    clauses.setdefault(current, [])
+                    i += width
+                    continue
+            if current is None:
+                raise SqlParseError("无法识别的子句")
+            clauses[current].append(token)
+            i += 1
+        return clauses
+
+    @staticmethod
+    def _split_alias(item: List[Token]) -> Tuple[List[Token], Optional[str]]:
+        """查询列 / 表: 拆出 AS alias 或结尾的裸别名"""
+        if len(item) >= 3 and _is_word(item[-2], "AS") and item[-1].kind == "ident":
+            return item[:-2], item[-1].value
+        if len(item) >= 2 and item[-1].kind == "ident" and item[-1].value not in _KEYWORDS \
+                and item[-2].value != "." and (item[-2].kind != "op" or item[-2].value == ")"):
+            return item[:-1], item[-1].value
+        return item, None
+
+    @staticmethod
+    def _resolve(item: List[Token], aliases, columns, scope: Optional[_Scope] = None) -> str:
+        """GROUP BY / ORDER BY 项: 列别名和位置序号还原为查询列表达式"""
+        if len(item) == 1 and item[0].kind == "ident" and item[0].value in aliases:
+            return aliases[item[0].value]
+        if len(item) == 1 and item[0].kind == "number" and item[0].value.isdigit():
+            position = int(item[0].value)
+            if 1 <= position <= len(columns):
+                return columns[position - 1]
+        return _expr(item, scope)
+
+    @staticmethod
+    def _join_separator(tokens, i) -> int:
+        """表之间的分隔: 逗号或 [NATURAL] [LEFT|RIGHT|FULL|INNER|CROSS] [OUTER] JOIN"""
+        if tokens[i].value == ",":
+            return 1
+        j = i
+        if _is_word(tokens[j], "NATURAL"):
+            j += 1
+        if j < len(tokens) and _is_word(tokens[j], "LEFT", "RIGHT", "FULL", "INNER", "CROSS"):
+            j += 1
+        if j < len(tokens) and _is_word(tokens[j], "OUTER"):
+            j += 1
+        if j < len(tokens) and _is_word(tokens[j], "JOIN"):
+            return j - i + 1
+        return 0
+
+    @staticmethod
+    def _tables(tokens: List[Token], outer: Optional[_Scope] = None) -> Tuple[List[str], List[str], _Scope]:
+        """FROM 子句 -> (表名列表, JOIN ON 条件, 本层的表引用)"""
+        refs = []  # (表引用, 别名, ON / USING 及其后的 token)
+        for part in _split_top(tokens, SqlFingerprint._join_separator):
+            if not part:
+                continue
+            on_at, depth = None, 0
+            for i, token in enumerate(part):
+                depth += token.value == "("
+                depth -= token.value == ")"
+                if depth == 0 and _is_word(token, "ON", "USING"):
+                    on_at = i
+                    break
+            ref, alias = SqlFingerprint._split_alias(part if on_at is None else part[:on_at])
+            if ref:
+                refs.append((ref, alias, [] if on_at is None else part[on_at:]))
+
+        # 派生表以子查询的指纹作为表名; schema.table -> table
+        tables = [_expr(ref, outer) if ref[0].value == "(" else ref[-1].value for ref, _, _ in refs]
+
+        # 同一张表出现多次 (自连接) 时按出现顺序编号, 否则 t1.a = t2.b 与 t1.b = t2.a 无法区分
+        counts, seen, qualifiers = Counter(tables), Counter(), {}
+        for (ref, alias, _), table in zip(refs, tables):
+            seen[table] += 1
+            identity = f"{table}#{seen[table]}" if counts[table] > 1 else table
+            if alias:
+                qualifiers[alias] = identity
+            if ref[0].value != "(":
+                qualifiers.setdefault(table, identity)
+        scope = _Scope(qualifiers, single=len(tables) == 1, outer=outer)
+
+        predicates = []
+        for _, _, condition in refs:
+            if condition and _is_word(condition[0], "ON"):
+                predicates.extend(_predicates(condition[1:], scope))
+            elif condition:
+                predicates.append("USING " + _expr(condition[1:], scope))
+        return tables, predicates, scope
+
+    @staticmethod
+    def _limit(limit_tokens: List[Token], offset_tokens: List[Token]) -> Tuple[Optional[int], Optional[int]]:
+        def number(tokens) -> Optional[int]:
+            if len(tokens) == 1 and tokens[0].kind == "number" and tokens[0].value.isdigit():
+                return int(tokens[0].value)
+            if tokens:
+                raise SqlParseError(f"无法识别的 LIMIT: {_expr(tokens)}")
+            return None
+
+        limit, offset = None, number(offset_tokens)
+        if limit_tokens:
+            parts = _split_top(limit_tokens, _comma)
+            if len(parts) == 2:
+                # MySQL: LIMIT offset, count
+                offset, limit = number(parts[0]), number(parts[1])
+            else:
+                limit = number(parts[0])
+        return limit, offset
+
+    def canonical(self) -> str:
+        """稳定的文本形式 (子查询嵌入父查询时使用)"""
+        parts = ["SELECT", "DISTINCT" if self.distinct else "", ", ".join(self.columns),
+                 "FROM", ", ".join(sorted(self.tables))]
+        if self.predicates:
+            parts += ["WHERE", " AND ".join(sorted(self.predicates))]
+        if self.group_by:
+            parts += ["GROUP BY", ", ".join(sorted(self.group_by))]
+        if self.having:
+            parts += ["HAVING", " AND ".join(sorted(self.having))]
+        if self.order_by:
+            parts += ["ORDER BY", ", ".join(self.order_by)]
+        if self.limit is not None:
+            parts += ["LIMIT", str(self.limit)]
+        if self.offset is not None:
+            parts += ["OFFSET", str(self.offset)]
+        return " ".join(p for p in parts if p)
+
+    def diff(self, actual: "SqlFingerprint") -> List[str]:
+        """与实际 SQL 的结构差异 (self 为预期), 一致时返回空列表"""
+        problems = []
+
+        def set_diff(label: str, expected, got):
+            missing, extra = sorted(set(expected) - set(got)), sorted(set(got) - set(expected))
+            if missing:
+                problems.append(f"缺{label}: {', '.join(missing)}")
+            if extra:
+                problems.append(f"多{label}: {', '.join(extra)}")
+
+        set_diff("表", self.tables, actual.tables)
+        set_diff("查询列", self.columns, actual.columns)
+        if self.distinct != actual.distinct:
+            problems.append("DISTINCT 不一致")
+        set_diff("条件", self.predicates, actual.predicates)
+        set_diff("分组", self.group_by, actual.group_by)
+        set_diff("HAVING 条件", self.having, actual.having)
+        if self.order_by != actual.order_by:
+            problems.append(f"排序不一致: 预期 {', '.join(self.order_by) or '无'}, 实际 {', '.join(actual.order_by) or '无'}")
+        if (self.limit, self.offset) != (actual.limit, actual.offset):
+            problems.append(f"LIMIT 不一致: 预期 {self.limit}, 实际 {actual.limit}"
+                            + (f" (OFFSET 预期 {self.offset or 0}, 实际 {actual.offset or 0})"
+                               if self.offset or actual.offset else ""))
+        return problems
+
+
+class FingerprintCache:
+    """
+    解析结果的 LRU 缓存, 以 SqlDigest hash 为键
+
+    无法解析的 SQL 同样缓存 (保存 SqlParseError), 不会重复尝试。
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sql: str) -> SqlFingerprint:
+        """
+        Raises:
+            SqlParseError: SQL 无法解析
+        """
+        key = SqlDigest.digest(sql)
+        if key is None:
+            raise SqlParseError("SQL 为空")
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if entry is None:
+            try:
+                entry = SqlFingerprint.parse(sql)
+            except SqlParseError as e:
+                entry = e
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        if isinstance(entry, SqlParseError):
+            raise entry
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+fingerprint_cache = FingerprintCache(maxsize=int(Config.get("FINGERPRINT_CACHE_SIZE", 4096)))
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+校验阶段的进程池
+
+structure / both / execution 模式的校验 (SQL 解析、结构比较、结果集比较) 是 CPU 密集的 Python 代码,
+在 runner 线程里执行会和 SSE / WebSocket 的网络 I/O 争抢 GIL。这些模式下校验交给进程池:
+- 按 VALIDATION_CHUNK_SIZE 条打包提交, 一次进程间往返处理一批, 分摊序列化开销
+- 在途的包不超过 VALIDATION_MAX_INFLIGHT 个, 达到上限时 submit 阻塞 (背压), 避免结果堆积在内存中
+- keywords 模式 (几次 in 判断) 或 VALIDATION_PROCESSES=0 时直接在当前线程校验, 不经过进程池
+
+子进程用 spawn 启动 (父进程有后台线程, fork 不安全), 启动时带上父进程的配置缓存;
+每个子进程各自持有结构指纹缓存和执行校验的快照连接池。
+"""
+
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import Config, refresh_config
+
+logger = logging.getLogger("Backend.ValidationPool")
+
+# (用例下标, 是否通过, 说明)
+ValidationResult = Tuple[int, bool, str]
+
+
+def _init_worker(config_cache: Dict[str, Any]):
+    """子进程初始化: 同步父进程的 system_config (须在导入 validator 之前, 执行校验的参数在导入时读取)"""
+    Config._cache.update(config_cache)
+    refresh_config()
+
+
+def _validate_chunk(mode: str, items: List[Tuple[int, Dict[str, Any], Optional[str], str]]) -> List[ValidationResult]:
+    """子进程: 校验一包 (下标, 编译预期, 标准 SQL, 实际 SQL)"""
+    from .validator import BatchValidator
+
+    validator = BatchValidator([item[1] for item in items], expected_sqls=[item[2] for item in items], mode=mode)
+    results = validator.validate_all([item[3] for item in items])
+    return [(item[0], is_pass, message) for item, (is_pass, message) in zip(items, results)]
+
+
+class ValidationStage:
+    """
+    一个批次的校验阶段 (只在提交结果的线程中使用)
+
+    submit 提交待校验的 SQL, completed 取出已完成的结果 (不阻塞), drain 等待全部完成。
+    结果的顺序与提交顺序不一定一致, 以用例下标对应。
+    """
+
+    def __init__(self, validator, pool: "ValidationPool"):
+        self.validator = validator
+        self.pool = pool
+        self.inline = validator.mode == "keywords" or pool.processes == 0
+        self._buffer: List[Tuple[int, Dict[str, Any], Optional[str], str]] = []
+        self._buffered_at = 0.0
+        self._done: List[ValidationResult] = []
+        self._pending: List[Tuple[Future, list]] = []
+
+    def submit(self, index: int, actual_sql: str):
+        """提交第 index 个用例的实际 SQL; 在途的包达到上限时阻塞"""
+        if self.inline:
+            is_pass, message = self.validator.validate(index, actual_sql)
+            self._done.append((index, is_pass, message))
+            return
+        if not self._buffer:
+            self._buffered_at = time.monotonic()
+        compiled, expected_sql = self.validator.expectation(index)
+        self._buffer.append((index, compiled, expected_sql, actual_sql))
+        if len(self._buffer) >= self.pool.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        chunk, self._buffer = self._buffer, []
+        try:
+            self._pending.append((self.pool.submit_chunk(self.validator.mode, chunk), chunk))
+        except Exception as e:
+            self._validate_inline(chunk, e)
+
+    def _collect(self, future: Future, chunk):
+        try:
+            self._done.extend(future.result())
+        except Exception as e:
+            self._validate_inline(chunk, e)
+
+    def _validate_inline(self, chunk, error: Exception):
+        # 进程池不可用 (例如子进程被系统杀掉) 时退回在本进程校验这一包
+        logger.error(f"Validation pool failed, validating {len(chunk)} items inline: {error}")
+        self._done.extend((index, *self.validator.validate(index, actual_sql)) for index, _, _, actual_sql in chunk)
+
+    def completed(self) -> List[ValidationResult]:
+        """取出已完成的结果; 缓冲中的 SQL 超过 VALIDATION_FLUSH_INTERVAL 未凑满一包时先提交"""
+        if self._buffer and time.monotonic() - self._buffered_at >= self.pool.flush_interval:
+            self._flush()
+        still_pending = []
+        for future, chunk in self._pending:
+            if future.done():
+                self._collect(future, chunk)
+            else:
+                still_pending.append((future, chunk))
+        self._pending = still_pending
+        done, self._done = self._done, []
+        return done
+
+    def drain(self) -> List[ValidationResult]:
+        """提交缓冲中的 SQL 并等待全部结果"""
+        self._flush()
+        for future, chunk in self._pending:
+            self._collect(future, chunk)
+        self._pending = []
+        done, self._done = self._done, []
+        return done
+
+
+class ValidationPool:
+    """校验进程池, 首次提交时启动"""
+
+    def __init__(self, processes: int, chunk_size: int = 32, max_inflight: int = 0, flush_interval: float = 0.2):
+        """
+        Args:
+            processes: 进程数, 0 表示不使用进程池
+            max_inflight: 在途包数上限, 0 表示进程数的 2 倍
+        """
+        self.processes = max(processes, 0)
+        self.chunk_size = max(chunk_size, 1)
+        self.max_inflight = max_inflight or self.processes * 2
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(max(self.max_inflight, 1))
+
+    def _ensure_started(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(dict(Config._cache),),
+                )
+                logger.info(f"Started validation pool with {self.processes} processes")
+            return self._executor
+
+    def submit_chunk(self, mode: str, chunk) -> Future:
+        """提交一包; 在途包数达到上限时等待"""
+        executor = self._ensure_started()
+        self._slots.acquire()
+        try:
+            future = executor.submit(_validate_chunk, mode, chunk)
+        except BrokenProcessPool:
+            # 子进程异常退出后整个进程池不可用, 丢弃后下次提交时重新启动
+            self._slots.release()
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def stage(self, validator) -> ValidationStage:
+        return ValidationStage(validator, self)
+
+    def validate_all(self, validator, actual_sqls: List[str]) -> List[Tuple[bool, str]]:
+        """按下标顺序校验全部用例 (等同于 validator.validate_all, CPU 密集的模式分包交给进程池)"""
+        stage = self.stage(validator)
+        if stage.inline:
+            return validator.validate_all(actual_sqls)
+        results: List[Optional[Tuple[bool, str]]] = [None] * len(actual_sqls)
+        for index, actual_sql in enumerate(actual_sqls):
+            stage.submit(index, actual_sql)
+        for index, is_pass, message in stage.drain():
+            results[index] = (is_pass, message)
+        return results
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+def _default_processes() -> int:
+    value = str(Config.get("VALIDATION_PROCESSES", "") or "").strip()
+    if not value:
+        return min(os.cpu_count() or 1, 8)
+    return int(value)
+
+
+validation_pool = ValidationPool(
+    processes=_default_processes(),
+    chunk_size=int(Config.get("VALIDATION_CHUNK_SIZE", 32)),
+    max_inflight=int(Config.get("VALIDATION_MAX_INFLIGHT", 0)),
+    flush_interval=float(Config.get("VALIDATION_FLUSH_INTERVAL", 0.2)),
+)
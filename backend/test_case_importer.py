@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+用例导入的 upsert 与幂等
+
+同一份文件重复导入只统计为 unchanged; 按 external_id (有时) 或标准化问题匹配已有用例;
+格式错误的预期不写库并返回行号; CSV 与 XLSX 的解析结果一致。
+
+运行: python -m pytest backend/test_case_importer.py  或  python backend/test_case_importer.py
+"""
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from openpyxl import Workbook
+
+from backend.app.models import SessionLocal, TestCase
+from backend.core.case_importer import CaseImporter, CaseImportError
+
+HEADER = ["question", "expected_keywords", "expected_conditions", "external_id", "分类"]
+ROWS = [
+    ["去年分红最多的公司", "ACC_DIVIDEND_AMOUNT", "", "", "分红"],
+    ["茅台的市值", "MARKET_VALUE", "NAME='贵州茅台'", "EXT-1", "估值"],
+    ["平安银行的营收", "REVENUE", "", "", ""],
+]
+
+
+def _csv(rows, header=HEADER) -> io.BytesIO:
+    lines = [",".join(header)] + [",".join(f'"{v}"' for v in row) for row in rows]
+    return io.BytesIO("\n".join(lines).encode("utf-8-sig"))
+
+
+def _xlsx(rows, header=HEADER) -> io.BytesIO:
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append([v or None for v in row])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _import(fileobj, filename="cases.csv"):
+    db = SessionLocal()
+    try:
+        return CaseImporter.import_file(db, fileobj, filename)
+    finally:
+        db.close()
+
+
+def _cases():
+    db = SessionLocal()
+    try:
+        return {c.question: c for c in db.query(TestCase).order_by(TestCase.id)}
+    finally:
+        db.close()
+
+
+def test_reimport_unchanged_file_is_idempotent(temp_db):
+    first = _import(_csv(ROWS))
+    assert (first["inserted"], first["updated"], first["unchanged"]) == (3, 0, 0)
+    before = {q: (c.id, c.updated_at) for q, c in _cases().items()}
+
+    second = _import(_csv(ROWS))
+    assert (second["imported"], second["inserted"], second["updated"], second["unchanged"]) == (0, 0, 0, 3)
+    assert {q: (c.id, c.updated_at) for q, c in _cases().items()} == before
+
+    # 同样的内容以 XLSX 导入也不产生新行
+    third = _import(_xlsx(ROWS), "cases.xlsx")
+    assert (third["inserted"], third["updated"], third["unchanged"]) == (0, 0, 3)
+
+
+def test_question_hash_ignores_case_width_and_whitespace(temp_db):
+    _import(_csv(ROWS[:1]))
+    result = _import(_csv([["  去年分红最多的公司 ", "ACC_DIVIDEND_AMOUNT", "", "", "分红"]]))
+    assert (result["inserted"], result["unchanged"]) == (0, 1)
+    assert CaseImporter.question_hash("ＡＢＣ  d") == CaseImporter.question_hash("abc d")
+
+
+def test_changed_rows_are_updated_in_place(temp_db):
+    _import(_csv(ROWS))
+    ids = {q: c.id for q, c in _cases().items()}
+
+    changed = [row[:] for row in ROWS]
+    changed[0][1] = "ACC_DIVIDEND_AMOUNT,REPORT_YEAR"   # 同一问题, 预期变化
+    changed[1][0] = "贵州茅台的总市值"                   # 同一 external_id, 问题变化
+    result = _import(_csv(changed))
+    assert (result["inserted"], result["updated"], result["unchanged"]) == (0, 2, 1)
+
+    cases = _cases()
+    assert len(cases) == 3
+    assert cases["去年分红最多的公司"].expected_keywords == "ACC_DIVIDEND_AMOUNT,REPORT_YEAR"
+    assert cases["去年分红最多的公司"].compiled_expectations["keywords"] == ["ACC_DIVIDEND_AMOUNT", "REPORT_YEAR"]
+    assert cases["贵州茅台的总市值"].id == ids["茅台的市值"]
+    assert cases["贵州茅台的总市值"].question_hash == CaseImporter.question_hash("贵州茅台的总市值")
+
+
+def test_duplicate_rows_in_file_keep_the_last(temp_db):
+    rows = [ROWS[0], [ROWS[0][0], "OTHER", "", "", "分红"]]
+    result = _import(_csv(rows))
+    assert (result["inserted"], result["unchanged"]) == (1, 1)
+    assert _cases()[ROWS[0][0]].expected_keywords == "OTHER"
+
+
+def test_invalid_expectations_are_skipped_with_row_number(temp_db):
+    rows = ROWS + [["引号不成对", "X", "NAME='a", "", ""]]
+    result = _import(_csv(rows))
+    assert (result["inserted"], result["invalid"]) == (3, 1)
+    assert result["errors"][0]["row"] == 5
+    assert "引号不成对" not in _cases()
+
+
+def test_report_remarks_column_is_not_imported_as_description(temp_db):
+    header = ["问题", "预期关键字", "备注"]
+    _import(_csv([["茅台的市值", "MARKET_VALUE", "缺关键字: MARKET_VALUE"]], header))
+    assert _cases()["茅台的市值"].description is None
+
+
+def test_missing_question_column_is_rejected(temp_db):
+    with pytest.raises(CaseImportError, match="未找到问题列"):
+        _import(_csv([["x"]], ["name"]))
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
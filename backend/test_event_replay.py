@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+批次事件日志与 WebSocket 断线续传
+
+seq 在落库时按数据库中的最大 seq 分配 (其他 worker 写过的事件之后继续编号);
+WebSocket 以 since=<seq> 重连时只补发之后的事件, 补完后以同一游标继续推送新事件, 不重复也不遗漏。
+
+运行: python -m pytest backend/test_event_replay.py  或  python backend/test_event_replay.py
+"""
+import os
+import sys
+import json
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.events import event_log
+from backend.app.models import SessionLocal, BatchEvent, TestBatch, TestCase, TestHistory
+from backend.app.routers import runner
+
+
+def _add_batch(batch_id, status="RUNNING", **fields):
+    db = SessionLocal()
+    try:
+        db.add(TestBatch(id=batch_id, status=status, total_count=5, **fields))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _append(batch_id, *messages):
+    for message in messages:
+        event_log.append(batch_id, message)
+    event_log.flush()
+
+
+def _updates(batch_id, start, stop):
+    return [{"type": "update", "case_id": i} for i in range(start, stop)]
+
+
+@pytest.fixture
+def client(temp_db):
+    app = FastAPI()
+    app.include_router(runner.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def _receive(ws, count):
+    return [json.loads(ws.receive_text()) for _ in range(count)]
+
+
+def test_seq_continues_after_events_written_elsewhere(temp_db):
+    _add_batch("a")
+    _add_batch("b")
+    # 其他 worker 已为批次 a 写入 seq 1..3
+    db = SessionLocal()
+    try:
+        db.add_all(BatchEvent(batch_id="a", seq=seq, type="update", payload=json.dumps({"seq": seq}))
+                   for seq in range(1, 4))
+        db.commit()
+    finally:
+        db.close()
+
+    event_log.append("a", {"type": "update", "case_id": 1})
+    event_log.append("b", {"type": "update", "case_id": 2})
+    event_log.append("a", {"type": "done"})
+    event_log.flush()
+
+    assert [e["seq"] for e in event_log.fetch("a", 0)] == [1, 2, 3, 4, 5]
+    assert event_log.fetch("a", 3) == [{"type": "update", "case_id": 1, "seq": 4}, {"type": "done", "seq": 5}]
+    assert event_log.fetch("b", 0) == [{"type": "update", "case_id": 2, "seq": 1}]
+    assert [e["seq"] for e in event_log.fetch("a", 1, limit=2)] == [2, 3]
+
+
+def test_resume_after_seq_replays_only_missing_events(client):
+    _add_batch("done-batch", status="COMPLETED")
+    _append("done-batch", *_updates("done-batch", 1, 5), {"type": "done"})
+
+    with client.websocket_connect("/run/ws/done-batch?since=2") as ws:
+        status, *events = _receive(ws, 4)
+    assert status["type"] == "batch_status" and status["last_seq"] == 5
+    assert [e["seq"] for e in events] == [3, 4, 5]
+    assert [e.get("case_id") for e in events] == [3, 4, None]
+    assert events[-1]["type"] == "done"
+
+    with client.websocket_connect("/run/ws/done-batch") as ws:
+        status, *events = _receive(ws, 6)
+    assert [e["seq"] for e in events] == [1, 2, 3, 4, 5]
+
+
+def test_resume_then_follow_live_events(client):
+    _add_batch("live")
+    _append("live", {"type": "init"}, *_updates("live", 1, 3))
+
+    with client.websocket_connect("/run/ws/live?since=1") as ws:
+        status, *replayed = _receive(ws, 3)
+        assert status["last_seq"] == 3
+        assert [e["seq"] for e in replayed] == [2, 3]
+        # 补发完成后写入的新事件以同一游标推送, 不重复已补发的事件
+        _append("live", *_updates("live", 3, 5))
+        _append("live", {"type": "done"})
+        live = _receive(ws, 3)
+    assert [e["seq"] for e in live] == [4, 5, 6]
+    assert live[-1]["type"] == "done"
+
+
+def test_batch_without_event_log_replays_history(client):
+    _add_batch("legacy", status="COMPLETED", end_time=datetime(2024, 1, 1))
+    db = SessionLocal()
+    try:
+        case = TestCase(question="q", expected_sql="SELECT 1")
+        db.add(case)
+        db.flush()
+        db.add_all(TestHistory(batch_id="legacy", case_id=case.id, question="q", actual_sql=f"SELECT {i}",
+                               result="PASS", duration=0.1) for i in range(3))
+        db.commit()
+    finally:
+        db.close()
+
+    with client.websocket_connect("/run/ws/legacy") as ws:
+        status, *messages = _receive(ws, 5)
+    assert status["last_seq"] == 0
+    assert [m["type"] for m in messages] == ["update"] * 3 + ["done"]
+    assert [m["result"]["actual_sql"] for m in messages[:3]] == ["SELECT 0", "SELECT 1", "SELECT 2"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
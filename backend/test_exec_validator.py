@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+基于执行结果的 SQL 校验
+
+在临时快照上比较标准 SQL 与实际 SQL 的结果集: 无序 / 有序比较、数值精度、列数 / 行数不一致、
+执行失败与超时、结果截断时不做判定、快照替换后缓存失效, 以及快照只读。
+
+运行: python -m pytest backend/test_exec_validator.py  或  python backend/test_exec_validator.py
+"""
+import os
+import sys
+import sqlite3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.core.exec_validator import ExecutionValidator, ExecutionError
+
+
+def _build(path, rows):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE stock (code TEXT, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO stock VALUES (?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+ROWS = [("600519", "贵州茅台", 1500.3), ("000001", "平安银行", 10.2), ("600036", "招商银行", 30.0)]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / "business.db")
+    _build(path, ROWS)
+    return path
+
+
+@pytest.fixture
+def validator(snapshot):
+    return ExecutionValidator(snapshot, pool_size=2, timeout=2.0)
+
+
+def test_unordered_results_compare_as_multiset(validator):
+    expected = "SELECT code, price FROM stock"
+    actual = "SELECT code AS c, price AS p FROM stock ORDER BY price DESC"
+    assert validator.validate(actual, expected) == (True, "Pass")
+
+
+def test_order_matters_when_expected_has_order_by(validator):
+    expected = "SELECT code FROM stock ORDER BY price"
+    assert validator.validate("SELECT code FROM stock ORDER BY price ASC", expected) == (True, "Pass")
+    assert validator.validate("SELECT code FROM stock ORDER BY price DESC", expected) == (False, "结果集不一致 (含顺序)")
+
+
+def test_numbers_compare_after_rounding(validator):
+    assert validator.validate("SELECT 0.1 + 0.2", "SELECT 0.3") == (True, "Pass")
+    assert validator.validate("SELECT 1.0", "SELECT 1") == (True, "Pass")
+    assert validator.validate("SELECT 0.31", "SELECT 0.3") == (False, "结果集不一致")
+
+
+def test_shape_mismatch(validator):
+    ok, message = validator.validate("SELECT code, name FROM stock", "SELECT code FROM stock")
+    assert not ok and message.startswith("结果列数不一致")
+    ok, message = validator.validate("SELECT code FROM stock LIMIT 2", "SELECT code FROM stock")
+    assert (ok, message) == (False, "结果行数不一致: 预期 3, 实际 2")
+
+
+def test_execution_failures(validator):
+    ok, message = validator.validate("SELECT missing FROM stock", "SELECT code FROM stock")
+    assert not ok and message.startswith("SQL 执行失败")
+    assert validator.validate("Error: timeout", "SELECT 1") == (False, "Error: timeout")
+    # 快照只读
+    ok, message = validator.validate("DELETE FROM stock", "SELECT 1")
+    assert not ok and message.startswith("SQL 执行失败")
+    assert validator.validate("SELECT count(*) FROM stock", "SELECT 3") == (True, "Pass")
+
+
+def test_undecidable_cases_return_none(validator, tmp_path):
+    # 标准 SQL 用到 SQLite 不支持的函数 / 没有标准 SQL / 快照不存在
+    assert validator.validate("SELECT 1", "SELECT DATE_FORMAT(NOW(), '%Y')") is None
+    assert validator.validate("SELECT 1", "  ") is None
+    assert ExecutionValidator(str(tmp_path / "missing.db")).validate("SELECT 1", "SELECT 1") is None
+
+
+def test_truncated_results_are_not_compared(snapshot):
+    validator = ExecutionValidator(snapshot, max_rows=2)
+    assert validator.validate("SELECT code FROM stock", "SELECT code FROM stock") is None
+    ok, message = validator.validate("SELECT code FROM stock", "SELECT code FROM stock LIMIT 2")
+    assert (ok, message) == (False, "结果行数不一致: 预期 2, 实际超过 2")
+
+
+def test_timeout(snapshot):
+    validator = ExecutionValidator(snapshot, timeout=0.2)
+    endless = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT count(*) FROM n"
+    with pytest.raises(ExecutionError, match="执行超时"):
+        validator.execute(endless, validator._sync_version())
+    ok, message = validator.validate(endless, "SELECT 1")
+    assert not ok and "执行超时" in message
+
+
+def test_replaced_snapshot_invalidates_cache(validator, snapshot):
+    expected = "SELECT count(*) FROM stock"
+    assert validator.validate("SELECT 3", expected) == (True, "Pass")
+    _build(snapshot, ROWS[:1])
+    os.utime(snapshot, ns=(0, 10 ** 9))  # 保证修改时间变化
+    assert validator.validate("SELECT 1", expected) == (True, "Pass")
+    assert validator.validate("SELECT 3", expected) == (False, "结果集不一致")
+
+
+def test_validate_many_matches_validate(validator):
+    pairs = [("SELECT code FROM stock", "SELECT code FROM stock ORDER BY code"),
+             ("SELECT name FROM stock", "SELECT code FROM stock"),
+             ("SELECT bad", "SELECT 1"),
+             ("SELECT 1", "SELECT DATE_FORMAT(NOW(), '%Y')")] * 5
+    assert validator.validate_many(pairs) == [validator.validate(*pair) for pair in pairs]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+用例预期的编译与加载
+
+覆盖分隔符 / 大小写的标准化、strict 模式下的格式检查、
+以及 load 对未编译或版本过期数据的回退 (与按文本校验的结果一致)。
+
+运行: python -m pytest backend/test_expectations.py  或  python backend/test_expectations.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.core.expectations import Expectations, ExpectationError, EXPECTATIONS_VERSION, MAX_ITEM_LENGTH
+from backend.core.validator import Validator, BatchValidator
+
+
+def test_compile_splits_and_normalizes():
+    compiled = Expectations.compile("code，name; \n v ", "name = 'X'\nv > 1,")
+    assert compiled == {
+        "keywords": ["CODE", "NAME", "V"],
+        "conditions": [{"text": "NAME = 'X'", "match": "NAME = X"}, {"text": "V > 1", "match": "V > 1"}],
+    }
+    assert Expectations.compile(None, "  ") == {"keywords": [], "conditions": []}
+
+
+@pytest.mark.parametrize("keywords, conditions, message", [
+    ("x" * (MAX_ITEM_LENGTH + 1), None, "预期关键字过长"),
+    (None, "c" * (MAX_ITEM_LENGTH + 1), "预期条件过长"),
+    (None, "name = 'a, b'", "引号不成对"),
+    (None, "''", "去掉引号后为空"),
+])
+def test_strict_compile_rejects_malformed(keywords, conditions, message):
+    with pytest.raises(ExpectationError, match=message):
+        Expectations.compile(keywords, conditions)
+    with pytest.raises(ExpectationError):
+        Expectations.columns(keywords, conditions)
+
+
+def test_lenient_compile_matches_text_validation():
+    # 存量数据不做格式检查, 判定结果与按文本校验一致
+    keywords, conditions = "code", "name = 'a, b'"
+    compiled = Expectations.compile(keywords, conditions, strict=False)
+    sql = "SELECT code FROM t WHERE name = 'a, b'"
+    assert BatchValidator([compiled]).validate(0, sql) == Validator.validate(sql, keywords, conditions)
+
+
+def test_columns_store_current_version():
+    columns = Expectations.columns("a", "b = 1")
+    assert columns["expectations_version"] == EXPECTATIONS_VERSION
+    assert columns["compiled_expectations"] == Expectations.compile("a", "b = 1")
+
+
+def test_load_uses_stored_result_only_for_current_version():
+    stored = {"keywords": ["STORED"], "conditions": []}
+    assert Expectations.load(stored, EXPECTATIONS_VERSION, "a", None) is stored
+    # 未编译或旧版本: 按当前文本重新编译 (不因格式错误失败)
+    assert Expectations.load(None, None, "a", "x = 'y") == Expectations.compile("a", "x = 'y", strict=False)
+    assert Expectations.load(stored, EXPECTATIONS_VERSION - 1, "a", None)["keywords"] == ["A"]
+
+
+def test_flatten():
+    keywords, conditions = Expectations.flatten(Expectations.compile("a, b", "c = 'd'"))
+    assert keywords == ["A", "B"]
+    assert conditions == [("C = 'D'", "C = D")]
+    assert Expectations.flatten({}) == ([], [])
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
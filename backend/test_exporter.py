@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+流式导出
+
+CSV (带 BOM, Excel 可识别中文) / NDJSON / Parquet 三种格式导出相同的内容,
+跨多个分块时行数与顺序不变; 历史记录的 SQL 正文从 sql_texts 取回。
+
+运行: python -m pytest backend/test_exporter.py  或  python backend/test_exporter.py
+"""
+import io
+import os
+import csv
+import sys
+import json
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.app import exporter
+from backend.app.exporter import StreamExporter, CASE_COLUMNS, HISTORY_COLUMNS
+from backend.app.models import SessionLocal, TestBatch, TestCase, TestHistory, SqlText
+
+CASE_COUNT = 7
+
+
+@pytest.fixture
+def cases(temp_db, monkeypatch):
+    # 分块小于行数, 覆盖多块输出
+    monkeypatch.setattr(exporter, "EXPORT_CHUNK_SIZE", 3)
+    db = SessionLocal()
+    try:
+        db.add_all(TestCase(question=f"问题 {i}, \"引号\"\n换行", expected_keywords=f"K{i}",
+                            is_active=i % 2 == 0, created_at=datetime(2024, 1, 1, 8, 0, i))
+                   for i in range(CASE_COUNT))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _export(fmt, columns=CASE_COLUMNS, stmt=None) -> bytes:
+    stmt = stmt if stmt is not None else StreamExporter.cases_statement([])
+    return b"".join(StreamExporter.stream(stmt, columns, fmt))
+
+
+def test_csv_has_bom_and_round_trips(cases):
+    data = _export("csv")
+    assert data.startswith(b"\xef\xbb\xbf")
+    rows = list(csv.DictReader(io.StringIO(data.decode("utf-8-sig"))))
+    assert list(rows[0]) == [name for name, _, _ in CASE_COLUMNS]
+    assert [row["question"] for row in rows] == [f"问题 {i}, \"引号\"\n换行" for i in range(CASE_COUNT)]
+    assert rows[1]["is_active"] == "False"
+
+
+def test_ndjson_one_object_per_row(cases):
+    lines = _export("ndjson").decode("utf-8").splitlines()
+    assert len(lines) == CASE_COUNT
+    first = json.loads(lines[0])
+    assert first["expected_keywords"] == "K0"
+    assert first["is_active"] is True
+    assert first["created_at"] == "2024-01-01T08:00:00"
+
+
+def test_parquet_matches_rows(cases):
+    pq = pytest.importorskip("pyarrow.parquet")
+    table = pq.read_table(io.BytesIO(_export("parquet")))
+    assert table.column_names == [name for name, _, _ in CASE_COLUMNS]
+    assert table.num_rows == CASE_COUNT
+    assert table.column("expected_keywords").to_pylist() == [f"K{i}" for i in range(CASE_COUNT)]
+    assert table.column("created_at").to_pylist()[2] == datetime(2024, 1, 1, 8, 0, 2)
+
+
+def test_empty_result(temp_db):
+    assert _export("csv").decode("utf-8-sig").strip() == ",".join(name for name, _, _ in CASE_COLUMNS)
+    assert _export("ndjson") == b""
+
+
+def test_history_sql_from_sql_texts(temp_db):
+    db = SessionLocal()
+    try:
+        db.add(TestBatch(id="b1"))
+        db.add(SqlText(hash="h1", sql="SELECT 1"))
+        db.add_all([
+            TestHistory(batch_id="b1", question="new", sql_hash="h1", result="PASS"),
+            TestHistory(batch_id="b1", question="legacy", actual_sql="SELECT 2", result="FAIL"),
+        ])
+        db.commit()
+    finally:
+        db.close()
+    stmt = StreamExporter.history_statement([TestHistory.batch_id == "b1"])
+    rows = [json.loads(line) for line in _export("ndjson", HISTORY_COLUMNS, stmt).splitlines()]
+    assert [(r["question"], r["actual_sql"]) for r in rows] == [("new", "SELECT 1"), ("legacy", "SELECT 2")]
+
+
+def test_unknown_format_is_rejected(temp_db):
+    with pytest.raises(ValueError):
+        StreamExporter.stream(StreamExporter.cases_statement([]), CASE_COLUMNS, "xml")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
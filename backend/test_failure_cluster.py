@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+失败聚类
+
+SQL 形状 / 缺失模式的提取; 同一种失败模式 (只是股票、日期等常量不同) 归为一组,
+不同模式不合并; 分组覆盖全部结果且互不重叠, 按大小降序编号。
+
+运行: python -m pytest backend/test_failure_cluster.py  或  python backend/test_failure_cluster.py
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.core.failure_cluster import FailureClusterer
+
+STOCKS = ["贵州茅台", "平安银行", "招商银行", "五粮液", "宁德时代", "比亚迪", "中国平安", "万科A"]
+
+
+def _result(case_id, sql, message):
+    return {"case_id": case_id, "question": f"q{case_id}", "actual_sql": sql, "message": message}
+
+
+def _results():
+    results = []
+    for i, stock in enumerate(STOCKS):
+        # 模式 1: 漏了排序
+        results.append(_result(i, f"SELECT code, price FROM stock WHERE name = '{stock}' LIMIT {i + 1}",
+                               "缺关键字: ORDER"))
+        # 模式 2: 年份条件写错, 同时缺两个条件
+        results.append(_result(100 + i, f"SELECT SUM(dividend) FROM dividend WHERE name = '{stock}' AND year = 20{10 + i}",
+                               f"缺条件: YEAR = {2020 + i}, REPORT_TYPE = 1"))
+    results.append(_result(200, "Error: HTTP 500", "Error: HTTP 500"))
+    return results
+
+
+def test_sql_shape_replaces_literals():
+    assert FailureClusterer.sql_shape("select a from t where b = 'x' and c > 1.5") == \
+        ["SELECT", "A", "FROM", "T", "WHERE", "B", "=", "?", "AND", "C", ">", "?"]
+    assert FailureClusterer.sql_shape("Error: timeout after 30s") == ["Error: timeout after #s"]
+    assert FailureClusterer.sql_shape("") == [""]
+
+
+def test_missing_items():
+    assert FailureClusterer.missing_items("缺关键字: A,B; 缺条件: X=1") == ["缺关键字:A", "缺关键字:B", "缺条件:X=#"]
+    assert FailureClusterer.missing_items("Error: HTTP 502") == ["Error: HTTP #"]
+    assert FailureClusterer.missing_items("") == [""]
+
+
+def test_same_failure_mode_is_grouped():
+    clusters = FailureClusterer.cluster(_results())
+    assert [c["size"] for c in clusters] == [8, 8, 1]
+    assert [c["cluster_id"] for c in clusters] == [1, 2, 3]
+    assert clusters[0]["case_ids"] == list(range(8))
+    assert clusters[0]["common_missing"] == ["缺关键字:ORDER"]
+    assert clusters[1]["case_ids"] == list(range(100, 108))
+    assert sorted(clusters[1]["common_missing"]) == ["缺条件:REPORT_TYPE = #", "缺条件:YEAR = #"]
+    assert clusters[1]["pattern"] == "缺条件: YEAR = #, REPORT_TYPE = #"
+    assert clusters[2]["case_ids"] == [200]
+
+
+def test_examples_limit():
+    clusters = FailureClusterer.cluster(_results(), examples=2)
+    assert [len(c["examples"]) for c in clusters] == [2, 2, 1]
+    assert set(clusters[0]["examples"][0]) == {"case_id", "question", "actual_sql", "message"}
+
+
+def test_threshold_one_keeps_only_identical_modes():
+    results = _results() + [_result(300, "SELECT code, price, name FROM stock WHERE name = 'x' LIMIT 1",
+                                    "缺关键字: ORDER")]
+    assert len(FailureClusterer.cluster(results, threshold=0.5)) == 3
+    assert len(FailureClusterer.cluster(results, threshold=1.0)) == 4
+
+
+def test_clusters_partition_random_results():
+    rng = random.Random(5)
+    columns = ["a", "b", "c", "d"]
+    results = []
+    for i in range(500):
+        cols = ", ".join(rng.sample(columns, rng.randint(1, 3)))
+        sql = f"SELECT {cols} FROM t{rng.randint(0, 3)} WHERE x = {rng.randint(0, 9)}"
+        message = "缺关键字: " + ",".join(rng.sample(["A", "B", "ORDER", "LIMIT"], rng.randint(1, 2)))
+        results.append(_result(i, sql, message))
+    clusters = FailureClusterer.cluster(results)
+    case_ids = sorted(cid for c in clusters for cid in c["case_ids"])
+    assert case_ids == list(range(500))
+    sizes = [c["size"] for c in clusters]
+    assert sizes == sorted(sizes, reverse=True) and sum(sizes) == 500
+    # 形状和缺失项完全相同的结果必在同一组
+    group_of = {cid: c["cluster_id"] for c in clusters for cid in c["case_ids"]}
+    by_key = {}
+    for r in results:
+        key = (tuple(FailureClusterer.sql_shape(r["actual_sql"])), tuple(sorted(FailureClusterer.missing_items(r["message"]))))
+        by_key.setdefault(key, set()).add(group_of[r["case_id"]])
+    assert all(len(groups) == 1 for groups in by_key.values())
+
+
+def test_empty():
+    assert FailureClusterer.cluster([]) == []
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
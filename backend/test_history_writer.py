@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+历史记录写后缓冲
+
+一次刷新写入历史行、SQL 正文 (去重)、批次计数和用例最近一次结果; 某个批次的行无法写入时
+其他批次照常落库, 失败批次连续失败 MAX_RETRIES 次后转存到 SPILL_DIR, 失败次数按批次分别统计。
+
+运行: python -m pytest backend/test_history_writer.py  或  python backend/test_history_writer.py
+"""
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.app import history_writer as history_writer_module
+from backend.app.history_writer import HistoryWriter
+from backend.app.models import SessionLocal, SqlText, TestBatch, TestCase, TestHistory
+
+START = datetime(2024, 1, 1, 9, 0, 0)
+
+
+@pytest.fixture
+def writer(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(history_writer_module, "SPILL_DIR", str(tmp_path / "spill"))
+    db = SessionLocal()
+    try:
+        db.add_all([TestCase(id=1, question="q1"), TestCase(id=2, question="q2")])
+        db.add_all([TestBatch(id="good"), TestBatch(id="bad"), TestBatch(id="other")])
+        db.commit()
+    finally:
+        db.close()
+    writer = HistoryWriter(max_rows=1000, flush_interval=3600)
+    yield writer
+    writer._pending = []
+    writer.close()
+
+
+def _row(batch_id, case_id=1, actual_sql="SELECT 1", result="PASS", offset=0, **extra):
+    return {"batch_id": batch_id, "case_id": case_id, "question": f"q{case_id}", "actual_sql": actual_sql,
+            "result": result, "error_message": None, "duration": 0.5, "similarity": None,
+            "run_at": START + timedelta(seconds=offset), **extra}
+
+
+def _bad_row(batch_id="bad"):
+    # 无法绑定的参数值, 插入时报错
+    return _row(batch_id, question=object())
+
+
+def _query(fn):
+    db = SessionLocal()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+
+
+def _spill_files(directory):
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_flush_writes_rows_counters_and_sql_texts(writer):
+    flushed = []
+    writer.add_listener(flushed.append)
+    writer.add(TestHistory, _row("good", 1, "SELECT 1", "PASS", 0))
+    writer.add(TestHistory, _row("good", 2, "SELECT 1", "FAIL", 1))
+    writer.add(TestHistory, _row("good", 1, "Error: timeout", "FAIL", 2))
+    writer.add(TestHistory, _row("other", 2, None, "FAIL", 3))
+    writer.flush()
+
+    assert flushed == [{"good", "other"}]
+    assert _query(lambda db: db.query(TestHistory).count()) == 4
+    assert _query(lambda db: [s.sql for s in db.query(SqlText).order_by(SqlText.sql)]) == ["Error: timeout", "SELECT 1"]
+    assert _query(lambda db: db.query(TestHistory).filter(TestHistory.actual_sql.isnot(None)).count()) == 0
+    good = _query(lambda db: db.get(TestBatch, "good"))
+    assert (good.completed_count, good.pass_count, good.fail_count, good.error_count, good.duration_sum) == (3, 1, 1, 1, 1.5)
+    other = _query(lambda db: db.get(TestBatch, "other"))
+    assert (other.completed_count, other.error_count) == (1, 1)
+    # 用例最近一次结果取 run_at 最新的一行
+    cases = _query(lambda db: {c.id: (c.last_result, c.last_run_at) for c in db.query(TestCase)})
+    assert cases == {1: ("FAIL", START + timedelta(seconds=2)), 2: ("FAIL", START + timedelta(seconds=3))}
+
+
+def test_add_flushes_when_buffer_is_full(writer):
+    writer.max_rows = 3
+    for i in range(3):
+        writer.add(TestHistory, _row("good", offset=i))
+    assert writer._pending == []
+    assert _query(lambda db: db.query(TestHistory).count()) == 3
+
+
+def test_bad_batch_does_not_block_other_batches(writer):
+    spill_dir = history_writer_module.SPILL_DIR
+    writer.add(TestHistory, _bad_row())
+    for attempt in range(HistoryWriter.MAX_RETRIES):
+        writer.add(TestHistory, _row("good", offset=attempt))
+        with pytest.raises(Exception):
+            writer.flush()
+        # 正常批次每次都写入, 失败批次的行放回缓冲, 直到转存
+        assert _query(lambda db: db.query(TestHistory).filter(TestHistory.batch_id == "good").count()) == attempt + 1
+        if attempt < HistoryWriter.MAX_RETRIES - 1:
+            assert [row["batch_id"] for _, row in writer._pending] == ["bad"]
+            assert _spill_files(spill_dir) == []
+
+    assert writer._pending == []
+    files = _spill_files(spill_dir)
+    assert len(files) == 1
+    with open(os.path.join(spill_dir, files[0]), encoding="utf-8") as f:
+        spilled = [json.loads(line) for line in f]
+    assert [(s["table"], s["row"]["batch_id"]) for s in spilled] == [("test_history", "bad")]
+    assert writer.pop_spilled("bad") is True
+    assert writer.pop_spilled("bad") is False
+    assert writer.pop_spilled("good") is False
+
+    good = _query(lambda db: db.get(TestBatch, "good"))
+    assert good.completed_count == HistoryWriter.MAX_RETRIES
+    assert _query(lambda db: db.get(TestBatch, "bad").completed_count) == 0
+
+
+def test_failures_are_counted_per_batch(writer):
+    writer.add(TestHistory, _bad_row("bad"))
+    for _ in range(HistoryWriter.MAX_RETRIES - 1):
+        with pytest.raises(Exception):
+            writer.flush()
+    # 另一个批次第一次失败, 不因 bad 批次的失败次数被提前转存
+    writer.add(TestHistory, _bad_row("other"))
+    with pytest.raises(Exception):
+        writer.flush()
+    assert [row["batch_id"] for _, row in writer._pending] == ["other"]
+    assert writer.pop_spilled("bad") is True
+    assert writer._failures == {"other": 1}
+
+
+def test_failure_count_resets_after_success(writer):
+    writer.add(TestHistory, _bad_row("bad"))
+    with pytest.raises(Exception):
+        writer.flush()
+    assert writer._failures == {"bad": 1}
+    # 修复数据后写入成功
+    writer._pending = [(TestHistory, _row("bad"))]
+    writer.flush()
+    assert writer._failures == {}
+    assert _query(lambda db: db.get(TestBatch, "bad").completed_count) == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
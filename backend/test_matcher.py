@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+多模式匹配与批量校验
+
+MultiPatternMatcher 与逐个 in 的结果一致 (含重叠、互为前缀 / 后缀的模式);
+BatchValidator (自动机路径和逐项 in 路径) 与 Validator.validate 的逐条判定一致。
+
+运行: python -m pytest backend/test_matcher.py  或  python backend/test_matcher.py
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.core.matcher import MultiPatternMatcher
+from backend.core.validator import Validator, BatchValidator
+
+# 随机生成预期 / SQL 用的片段: 含引号、全角逗号、分号、换行等分隔符和大小写
+FRAGMENTS = ["SELECT", "order by", "LIMIT 1", "'A'", '"B"', "X=1", "分红", "a", "  ", ",", "，", ";", "\n", "''", "Error"]
+
+
+def _brute_force(patterns, text):
+    return {p for p in patterns if p and p in text}
+
+
+def test_matcher_matches_brute_force():
+    rng = random.Random(1)
+    for _ in range(2000):
+        patterns = ["".join(rng.choice("abc") for _ in range(rng.randint(0, 4))) for _ in range(rng.randint(0, 8))]
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+        assert MultiPatternMatcher(patterns).find(text) == _brute_force(patterns, text), (patterns, text)
+
+
+def test_matcher_overlapping_patterns():
+    patterns = ["HE", "SHE", "HIS", "HERS", "S", "", "HE"]
+    matcher = MultiPatternMatcher(patterns)
+    assert len(matcher) == 5  # 空串和重复的模式不进入自动机
+    assert matcher.find("USHERS") == {"HE", "SHE", "HERS", "S"}
+    assert matcher.find("") == set()
+    assert MultiPatternMatcher([]).find("ANY") == set()
+
+
+def _random_items(rng, count):
+    def text(n):
+        return "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, n)))
+
+    items = []
+    for _ in range(count):
+        sql = " ".join(rng.choice(FRAGMENTS + ["\t", "\r\n"]) for _ in range(rng.randint(0, 10)))
+        keywords = text(5) if rng.random() > 0.1 else None
+        conditions = text(5) if rng.random() > 0.1 else None
+        items.append((sql, keywords, conditions))
+    return items
+
+
+@pytest.mark.parametrize("min_patterns", [1, BatchValidator.AUTOMATON_MIN_PATTERNS])
+def test_batch_validator_agrees_with_validate(monkeypatch, min_patterns):
+    # 阈值为 1 时每个用例都走自动机, 默认阈值下走逐项 in
+    monkeypatch.setattr(BatchValidator, "AUTOMATON_MIN_PATTERNS", min_patterns)
+    items = _random_items(random.Random(2), 3000)
+    # 同一条 SQL 多次出现, 覆盖标准化 / 扫描结果的复用
+    items += items[:200]
+    expected = [Validator.validate(*item) for item in items]
+    assert Validator.validate_batch(items) == expected
+
+
+def test_batch_validator_reports_missing_items_in_order(monkeypatch):
+    monkeypatch.setattr(BatchValidator, "AUTOMATON_MIN_PATTERNS", 1)
+    validator = BatchValidator.from_text([("code, name, missing_a", "v > 1, name = 'x', missing = 'y'")])
+    sql = "select code, name from t where v > 1 and name = 'x'"
+    assert validator.validate(0, sql) == (False, "缺关键字: MISSING_A; 缺条件: MISSING = 'Y'")
+    assert validator.validate(0, sql) == Validator.validate(sql, "code, name, missing_a", "v > 1, name = 'x', missing = 'y'")
+    assert validator.validate(0, "Error: timeout") == (False, "Error: timeout")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
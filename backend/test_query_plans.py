@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询的执行计划检查
+
+在临时 SQLite 库上执行迁移, 用 EXPLAIN QUERY PLAN 确认 runner / 报告 / 用例页面的
+过滤与排序都命中了迁移创建的索引, 而不是全表扫描。
+
+运行: python -m pytest backend/test_query_plans.py  或  python backend/test_query_plans.py
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect, text
+
+from backend.app.models import Base
+from backend.app.migrations import run_migrations, explain_query_plan
+
+HOT_QUERIES = [
+    # (说明, SQL, 期望命中的索引)
+    ("用例最近一次结果",
+     "SELECT result FROM test_history WHERE case_id = 1 ORDER BY run_at DESC LIMIT 1",
+     "ix_test_history_case_run_at"),
+    ("批次内按结果统计",
+     "SELECT result, COUNT(*) FROM test_history WHERE batch_id = 'b' GROUP BY result",
+     "ix_test_history_batch_result"),
+    ("运行中批次",
+     "SELECT id FROM test_batches WHERE status = 'RUNNING' ORDER BY start_time DESC",
+     "ix_test_batches_status_start"),
+    ("报告列表",
+     "SELECT id FROM test_batches ORDER BY start_time DESC, id DESC LIMIT 50",
+     "ix_test_batches_start_id"),
+    ("按分类筛选启用用例",
+     "SELECT id FROM test_cases WHERE is_active = 1 AND category = 'valuation'",
+     "ix_test_cases_active_category"),
+    ("按最近结果筛选用例 (游标翻页)",
+     "SELECT id FROM test_cases WHERE last_result = 'FAIL' AND id > 100 ORDER BY id LIMIT 50",
+     "ix_test_cases_last_result"),
+]
+
+
+def _legacy_engine(path):
+    """模拟升级前的库: 只有 create_all 建出来的旧结构 (无复合索引)"""
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE test_history (id INTEGER PRIMARY KEY, batch_id VARCHAR, case_id INTEGER, "
+            "question TEXT, actual_sql TEXT, result VARCHAR, error_message TEXT, run_at DATETIME)"
+        ))
+        conn.execute(text("CREATE INDEX ix_test_history_batch_id ON test_history (batch_id)"))
+    return engine
+
+
+def test_hot_queries_use_indexes():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _legacy_engine(os.path.join(tmp, "legacy.db"))
+        run_migrations(engine)
+        with engine.connect() as conn:
+            for desc, sql, index_name in HOT_QUERIES:
+                plan = " | ".join(explain_query_plan(conn, sql))
+                assert index_name in plan, f"{desc}: {plan}"
+        engine.dispose()
+
+
+def test_migrations_are_idempotent():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'fresh.db')}")
+        Base.metadata.create_all(engine)
+        run_migrations(engine)
+        run_migrations(engine)
+        with engine.connect() as conn:
+            versions = conn.execute(text("SELECT COUNT(*) FROM schema_migrations")).scalar()
+        assert versions >= 1
+        engine.dispose()
+
+
+def test_sql_texts_backfill_dedups():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _legacy_engine(os.path.join(tmp, "legacy.db"))
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO test_history (case_id, actual_sql, result) VALUES "
+                "(1, 'SELECT a\n  FROM t', 'PASS'), (1, 'SELECT a FROM t', 'PASS'), (2, '', 'FAIL')"
+            ))
+        run_migrations(engine)
+        with engine.connect() as conn:
+            hashes = [r[0] for r in conn.execute(text("SELECT sql_hash FROM test_history ORDER BY id"))]
+            texts = conn.execute(text("SELECT COUNT(*) FROM sql_texts")).scalar()
+            leftover = conn.execute(text("SELECT COUNT(*) FROM test_history WHERE actual_sql IS NOT NULL")).scalar()
+        assert hashes[0] == hashes[1] and hashes[2] is None
+        assert texts == 1 and leftover == 0
+        engine.dispose()
+
+
+def test_sql_texts_keep_literal_whitespace():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _legacy_engine(os.path.join(tmp, "legacy.db"))
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO test_history (case_id, actual_sql, result) VALUES "
+                "(1, 'SELECT a FROM t WHERE n = ''A  B''', 'FAIL'), (1, 'SELECT a FROM t WHERE n = ''A B''', 'PASS')"
+            ))
+        run_migrations(engine)
+        with engine.connect() as conn:
+            texts = [r[0] for r in conn.execute(text("SELECT sql FROM sql_texts ORDER BY sql"))]
+        assert texts == ["SELECT a FROM t WHERE n = 'A  B'", "SELECT a FROM t WHERE n = 'A B'"]
+        engine.dispose()
+
+
+def test_superseded_indexes_are_dropped():
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = _legacy_engine(os.path.join(tmp, "legacy.db"))
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE test_batches (id VARCHAR PRIMARY KEY, start_time DATETIME, status VARCHAR)"))
+            conn.execute(text("CREATE INDEX ix_test_batches_start_time ON test_batches (start_time)"))
+        run_migrations(engine)
+        with engine.connect() as conn:
+            indexes = {idx["name"] for idx in inspect(conn).get_indexes("test_batches")}
+        assert "ix_test_batches_start_time" not in indexes
+        assert "ix_test_batches_start_id" in indexes
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    test_hot_queries_use_indexes()
+    test_migrations_are_idempotent()
+    test_sql_texts_backfill_dedups()
+    test_sql_texts_keep_literal_whitespace()
+    test_superseded_indexes_are_dropped()
+    print("OK")
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+报告文件缓存
+
+已结束的批次: 首次导出生成并缓存, 之后复用同一文件; ETag / If-None-Match 返回 304;
+Range 请求返回 206; 用例修改后 key 变化、旧文件被替换。运行中的批次不缓存、发送后删除临时文件。
+超过容量时按最近使用时间淘汰 (宽限期内的文件保留)。
+
+运行: python -m pytest backend/test_report_cache.py  或  python backend/test_report_cache.py
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.models import SessionLocal, TestBatch, TestCase, TestHistory
+from backend.app.report_cache import ReportCache, report_cache, EVICTION_GRACE_SECONDS
+from backend.app.routers import reports
+
+
+@pytest.fixture
+def client(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(report_cache, "directory", str(tmp_path / "report_cache"))
+    db = SessionLocal()
+    try:
+        case = TestCase(question="茅台的市值", expected_keywords="MARKET_VALUE")
+        db.add(case)
+        db.add(TestBatch(id="done", status="COMPLETED", end_time=datetime(2024, 1, 1), completed_count=20))
+        db.add(TestBatch(id="running", status="RUNNING"))
+        db.add(TestBatch(id="empty", status="COMPLETED"))
+        db.flush()
+        for batch_id in ("done", "running"):
+            db.add_all(TestHistory(batch_id=batch_id, case_id=case.id, question=case.question,
+                                   actual_sql=f"SELECT {i}", result="PASS" if i % 2 else "FAIL")
+                       for i in range(20))
+        db.commit()
+    finally:
+        db.close()
+    app = FastAPI()
+    app.include_router(reports.router)
+    with TestClient(app) as client:
+        yield client
+
+
+def _cached_files():
+    return sorted(os.listdir(report_cache.directory))
+
+
+def test_completed_batch_is_cached_with_etag(client):
+    first = client.get("/reports/done/export")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    files = _cached_files()
+    assert len(files) == 1 and files[0].startswith("done-")
+    mtime = os.stat(os.path.join(report_cache.directory, files[0])).st_mtime_ns
+
+    second = client.get("/reports/done/export")
+    assert second.headers["etag"] == etag
+    assert second.content == first.content
+    assert _cached_files() == files
+    # 命中时刷新 mtime (LRU)
+    assert os.stat(os.path.join(report_cache.directory, files[0])).st_mtime_ns >= mtime
+
+    not_modified = client.get("/reports/done/export", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.content == b""
+
+
+def test_range_request(client):
+    full = client.get("/reports/done/export").content
+    partial = client.get("/reports/done/export", headers={"Range": "bytes=0-99"})
+    assert partial.status_code == 206
+    assert partial.content == full[:100]
+    assert partial.headers["content-range"] == f"bytes 0-99/{len(full)}"
+
+
+def test_case_change_replaces_cached_report(client):
+    etag = client.get("/reports/done/export").headers["etag"]
+    db = SessionLocal()
+    try:
+        db.query(TestCase).update({TestCase.expected_keywords: "MARKET_VALUE,CODE", TestCase.updated_at: datetime.now()})
+        db.commit()
+    finally:
+        db.close()
+    response = client.get("/reports/done/export", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert len(_cached_files()) == 1
+
+
+def test_running_batch_is_not_cached(client):
+    response = client.get("/reports/running/export")
+    assert response.status_code == 200
+    # 临时文件在响应发送后删除
+    assert _cached_files() == []
+
+
+def test_batch_without_results(client):
+    assert client.get("/reports/empty/export").status_code == 400
+    assert client.get("/reports/missing/export").status_code == 404
+    assert _cached_files() == []
+
+
+def test_eviction_by_last_use(tmp_path):
+    cache = ReportCache(str(tmp_path), max_bytes=250)
+    old = time.time() - EVICTION_GRACE_SECONDS - 100
+    for i, name in enumerate(["a-1.xlsx", "b-1.xlsx", "c-1.xlsx"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (old + i, old + i))
+    (tmp_path / "d-1.xlsx").write_bytes(b"x" * 100)  # 刚使用过, 在宽限期内
+    stale_tmp = tmp_path / "a-1.xlsx.1.abc.tmp"
+    stale_tmp.write_bytes(b"x")
+    os.utime(stale_tmp, (0, 0))
+
+    cache.evict()
+    assert sorted(os.listdir(tmp_path)) == ["c-1.xlsx", "d-1.xlsx"]
+
+    cache.invalidate("c")
+    assert os.listdir(tmp_path) == ["d-1.xlsx"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Excel 报告
+
+write_report 从生成器流式写出, openpyxl 可以读回: 表头、逐行内容、控制字符被去掉、
+测试结果列的通过 / 失败样式, 以及返回的统计; generate_report 按 Index 排序。
+
+运行: python -m pytest backend/test_reporter.py  或  python backend/test_reporter.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from openpyxl import load_workbook
+
+from backend.core.reporter import Reporter, REPORT_COLUMNS
+
+
+def _rows(count):
+    for i in range(count):
+        yield {
+            "Index": i + 1,
+            "问题": f"问题 {i}\x07",
+            "预期关键字": "CODE",
+            "预期条件": None,
+            "实际生成的SQL": f"SELECT code FROM t WHERE id = {i}",
+            "测试结果": "通过" if i % 3 else "失败",
+            "备注": "" if i % 3 else "缺关键字: CODE",
+        }
+
+
+def test_streamed_report_reads_back(tmp_path):
+    path = str(tmp_path / "reports" / "report.xlsx")
+    stats = Reporter.write_report(_rows(300), path)
+    assert stats == {"total": 300, "passed": 200, "failed": 100, "pass_rate": "66.67%"}
+
+    sheet = load_workbook(path)["测试报告"]
+    rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0] == tuple(REPORT_COLUMNS)
+    assert len(rows) == 301
+    assert rows[1] == (1, "问题 0", "CODE", None, "SELECT code FROM t WHERE id = 0", "失败", "缺关键字: CODE")
+    assert rows[300][0] == 300
+
+    header, passed, failed = sheet["A1"], sheet["F3"], sheet["F2"]
+    assert header.font.bold and header.style == "report_header"
+    assert passed.style == "report_pass" and passed.fill.start_color.rgb.endswith("C6EFCE")
+    assert failed.style == "report_fail" and failed.fill.start_color.rgb.endswith("FFC7CE")
+    assert sheet["B2"].style == "report_cell" and sheet["B2"].alignment.wrap_text
+    assert sheet.column_dimensions["E"].width == REPORT_COLUMNS["实际生成的SQL"]
+
+
+def test_empty_report(tmp_path):
+    path = str(tmp_path / "empty.xlsx")
+    assert Reporter.write_report(iter(()), path)["total"] == 0
+    assert list(load_workbook(path)["测试报告"].iter_rows(values_only=True)) == [tuple(REPORT_COLUMNS)]
+
+
+def test_generate_report_sorts_by_index(tmp_path):
+    reporter = Reporter()
+    for row in reversed(list(_rows(5))):
+        reporter.add_result(row)
+    reporter.add_result({"Index": 6, "问题": "额外列", "测试结果": "通过", "相似度": 0.5})
+    path = reporter.generate_report(str(tmp_path / "r.xlsx"))
+
+    rows = list(load_workbook(path)["测试报告"].iter_rows(values_only=True))
+    assert rows[0][-1] == "相似度"
+    assert [row[0] for row in rows[1:]] == [1, 2, 3, 4, 5, 6]
+    assert rows[6][-1] == 0.5
+    assert reporter.get_statistics()["passed"] == 4
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
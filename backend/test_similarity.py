@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+相似度分数
+
+MinHash 估计值接近精确的 Jaccard 系数, 分块计算签名不改变结果;
+score_batch 对报错 / 无预期 / 仅有关键字等情况的取值, 以及与逐条计算一致。
+
+运行: python -m pytest backend/test_similarity.py  或  python backend/test_similarity.py
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+from backend.core import similarity
+from backend.core.expectations import Expectations
+from backend.core.similarity import MinHasher, SimilarityScorer, hash_items, minhasher, shingles
+
+
+def _exact_jaccard(left, right):
+    left, right = set(left.tolist()), set(right.tolist())
+    return len(left & right) / len(left | right)
+
+
+def test_minhash_estimates_jaccard():
+    rng = random.Random(3)
+    hasher = MinHasher(num_perm=256)
+    errors = []
+    for _ in range(200):
+        common = [f"t{rng.randint(0, 10 ** 6)}" for _ in range(rng.randint(0, 40))]
+        left = hash_items(common + [f"l{i}" for i in range(rng.randint(1, 40))])
+        right = hash_items(common + [f"r{i}" for i in range(rng.randint(1, 40))])
+        estimate = MinHasher.jaccard(*hasher.signatures([left, right])[:, None])[0]
+        errors.append(abs(estimate - _exact_jaccard(left, right)))
+    # 单次估计的标准差约为 1/sqrt(256)
+    assert np.mean(errors) < 0.04
+    assert max(errors) < 0.2
+
+
+def test_signatures_independent_of_chunking(monkeypatch):
+    sets = [shingles(f"SELECT a{i} FROM t WHERE b = {i % 7}") for i in range(25)] + [hash_items([])]
+    full = minhasher.signatures(sets)
+    monkeypatch.setattr(similarity, "SIGNATURE_CHUNK", 4)
+    assert np.array_equal(minhasher.signatures(sets), full)
+    assert (full[-1] == np.iinfo(np.uint32).max).all()  # 空集合
+
+
+def test_shingles_ignore_case_and_whitespace():
+    assert np.array_equal(np.sort(shingles("select a\n from  t")), np.sort(shingles("SELECT A FROM T")))
+
+
+def test_score_batch_cases():
+    compiled = Expectations.compile("CODE, NAME", "PRICE > 10")
+    none = Expectations.compile(None, None)
+    expected = "SELECT code, name FROM stock WHERE price > 10"
+    scores = SimilarityScorer.score_batch(
+        [expected, "Error: timeout", "", "SELECT code FROM stock", "SELECT code FROM stock", "SELECT 1"],
+        [expected, expected, expected, None, None, None],
+        [compiled, compiled, compiled, compiled, none, none],
+    )
+    assert scores[0] == 1.0
+    assert scores[1:3] == [0.0, 0.0]
+    assert scores[3] == round(1 / 3, 4)  # 只有预期覆盖率: 3 项中出现 1 项
+    assert scores[4] is None and scores[5] is None
+
+
+def test_score_orders_near_misses_above_unrelated_sql():
+    expected = "SELECT code, name FROM stock WHERE price > 10 ORDER BY price DESC LIMIT 5"
+    near = "SELECT code, name FROM stock WHERE price > 10 ORDER BY price ASC LIMIT 5"
+    unrelated = "SELECT count(*) FROM fund"
+    none = Expectations.compile(None, None)
+    near_score, unrelated_score = SimilarityScorer.score_batch([near, unrelated], [expected] * 2, [none] * 2)
+    assert near_score > 0.6 > unrelated_score
+
+
+def test_batch_equals_per_item():
+    rng = random.Random(4)
+    words = ["SELECT", "a", "b", "FROM", "t", "WHERE", "a = 1", "ORDER BY b", "LIMIT 3"]
+    actual = [" ".join(rng.choice(words) for _ in range(rng.randint(0, 8))) for _ in range(60)]
+    expected = [rng.choice([None, "SELECT a FROM t", "SELECT b FROM t WHERE a = 1"]) for _ in actual]
+    compiled = [Expectations.compile(rng.choice([None, "A", "A, B"]), None) for _ in actual]
+    batch = SimilarityScorer.score_batch(actual, expected, compiled)
+    single = [SimilarityScorer.score_batch([a], [e], [c])[0] for a, e, c in zip(actual, expected, compiled)]
+    assert batch == single
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+SQL 结构指纹的解析与比较
+
+覆盖 structure 校验依赖的标准化规则: 大小写 / 空白 / 别名无关, 条件与书写顺序无关,
+多表时列引用按表区分 (含自连接和相关子查询), 不支持的语句抛出 SqlParseError。
+
+运行: python -m pytest backend/test_sql_fingerprint.py  或  python backend/test_sql_fingerprint.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from backend.core.sql_fingerprint import SqlFingerprint, SqlParseError, FingerprintCache, tokenize
+
+
+def _diff(expected: str, actual: str):
+    return SqlFingerprint.parse(expected).diff(SqlFingerprint.parse(actual))
+
+
+def test_tokenize_normalizes_case_and_keeps_literals():
+    tokens = tokenize("select `Code`, 'Ab  c' from t -- note\n where v >= 1.50;")
+    assert [t.value for t in tokens] == ["SELECT", "CODE", ",", "'Ab  c'", "FROM", "T", "WHERE", "V", ">=", "1.5"]
+
+
+def test_equivalent_formatting_matches():
+    assert _diff(
+        "SELECT code, name FROM A_SHARE WHERE v > 1 AND code = 'x' ORDER BY v DESC LIMIT 10",
+        "select NAME, Code\nfrom a_share as s\nwhere 'x' = s.code and 1 < s.v order by s.v desc limit 10",
+    ) == []
+
+
+def test_or_branches_and_in_lists_are_sorted():
+    assert _diff(
+        "SELECT a FROM t WHERE (b = 1 OR c = 2) AND d IN ('y', 'x')",
+        "SELECT a FROM t WHERE d IN ('x', 'y') AND (c = 2 OR b = 1)",
+    ) == []
+
+
+def test_order_by_alias_and_position_resolve_to_expression():
+    expected = SqlFingerprint.parse("SELECT code, SUM(v) AS total FROM t GROUP BY code ORDER BY total DESC")
+    by_position = SqlFingerprint.parse("SELECT code, SUM(v) FROM t GROUP BY 1 ORDER BY SUM(v) DESC")
+    assert expected.order_by == ("SUM(V) DESC",)
+    assert expected.diff(by_position) == []
+
+
+def test_mysql_limit_offset():
+    fingerprint = SqlFingerprint.parse("SELECT a FROM t LIMIT 20, 10")
+    assert (fingerprint.limit, fingerprint.offset) == (10, 20)
+    assert _diff("SELECT a FROM t LIMIT 10 OFFSET 20", "SELECT a FROM t LIMIT 20, 10") == []
+
+
+def test_missing_condition_is_reported():
+    problems = _diff("SELECT a FROM t WHERE b = 1 AND c = 2", "SELECT a FROM t WHERE b = 1")
+    assert problems == ["缺条件: 2 = C"]
+
+
+def test_join_qualifiers_resolve_to_tables():
+    expected = "SELECT a.x FROM t a JOIN u b ON a.code = b.code WHERE a.v > 1"
+    # 别名不同但引用的表相同
+    assert _diff(expected, "SELECT m.x FROM t m JOIN u n ON n.code = m.code WHERE 1 < m.v") == []
+    # 过滤条件作用在另一张表上
+    assert _diff(expected, "SELECT a.x FROM t a JOIN u b ON a.code = b.code WHERE b.v > 1") == [
+        "缺条件: 1 < T.V", "多条件: 1 < U.V"
+    ]
+    assert "T.CODE = U.CODE" in SqlFingerprint.parse(expected).predicates
+
+
+def test_self_join_distinguishes_instances():
+    problems = _diff("SELECT * FROM t t1, t t2 WHERE t1.a = t2.b", "SELECT * FROM t t1, t t2 WHERE t1.b = t2.a")
+    assert problems == ["缺条件: T#1.A = T#2.B", "多条件: T#1.B = T#2.A"]
+
+
+def test_correlated_subquery_keeps_outer_qualifier():
+    fingerprint = SqlFingerprint.parse("SELECT o.x FROM t o WHERE o.k IN (SELECT u.k FROM u WHERE u.code = o.code)")
+    assert fingerprint.predicates == frozenset({"K IN (SELECT K FROM U WHERE CODE = T.CODE)"})
+
+
+def test_schema_qualified_names():
+    fingerprint = SqlFingerprint.parse("SELECT db.t.x, db.upper(y) FROM db.t")
+    assert fingerprint.tables == frozenset({"T"})
+    assert fingerprint.columns == ("UPPER(Y)", "X")
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    "UPDATE t SET a = 1",
+    "SELECT a FROM t UNION SELECT a FROM u",
+    "SELECT a FROM t WHERE (b = 1",
+])
+def test_unsupported_sql_raises(sql):
+    with pytest.raises(SqlParseError):
+        SqlFingerprint.parse(sql)
+
+
+def test_cache_reuses_parse_results_and_errors():
+    cache = FingerprintCache(maxsize=2)
+    first = cache.get("SELECT a FROM t")
+    assert cache.get("SELECT a\n  FROM t") is first
+    for _ in range(2):
+        with pytest.raises(SqlParseError):
+            cache.get("DELETE FROM t")
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -19,63 +19,83 @@ const Runner: React.FC = () => {
   useEffect(() => {
     if (!activeBatchId || !isRunning) return;
 
-    // Connect WS
-    const host = window.location.host;
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    const wsUrl = `${protocol}//${host}/run/ws/${activeBatchId}`;
-    console.log("Connecting WS:", wsUrl);
-
-    const socket = new WebSocket(wsUrl);
-
-    socket.onopen = () => {
-      addLog(`已连接到实时日志流: ${activeBatchId}`, 'INFO');
-    };
+    // 最后收到的事件序号, 断线重连时通过 since 只补发缺失的事件
+    let lastSeq = 0;
+    let finished = false;
+    let socket: WebSocket | null = null;
+    let reconnectTimer: ReturnType<typeof setTimeout> | undefined;
+
+    const connect = () => {
+      const host = window.location.host;
+      const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+      const wsUrl = `${protocol}//${host}/run/ws/${activeBatchId}?since=${lastSeq}`;
+      console.log("Connecting WS:", wsUrl);
+
+      const ws = new WebSocket(wsUrl);
+      socket = ws;
+
+      ws.onopen = () => {
+        addLog(`已连接到实时日志流: ${activeBatchId}`, 'INFO');
+      };
+
+      ws.onmessage = (event) => {
+        try {
+          const msg = JSON.parse(event.data);
+          // Message types: init, running, update, batch_status, done
+          if (typeof msg.seq === 'number') {
+            if (msg.seq <= lastSeq) return;
+            lastSeq = msg.seq;
+          }
 
-    socket.onmessage = (event) => {
-      try {
-        const msg = JSON.parse(event.data);
-        // Message types: init, running, update, batch_status, done
-
-        if (msg.type === 'running') {
-          updateCaseStatus(msg.case_id, CaseStatus.RUNNING);
-        } else if (msg.type === 'update') {
-          // msg.result: { case_id, result: PASS/FAIL, message, ... }
-          // Map backend result to frontend status
-          const status = msg.result.result === 'PASS' ? CaseStatus.PASS : CaseStatus.FAIL;
-          updateCaseStatus(msg.case_id, status);
-          const logLvl = status === CaseStatus.PASS ? 'INFO' : 'ERROR';
-          addLog(`[${status}] #${msg.case_id}: ${msg.result.message || 'Done'}`, logLvl);
-        } else if (msg.type === 'batch_status') {
-          // msg.total, msg.completed
-          if (msg.total > 0) {
-            const p = Math.round((msg.completed / msg.total) * 100);
-            updateProgress(p);
+          if (msg.type === 'running') {
+            updateCaseStatus(msg.case_id, CaseStatus.RUNNING);
+          } else if (msg.type === 'update') {
+            // msg.result: { case_id, result: PASS/FAIL, message, ... }
+            // Map backend result to frontend status
+            const status = msg.result.result === 'PASS' ? CaseStatus.PASS : CaseStatus.FAIL;
+            updateCaseStatus(msg.case_id, status);
+            const logLvl = status === CaseStatus.PASS ? 'INFO' : 'ERROR';
+            addLog(`[${status}] #${msg.case_id}: ${msg.result.message || 'Done'}`, logLvl);
+          } else if (msg.type === 'batch_status') {
+            // msg.total, msg.completed
+            if (msg.total > 0) {
+              const p = Math.round((msg.completed / msg.total) * 100);
+              updateProgress(p);
+            }
+          } else if (msg.type === 'log') {
+            // Generic log
+            addLog(msg.message, msg.level || 'INFO');
+          } else if (msg.type === 'done') {
+            finished = true;
+            stopRun();
+            addLog("测试执行完成。", "INFO");
+            ws.close();
           }
-        } else if (msg.type === 'log') {
-          // Generic log
-          addLog(msg.message, msg.level || 'INFO');
-        } else if (msg.type === 'done') {
-          stopRun();
-          addLog("测试执行完成。", "INFO");
-          socket.close();
+
+        } catch (e) {
+          console.error("WS Parse Error", e);
         }
+      };
 
-      } catch (e) {
-        console.error("WS Parse Error", e);
-      }
-    };
+      ws.onerror = (e) => {
+        console.error("WS Error", e);
+        addLog("WebSocket 连接错误", "ERROR");
+      };
 
-    socket.onerror = (e) => {
-      console.error("WS Error", e);
-      addLog("WebSocket 连接错误", "ERROR");
+      ws.onclose = () => {
+        console.log("WS Closed");
+        if (!finished && socket === ws) {
+          reconnectTimer = setTimeout(connect, 1000);
+        }
+      };
     };
 
-    socket.onclose = () => {
-      console.log("WS Closed");
-    };
+    connect();
 
     return () => {
-      socket.close();
+      finished = true;
+      clearTimeout(reconnectTimer);
+      socket?.close();
     };
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [activeBatchId]);